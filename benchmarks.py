@@ -0,0 +1,1030 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import difflib
+import glob
+import re
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import waiver_wire_winner as www
+
+# ---------------------- Benchmarks for the Waiver Wire Winner pipeline ---------------------- #
+
+# Run with: python benchmarks.py [--output results.jsonl] <benchmark> [options]
+# Results are printed as JSON so they can be saved and compared between commits
+
+# ------------- Recorded fixture payloads ------------- #
+
+# record the full live feed and the trimmed boxscore payload for every game on a date so the
+# benchmarks can be replayed offline. Files are written as <game_pk>.full.json and <game_pk>.boxscore.json
+
+def record_fixtures(fixture_dir, date):
+    os.makedirs(fixture_dir, exist_ok=True)
+
+    client = www.MLBStatsAPIClient()
+    game_pks = www.get_days_previous_games(client, date)
+
+    for game_pk in game_pks:
+        full_response = client.session.get(f"{www.base_url}/v1.1/game/{game_pk}/feed/live", timeout=client.timeout)
+        boxscore_response = client.session.get(f"{www.base_url}/v1.1/game/{game_pk}/feed/live", params={"fields": ",".join(www.boxscore_fields)}, timeout=client.timeout)
+
+        with open(os.path.join(fixture_dir, f"{game_pk}.full.json"), "wb") as f:
+            f.write(full_response.content)
+        with open(os.path.join(fixture_dir, f"{game_pk}.boxscore.json"), "wb") as f:
+            f.write(boxscore_response.content)
+
+    return game_pks
+
+# apply the Stats API `fields` filter locally, used when only full feeds were recorded.
+# The keys of the players map are player ids (ID123456) so they are always kept
+
+def filter_fields(node, fields, keep_all_keys = False):
+    if isinstance(node, dict):
+        return {key: filter_fields(value, fields, keep_all_keys=(key == 'players')) for key, value in node.items() if keep_all_keys or key in fields}
+    if isinstance(node, list):
+        return [filter_fields(value, fields) for value in node]
+    return node
+
+def load_fixture_payloads(fixture_dir, variant):
+    payloads = {}
+
+    for file_name in sorted(os.listdir(fixture_dir)):
+        if not file_name.endswith(".full.json"):
+            continue
+
+        game_pk = int(file_name.split(".")[0])
+        variant_path = os.path.join(fixture_dir, f"{game_pk}.{variant}.json")
+
+        if os.path.exists(variant_path):
+            with open(variant_path, "rb") as f:
+                payloads[game_pk] = f.read()
+        else:
+            # derive the boxscore payload from the full feed
+            with open(os.path.join(fixture_dir, file_name), "rb") as f:
+                payloads[game_pk] = json.dumps(filter_fields(json.loads(f.read()), set(www.boxscore_fields))).encode()
+
+    return payloads
+
+# client stand-in that serves the recorded payloads instead of hitting the API
+
+class FixtureStatsAPIClient(www.MLBStatsAPIClient):
+
+    def __init__(self, payloads):
+        super().__init__()
+        self.payloads = payloads
+
+    def get_game(self, game_pk, timecode = None, hydrate = None, fields = None):
+        return json.loads(self.payloads[game_pk])
+
+# ------------- Benchmark: full feed vs boxscore-only payloads ------------- #
+
+# parse every payload in a directory, run in a separate process so that peak RSS is not shared between the
+# two variants. The payloads are read as they are, a variant that has to be derived is written out beforehand
+
+def _parse_payloads(payload_dir):
+    payloads = {}
+    for file_name in sorted(os.listdir(payload_dir)):
+        with open(os.path.join(payload_dir, file_name), "rb") as f:
+            payloads[file_name] = f.read()
+
+    baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for payload in payloads.values():
+        json.loads(payload)
+    parse_seconds = time.perf_counter() - start
+
+    return {
+        'games': len(payloads),
+        'bytes': sum(len(payload) for payload in payloads.values()),
+        'parse_seconds': round(parse_seconds, 4),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'baseline_rss_kb': baseline_rss_kb,
+    }
+
+def bench_boxscore(fixture_dir):
+    results = {}
+
+    # the boxscore payloads derived from full feeds are built here, so parsing the full feeds doesn't count
+    # towards the boxscore variant's peak RSS
+    with tempfile.TemporaryDirectory() as payload_root:
+        for variant in ['full', 'boxscore']:
+            payload_dir = os.path.join(payload_root, variant)
+            os.makedirs(payload_dir)
+            for game_pk, payload in load_fixture_payloads(fixture_dir, variant).items():
+                with open(os.path.join(payload_dir, f"{game_pk}.json"), "wb") as f:
+                    f.write(payload)
+
+            output = subprocess.run([sys.executable, __file__, "_parse", payload_dir], check=True, capture_output=True, text=True).stdout
+            results[variant] = json.loads(output)
+
+    # make sure that the trimmed payload scores exactly the same as the full feed
+
+    full_client = FixtureStatsAPIClient(load_fixture_payloads(fixture_dir, 'full'))
+    boxscore_client = FixtureStatsAPIClient(load_fixture_payloads(fixture_dir, 'boxscore'))
+    game_pks = sorted(full_client.payloads)
+
+    full_pitchers, full_batters = www.calculate_player_scoring(full_client, game_pks)
+    boxscore_pitchers, boxscore_batters = www.calculate_player_scoring(boxscore_client, game_pks)
+    results['identical_scoring'] = bool(full_pitchers.equals(boxscore_pitchers) and full_batters.equals(boxscore_batters))
+
+    return results
+
+# ------------- Synthetic boxscores ------------- #
+
+# one player's game, drawn at roughly realistic per-game rates. Regulars get a full game of plate
+# appearances and starters a full outing, everyone else a pinch hit or an inning or so
+
+def synthetic_batting(rng, regular = True):
+    plate_appearances = int(rng.integers(0, 6)) if regular else int(rng.integers(0, 2))
+    hits = int(rng.binomial(plate_appearances, 0.25))
+    doubles = int(rng.binomial(hits, 0.2))
+    home_runs = int(rng.binomial(hits - doubles, 0.15))
+
+    return {
+        'plateAppearances': plate_appearances, 'hits': hits, 'doubles': doubles, 'triples': int(rng.random() < 0.01) if hits > doubles + home_runs else 0,
+        'homeRuns': home_runs, 'baseOnBalls': int(rng.binomial(plate_appearances, 0.08)), 'runs': int(rng.binomial(plate_appearances, 0.12)),
+        'rbi': int(rng.binomial(plate_appearances, 0.12)), 'stolenBases': int(rng.random() < 0.05), 'strikeOuts': int(rng.binomial(plate_appearances, 0.22)),
+        'intentionalWalks': 0, 'hitByPitch': int(rng.random() < 0.02), 'sacBunts': 0, 'sacFlies': int(rng.random() < 0.02),
+        'caughtStealing': int(rng.random() < 0.01), 'groundIntoDoublePlay': int(rng.random() < 0.05),
+    }
+
+def synthetic_pitching(rng, starter = True):
+    outs = int(rng.integers(12, 22)) if starter else int(rng.integers(0, 5))
+
+    return {
+        'outs': outs, 'earnedRuns': int(rng.poisson(outs / 9)), 'wins': int(rng.random() < 0.1), 'losses': int(rng.random() < 0.1),
+        'saves': int(rng.random() < 0.05), 'blownSaves': int(rng.random() < 0.02), 'holds': int(rng.random() < 0.08),
+        'strikeOuts': int(rng.binomial(outs, 0.3)), 'hits': int(rng.poisson(outs / 3)), 'baseOnBalls': int(rng.poisson(outs / 9)),
+        'hitByPitch': int(rng.random() < 0.05), 'wildPitches': int(rng.random() < 0.05), 'balks': 0, 'pickoffs': 0,
+        'shutouts': 0, 'completeGames': 0,
+    }
+
+def synthetic_live_feed(game_pk, away_team_id, home_team_id, away_players, home_players):
+    teams = {}
+
+    for side, team_id, players in [('away', away_team_id, away_players), ('home', home_team_id, home_players)]:
+        teams[side] = {'team': {'id': team_id}, 'players': {
+            f"ID{player_id}": {'person': {'id': player_id, 'fullName': name}, 'parentTeamId': team_id, 'stats': {'batting': batting, 'pitching': pitching}}
+            for player_id, name, batting, pitching in players
+        }}
+
+    return {'gamePk': game_pk, 'gameData': {'status': {'abstractGameState': 'Final'}}, 'liveData': {'boxscore': {'teams': teams}}}
+
+# build a boxscore shaped like the live feed for one game, with a full lineup of batters for each side
+# and a starter plus a few relievers
+
+def synthetic_boxscore(game_pk, rng, away_team_id = 1, home_team_id = 2, batters_per_team = 13, pitchers_per_team = 5):
+    sides = []
+
+    for team_id in [away_team_id, home_team_id]:
+        players = []
+        for slot in range(batters_per_team + pitchers_per_team):
+            player_id = team_id * 1000 + slot
+            if slot < batters_per_team:
+                players.append((player_id, f"Player {player_id}", synthetic_batting(rng, regular=slot < 9), {}))
+            else:
+                players.append((player_id, f"Player {player_id}", {}, synthetic_pitching(rng, starter=slot == batters_per_team)))
+        sides.append(players)
+
+    return synthetic_live_feed(game_pk, away_team_id, home_team_id, *sides)
+
+# ------------- Benchmark: vectorized scoring vs the per-player loop ------------- #
+
+# the original per-player scoring loop, kept here as the reference implementation
+
+def legacy_score_games(games_data, pitching_point_system = www.pitching_point_system, batting_point_system = www.batting_point_system):
+    pitcher_data = []
+    batter_data = []
+
+    for game_data in games_data:
+        for team in ['away', 'home']:
+            for player_info in game_data['liveData']['boxscore']['teams'][team]['players'].values():
+                player_name = player_info['person']['fullName']
+                player_id = player_info['person']['id']
+                team_id = player_info.get('parentTeamId', 999)
+                game_batting_stats = player_info['stats']['batting']
+                game_pitching_stats = player_info['stats']['pitching']
+
+                innings_pitched_game = game_pitching_stats.get('outs', 0) / 3
+
+                if innings_pitched_game > 0:
+                    game_pitching_score = sum(game_pitching_stats.get(stat, 0) * pitching_point_system.get(stat, 0) for stat in pitching_point_system)
+                    if innings_pitched_game >= 6 and game_pitching_stats.get('earnedRuns', 0) <= 3:
+                        game_pitching_score += 8
+                    pitcher_data.append({
+                        'Player Name': player_name,
+                        'Player ID': player_id,
+                        'Team ID': team_id,
+                        'Game Pitching Fantasy Score': game_pitching_score,
+                        'Game Pitching Fantasy Score per Inning': round(game_pitching_score / innings_pitched_game, 1),
+                    })
+
+                plate_appearances = game_batting_stats.get('plateAppearances', 0)
+                hits = game_batting_stats.get('hits', 0)
+
+                if plate_appearances > 0:
+                    game_batting_score = sum(game_batting_stats.get(stat, 0) * batting_point_system.get(stat, 0) for stat in batting_point_system)
+                    if hits > 0:
+                        singles = hits - game_batting_stats.get('doubles', 0) - game_batting_stats.get('triples', 0) - game_batting_stats.get('homeRuns', 0)
+                        game_batting_score += (singles * 2)
+                    batter_data.append({
+                        'Player Name': player_name,
+                        'Player ID': player_id,
+                        'Team ID': team_id,
+                        'Game Batting Fantasy Score': game_batting_score,
+                        'Game Batting Fantasy Score per PA': round(game_batting_score / plate_appearances, 1),
+                    })
+
+    return pd.DataFrame(pitcher_data), pd.DataFrame(batter_data)
+
+def bench_scoring(games, seed = 0):
+    rng = np.random.default_rng(seed)
+    games_data = [synthetic_boxscore(game_pk, rng, away_team_id=(2 * game_pk) % 30 + 1, home_team_id=(2 * game_pk + 1) % 30 + 1) for game_pk in range(games)]
+
+    start = time.perf_counter()
+    legacy_pitchers, legacy_batters = legacy_score_games(games_data)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stat_lines = www.extract_stat_lines(games_data)
+    extract_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pitcher_df, batter_df = www.score_stat_lines(stat_lines)
+    score_seconds = time.perf_counter() - start
+    vectorized_seconds = extract_seconds + score_seconds
+
+    identical = all(
+        np.array_equal(legacy[column].to_numpy(), vectorized[column].to_numpy())
+        for legacy, vectorized in [(legacy_pitchers, pitcher_df), (legacy_batters, batter_df)]
+        for column in legacy.columns
+    )
+
+    return {
+        'games': games,
+        'stat_lines': len(stat_lines),
+        'legacy_seconds': round(legacy_seconds, 4),
+        'vectorized_seconds': round(vectorized_seconds, 4),
+        'vectorized_extract_seconds': round(extract_seconds, 4),
+        'vectorized_score_seconds': round(score_seconds, 4),
+        'speedup': round(legacy_seconds / vectorized_seconds, 2),
+        'identical_scoring': bool(identical),
+    }
+
+# ------------- Synthetic ESPN free agents ------------- #
+
+first_names = ['Aaron', 'Adam', 'Alex', 'Andrew', 'Anthony', 'Austin', 'Blake', 'Brandon', 'Brent', 'Bryce', 'Carlos', 'Chris', 'Cody', 'Corey', 'Daniel',
+               'David', 'Dylan', 'Eddie', 'Eric', 'Evan', 'Francisco', 'Gavin', 'George', 'Hunter', 'Jack', 'Jacob', 'Jake', 'James', 'Jason', 'Jordan',
+               'Jose', 'Josh', 'Juan', 'Justin', 'Kevin', 'Kyle', 'Logan', 'Luis', 'Manny', 'Marcus', 'Matt', 'Max', 'Michael', 'Mike', 'Nick', 'Nolan',
+               'Paul', 'Pete', 'Rafael', 'Ryan', 'Sam', 'Sean', 'Shane', 'Spencer', 'Steven', 'Taylor', 'Tyler', 'Victor', 'Will', 'Zack']
+
+last_names = ['Adams', 'Alvarez', 'Anderson', 'Baker', 'Bell', 'Brown', 'Burnes', 'Castillo', 'Clark', 'Cole', 'Cruz', 'Davis', 'Diaz', 'Edwards',
+              'Flores', 'Garcia', 'Gomez', 'Gonzalez', 'Gray', 'Hall', 'Harris', 'Hernandez', 'Hill', 'Jackson', 'Johnson', 'Jones', 'Kelly', 'King',
+              'Lee', 'Lewis', 'Lopez', 'Martin', 'Martinez', 'Miller', 'Moore', 'Morales', 'Murphy', 'Nelson', 'Ortiz', 'Perez', 'Ramirez', 'Reyes',
+              'Rivera', 'Robinson', 'Rodriguez', 'Ruiz', 'Sanchez', 'Santana', 'Smith', 'Suarez', 'Taylor', 'Thomas', 'Torres', 'Turner', 'Walker',
+              'White', 'Williams', 'Wilson', 'Wright', 'Young']
+
+def synthetic_player_names(count, rng):
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(first_names)} {rng.choice(last_names)}")
+
+    return sorted(names)
+
+# stand-in for espn_api's League, only what the pipeline uses
+
+class FakeLeague:
+
+    def __init__(self, free_agent_names, league_id = 1):
+        self.league_id = league_id
+        self.free_agent_players = [SimpleNamespace(name=name, playerId=100000 + i, proTeam='FA') for i, name in enumerate(free_agent_names)]
+        self.player_map = {player.playerId: player.name for player in self.free_agent_players}
+
+    def free_agents(self, size = 50):
+        return self.free_agent_players[:size]
+
+# ------------- Synthetic season and Stats API stand-in ------------- #
+
+# a season of schedules and live feeds generated on demand. Every team has a fixed roster split between
+# pitchers and batters, starters go in a five man rotation, a few relievers pitch each game and most of
+# the batters start. Games are generated deterministically from (seed, game_pk), so nothing has to be held in memory
+
+class SyntheticSeason:
+
+    def __init__(self, days = 180, games_per_day = 15, roster_size = 26, teams = 30, start_date = date(2024, 3, 28), seed = 0):
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.dates = [start_date + timedelta(days=offset) for offset in range(days)]
+
+        team_ids = list(range(101, 101 + teams))
+        names = iter(synthetic_player_names(teams * roster_size, rng))
+        pitchers_per_team = roster_size // 2
+        self.pitchers = {team_id: [(team_id * 1000 + slot, next(names)) for slot in range(pitchers_per_team)] for team_id in team_ids}
+        self.batters = {team_id: [(team_id * 1000 + slot, next(names)) for slot in range(pitchers_per_team, roster_size)] for team_id in team_ids}
+
+        # pair the teams up each day, a game_pk encodes its day so the schedule can be looked up both ways
+        self.games_by_date = {}
+        self.games = {}
+        for day_index, game_date in enumerate(self.dates):
+            shuffled_teams = [int(team_id) for team_id in rng.permutation(team_ids)]
+            day_games = []
+            for game_index in range(min(games_per_day, teams // 2)):
+                game_pk = (day_index + 1) * 100 + game_index
+                self.games[game_pk] = (day_index, shuffled_teams[2 * game_index], shuffled_teams[2 * game_index + 1])
+                day_games.append(game_pk)
+            self.games_by_date[game_date] = day_games
+
+    def player_names(self):
+        return [name for roster in list(self.pitchers.values()) + list(self.batters.values()) for _, name in roster]
+
+    def schedule(self, game_date):
+        games = [{
+            'gamePk': game_pk, 'status': {'abstractGameState': 'Final', 'codedGameState': 'F', 'detailedState': 'Final'},
+            'teams': {'away': {'team': {'id': self.games[game_pk][1]}}, 'home': {'team': {'id': self.games[game_pk][2]}}},
+        } for game_pk in self.games_by_date.get(game_date, [])]
+
+        return {'dates': [{'date': game_date.isoformat(), 'games': games}] if games else []}
+
+    def _team_players(self, rng, team_id, day_index):
+        pitchers = self.pitchers[team_id]
+        starter = day_index % 5
+        relievers = set(int(i) for i in rng.choice(np.arange(5, len(pitchers)), size=min(3, len(pitchers) - 5), replace=False))
+        starting_batters = set(int(i) for i in rng.choice(len(self.batters[team_id]), size=min(9, len(self.batters[team_id])), replace=False))
+
+        players = [(player_id, name, synthetic_batting(rng, regular=i in starting_batters), {}) for i, (player_id, name) in enumerate(self.batters[team_id])]
+        for i, (player_id, name) in enumerate(pitchers):
+            pitching = synthetic_pitching(rng, starter=True) if i == starter else synthetic_pitching(rng, starter=False) if i in relievers else {}
+            players.append((player_id, name, {}, pitching))
+
+        return players
+
+    def game(self, game_pk):
+        day_index, away_team_id, home_team_id = self.games[game_pk]
+        rng = np.random.default_rng([self.seed, game_pk])
+
+        return synthetic_live_feed(game_pk, away_team_id, home_team_id, self._team_players(rng, away_team_id, day_index), self._team_players(rng, home_team_id, day_index))
+
+# MLBStatsAPIClient that answers from a SyntheticSeason. Only _get is replaced, so batching, threading and
+# metrics all go through the real client code. Payloads are serialized and parsed like a real response would be
+
+class SyntheticStatsAPIClient(www.MLBStatsAPIClient):
+
+    def __init__(self, season, **kwargs):
+        super().__init__(**kwargs)
+        self.season = season
+
+    def _get(self, request_url, params = None, cache_policy = None, use_cache = True):
+        game_match = re.search(r"/game/(\d+)/feed/live", request_url)
+        if game_match:
+            payload = self.season.game(int(game_match.group(1)))
+        else:
+            payload = self.season.schedule(www._parse_date(re.search(r"date=([^&]+)", request_url).group(1)))
+
+        body = json.dumps(payload).encode()
+        if self.metrics is not None:
+            self.metrics.add('http_requests')
+            self.metrics.add('http_bytes', len(body))
+
+        return json.loads(body)
+
+# ------------- Benchmark: pipeline stages over a synthetic season ------------- #
+
+# ingest a whole synthetic season day by day and time each stage of the pipeline at a few database sizes
+# (by default after day 1, 90 and 180), then the free agent join against a fake ESPN league at the end
+
+def bench_pipeline(days = 180, games_per_day = 15, roster_size = 26, free_agents = 1500, checkpoints = (1, 90, 180), seed = 0):
+    season = SyntheticSeason(days=days, games_per_day=games_per_day, roster_size=roster_size, seed=seed)
+    client = SyntheticStatsAPIClient(season)
+    conn = www.connect_database(":memory:")
+    www.build_database(conn)
+
+    # the nightly path: ingest_day also writes the stat lines, the ledger and the team strengths
+    ingest_client = SyntheticStatsAPIClient(season)
+    ingest_conn = www.connect_database(":memory:")
+    www.build_database(ingest_conn)
+    ingest_seconds = 0.0
+
+    checkpoint_results = {}
+    start = time.perf_counter()
+
+    for day_number, game_date in enumerate(season.dates, start=1):
+        date_string = game_date.strftime("%m/%d/%Y")
+        games = www.get_days_previous_games(client, date_string) if season.games_by_date[game_date] else []
+
+        scoring_start = time.perf_counter()
+        pitcher_df, batter_df = www.calculate_player_scoring(client, games)
+        scoring_seconds = time.perf_counter() - scoring_start
+
+        update_start = time.perf_counter()
+        www.update_player_data(conn, pitcher_df, batter_df, date_string)
+        update_seconds = time.perf_counter() - update_start
+
+        ingest_start = time.perf_counter()
+        www.ingest_day(ingest_conn, ingest_client, date_string)
+        ingest_day_seconds = time.perf_counter() - ingest_start
+        ingest_seconds += ingest_day_seconds
+
+        if day_number in checkpoints:
+            predict_start = time.perf_counter()
+            www.predict_players(conn)
+            predict_seconds = time.perf_counter() - predict_start
+
+            checkpoint_results[f"day_{day_number}"] = {
+                'appearances': conn.execute("SELECT COUNT(*) FROM appearances").fetchone()[0],
+                'players': conn.execute("SELECT COUNT(*) FROM player_summary").fetchone()[0],
+                'calculate_player_scoring_seconds': round(scoring_seconds, 4),
+                'update_player_data_seconds': round(update_seconds, 4),
+                'ingest_day_seconds': round(ingest_day_seconds, 4),
+                'predict_players_seconds': round(predict_seconds, 4),
+            }
+
+    season_seconds = time.perf_counter() - start - ingest_seconds
+
+    # free agents: about half of the league's players, topped up with names that never played
+    rng = np.random.default_rng(seed)
+    season_names = season.player_names()
+    free_agent_names = list(rng.choice(season_names, size=min(free_agents, len(season_names)) // 2, replace=False))
+    season_name_set = set(season_names)
+    other_names = [name for name in synthetic_player_names(len(season_names) + free_agents, rng) if name not in season_name_set]
+    free_agent_names += other_names[:free_agents - len(free_agent_names)]
+    league = FakeLeague(free_agent_names)
+
+    ranked_players = www.rank_players(conn)
+    join_start = time.perf_counter()
+    available_players = www.join_with_waiver_players(league, *ranked_players, conn)
+    join_seconds = time.perf_counter() - join_start
+
+    return {
+        'days': days,
+        'games_per_day': games_per_day,
+        'roster_size': roster_size,
+        'free_agents': len(free_agent_names),
+        'season_ingest_seconds': round(season_seconds, 4),
+        'season_ingest_day_seconds': round(ingest_seconds, 4),
+        'checkpoints': checkpoint_results,
+        'join_with_waiver_players_seconds': round(join_seconds, 4),
+        'available_probable_players': len(available_players[0]) + len(available_players[1]),
+    }
+
+# ------------- Benchmark: one ingest shared by many leagues ------------- #
+
+# every league gets its own point system (the default one with a few weights changed) and its own free
+# agent pool. Ingest fetches the games once whatever the number of leagues, so only scoring, ranking and
+# the free agent joins should grow with it
+
+def bench_leagues(league_counts = (1, 2, 4, 8), days = 30, games_per_day = 15, free_agents = 1500, seed = 0):
+    season = SyntheticSeason(days=days, games_per_day=games_per_day, seed=seed)
+    rng = np.random.default_rng(seed)
+    season_names = season.player_names()
+
+    results = {}
+    for league_count in league_counts:
+        scoring_configs = dict(www.default_scoring_configs)
+        for i in range(1, league_count):
+            scoring_configs[f'league_{i}'] = {
+                'pitching': {stat: points + int(rng.integers(-1, 2)) for stat, points in www.pitching_point_system.items()},
+                'batting': {stat: points + int(rng.integers(-1, 2)) for stat, points in www.batting_point_system.items()},
+            }
+
+        client = SyntheticStatsAPIClient(season, metrics=www.PipelineMetrics())
+        conn = www.connect_database(":memory:")
+        www.build_database(conn)
+        www.register_scoring_configs(conn, scoring_configs)
+
+        start = time.perf_counter()
+        for game_date in season.dates:
+            www.ingest_day(conn, client, game_date.strftime("%m/%d/%Y"), scoring_configs=scoring_configs)
+        ingest_seconds = time.perf_counter() - start
+
+        report_date = season.dates[-1].strftime("%m/%d/%Y")
+        league_free_agents = {scoring: [(100000 + i, name) for i, name in enumerate(rng.choice(season_names, size=min(free_agents, len(season_names)), replace=False))]
+                              for scoring in scoring_configs}
+
+        start = time.perf_counter()
+        for scoring in scoring_configs:
+            ranked_players = www.rank_players(conn, scoring=scoring)
+            www.filter_available_players(conn, client, None, report_date, ranked_players, free_agents=league_free_agents[scoring], scoring=scoring)
+        report_seconds = time.perf_counter() - start
+
+        results[f'leagues_{league_count}'] = {
+            'http_requests': client.metrics.counters['http_requests'],
+            'ingest_seconds': round(ingest_seconds, 4),
+            'rank_and_filter_seconds': round(report_seconds, 4),
+        }
+
+    return {'days': days, 'games_per_day': games_per_day, 'results': results}
+
+# ------------- Benchmark: replaying a season and sweeping ranking strategies ------------- #
+
+def bench_backtest(days = 180, games_per_day = 15, roster_size = 26, top_n = 5, seed = 0):
+    season = SyntheticSeason(days=days, games_per_day=games_per_day, roster_size=roster_size, seed=seed)
+    client = SyntheticStatsAPIClient(season)
+    conn = www.connect_database(":memory:")
+    www.build_database(conn)
+
+    for game_date in season.dates:
+        date_string = game_date.strftime("%m/%d/%Y")
+        games = www.get_days_previous_games(client, date_string) if season.games_by_date[game_date] else []
+        www.update_player_data(conn, *www.calculate_player_scoring(client, games), date_string)
+
+    # every built in strategy, plus a sweep of the quantile and the boom threshold
+    strategies = ['sharpe', 'decayed_sharpe', 'mean', 'decayed_mean']
+    strategies += [f'upside_quantile:q={q}' for q in (0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95)]
+    strategies += [f'boom_probability:threshold={threshold}' for threshold in (2, 4, 6, 8, 10, 12, 15, 20, 25, 30)]
+
+    replay_seconds = {}
+    sweep_seconds = {}
+    best_strategies = {}
+    for role in www.player_roles:
+        start = time.perf_counter()
+        replayed_season = www.replay_season(conn, role)
+        replay_seconds[role] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        results = www.evaluate_strategies(replayed_season, strategies, top_n)
+        sweep_seconds[role] = round(time.perf_counter() - start, 4)
+        best_strategies[role] = results.sort_values(by='points_per_pick', ascending=False)['strategy'].iloc[0]
+
+    return {
+        'days': days,
+        'appearances': conn.execute("SELECT COUNT(*) FROM appearances").fetchone()[0],
+        'strategies': len(strategies),
+        'replay_seconds': replay_seconds,
+        'sweep_seconds': sweep_seconds,
+        'seconds_per_strategy': {role: round(seconds / len(strategies), 4) for role, seconds in sweep_seconds.items()},
+        'best_strategies': best_strategies,
+    }
+
+# ------------- Benchmark: columnar snapshot reads vs SQLite ------------- #
+
+# ingest a synthetic season into an on-disk database with a snapshot directory, then load every player's
+# score history and replay the season from SQLite and from the memory mapped snapshot. Peak memory is the
+# Python heap (tracemalloc) plus whatever Arrow allocated
+
+def _peak_memory(function, *args):
+    import pyarrow as pa
+
+    tracemalloc.start()
+    arrow_before = pa.total_allocated_bytes()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    peak_bytes = tracemalloc.get_traced_memory()[1] + max(pa.total_allocated_bytes() - arrow_before, 0)
+    tracemalloc.stop()
+
+    return result, round(seconds, 4), peak_bytes
+
+def bench_snapshots(days = 180, games_per_day = 15, roster_size = 26, seed = 0):
+    season = SyntheticSeason(days=days, games_per_day=games_per_day, roster_size=roster_size, seed=seed)
+    client = SyntheticStatsAPIClient(season)
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_dir = os.path.join(directory, "snapshots")
+        conn = www.connect_database(os.path.join(directory, "bench.db"), snapshot_dir=snapshot_dir)
+        www.build_database(conn)
+
+        # ingest_day writes the day's snapshot files, this times doing that again from the database
+        sync_seconds = []
+        for game_date in season.dates:
+            www.ingest_day(conn, client, game_date.strftime("%m/%d/%Y"))
+            for path in glob.glob(os.path.join(snapshot_dir, "appearances", "*", "*", f"{game_date.isoformat()}.*.arrow")):
+                os.remove(path)
+            start = time.perf_counter()
+            www.sync_appearance_snapshots(conn, game_dates=[game_date])
+            sync_seconds.append(time.perf_counter() - start)
+
+        results = {'days': days, 'appearances': conn.execute("SELECT COUNT(*) FROM appearances").fetchone()[0], 'sync_seconds_per_day': round(float(np.mean(sync_seconds)), 4)}
+
+        for role in www.player_roles:
+            player_ids = [row[0] for row in conn.execute("SELECT mlbam_id FROM player_summary WHERE role = ?", (role,))]
+
+            conn.snapshot_dir = None
+            (sqlite_histories, _), sqlite_histories_seconds, sqlite_histories_bytes = _peak_memory(www.load_score_histories, conn, role, player_ids)
+            sqlite_season, sqlite_replay_seconds, sqlite_replay_bytes = _peak_memory(www.replay_season, conn, role)
+
+            conn.snapshot_dir = snapshot_dir
+            (snapshot_histories, _), snapshot_histories_seconds, snapshot_histories_bytes = _peak_memory(www.load_score_histories, conn, role, player_ids)
+            snapshot_season, snapshot_replay_seconds, snapshot_replay_bytes = _peak_memory(www.replay_season, conn, role)
+
+            results[role] = {
+                'players': len(player_ids),
+                'sqlite_histories_seconds': sqlite_histories_seconds,
+                'snapshot_histories_seconds': snapshot_histories_seconds,
+                'sqlite_histories_peak_bytes': sqlite_histories_bytes,
+                'snapshot_histories_peak_bytes': snapshot_histories_bytes,
+                'sqlite_replay_seconds': sqlite_replay_seconds,
+                'snapshot_replay_seconds': snapshot_replay_seconds,
+                'sqlite_replay_peak_bytes': sqlite_replay_bytes,
+                'snapshot_replay_peak_bytes': snapshot_replay_bytes,
+                'identical': bool(np.array_equal(sqlite_histories, snapshot_histories) and np.array_equal(sqlite_season['points'], snapshot_season['points'])
+                                  and np.array_equal(sqlite_season['likely_to_play'], snapshot_season['likely_to_play'])),
+            }
+
+        conn.close()
+
+    return results
+
+# ------------- Benchmark: counted bootstrap vs materialized draws ------------- #
+
+def bench_projection(players = 1500, draws = 10000, longest_history = 160, seed = 0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, longest_history + 1, players)
+    histories = np.where(np.arange(longest_history) < lengths[:, None], rng.integers(-5, 40, (players, longest_history)), 0)
+
+    start = time.perf_counter()
+    projection = www.bootstrap_projection(histories, lengths, 10, draws, seed=seed)
+    counted_seconds = time.perf_counter() - start
+
+    # the straightforward version: draw every index, gather the scores and reduce them
+    start = time.perf_counter()
+    drawn_scores = np.take_along_axis(histories, rng.integers(0, lengths[:, None], size=(players, draws)), axis=1)
+    materialized = {'boom_probability': (drawn_scores >= 10).mean(axis=1), 'expected_score': drawn_scores.mean(axis=1), 'upper_quantile': np.quantile(drawn_scores, 0.9, axis=1)}
+    materialized_seconds = time.perf_counter() - start
+
+    return {
+        'players': players,
+        'draws': draws,
+        'counted_seconds': round(counted_seconds, 4),
+        'materialized_seconds': round(materialized_seconds, 4),
+        'speedup': round(materialized_seconds / counted_seconds, 2),
+        'max_boom_probability_difference': round(float(np.abs(projection['boom_probability'] - materialized['boom_probability']).max()), 4),
+    }
+
+# ------------- Benchmark: live diff patches vs refetching every boxscore ------------- #
+
+# a slate of games played out one plate appearance at a time by the lineup's first nine batters against
+# each side's starter. Every play patches the batter's and the pitcher's stat lines and appends the play to the play-by-play, which a live watcher downloads but never applies
+
+class SyntheticLiveSlate:
+
+    def __init__(self, games = 15, plays_per_poll = 3, polls = 40, seed = 0):
+        self.season = SyntheticSeason(days=1, games_per_day=games, seed=seed)
+        self.game_date = self.season.dates[0]
+        self.rng = np.random.default_rng(seed)
+        self.plays_per_poll = plays_per_poll
+        self.polls = polls
+        self.poll_number = 0
+        self.feeds = {}
+        self.patches = {}
+
+        for game_pk, (_, away_team_id, home_team_id) in self.season.games.items():
+            # like the real boxscore, the whole roster is listed with every stat at zero before the first pitch
+            sides = [[(player_id, name, dict.fromkeys(synthetic_batting(self.rng), 0), {}) for player_id, name in self.season.batters[team_id]]
+                     + [(player_id, name, {}, dict.fromkeys(synthetic_pitching(self.rng), 0)) for player_id, name in self.season.pitchers[team_id]] for team_id in (away_team_id, home_team_id)]
+            feed = synthetic_live_feed(game_pk, away_team_id, home_team_id, *sides)
+            feed['gameData']['status']['abstractGameState'] = 'Live'
+            feed['metaData'] = {'timeStamp': self._timecode()}
+            feed['liveData']['plays'] = {'allPlays': []}
+            self.feeds[game_pk] = feed
+            self.patches[game_pk] = []
+
+    def _timecode(self):
+        return f"20240328_{self.poll_number:06d}"
+
+    # play the next few plate appearances of every game, recording them as one patch per game
+
+    def advance(self):
+        self.poll_number += 1
+        final = self.poll_number >= self.polls
+
+        for game_pk, feed in self.feeds.items():
+            teams = feed['liveData']['boxscore']['teams']
+            operations = []
+
+            for _ in range(self.plays_per_poll):
+                batting_side, pitching_side = ('away', 'home') if self.rng.random() < 0.5 else ('home', 'away')
+                batter_key = list(teams[batting_side]['players'])[int(self.rng.integers(0, 9))]
+                pitcher_key = list(teams[pitching_side]['players'])[len(self.season.batters[teams[pitching_side]['team']['id']])]
+
+                outcome = self.rng.choice(['out', 'strikeOut', 'single', 'homeRun', 'walk'], p=[0.45, 0.22, 0.2, 0.04, 0.09])
+                changes = [(batting_side, batter_key, 'batting', 'plateAppearances')]
+                if outcome in ('out', 'strikeOut'):
+                    changes.append((pitching_side, pitcher_key, 'pitching', 'outs'))
+                if outcome == 'strikeOut':
+                    changes += [(batting_side, batter_key, 'batting', 'strikeOuts'), (pitching_side, pitcher_key, 'pitching', 'strikeOuts')]
+                if outcome in ('single', 'homeRun'):
+                    changes += [(batting_side, batter_key, 'batting', 'hits'), (pitching_side, pitcher_key, 'pitching', 'hits')]
+                if outcome == 'homeRun':
+                    changes += [(batting_side, batter_key, 'batting', stat) for stat in ('homeRuns', 'runs', 'rbi')] + [(pitching_side, pitcher_key, 'pitching', 'earnedRuns')]
+                if outcome == 'walk':
+                    changes += [(batting_side, batter_key, 'batting', 'baseOnBalls'), (pitching_side, pitcher_key, 'pitching', 'baseOnBalls')]
+
+                for side, player_key, stat_group, stat in changes:
+                    stats = teams[side]['players'][player_key]['stats'][stat_group]
+                    stats[stat] = stats.get(stat, 0) + 1
+                    operations.append({'op': 'add', 'path': f"/liveData/boxscore/teams/{side}/players/{player_key}/stats/{stat_group}/{stat}", 'value': stats[stat]})
+
+                play = {'result': {'eventType': str(outcome)}, 'matchup': {'batter': batter_key, 'pitcher': pitcher_key}, 'playEvents': [{'details': {'description': 'pitch'}}] * 4}
+                feed['liveData']['plays']['allPlays'].append(play)
+                operations.append({'op': 'add', 'path': '/liveData/plays/allPlays/-', 'value': play})
+
+            if final:
+                feed['gameData']['status']['abstractGameState'] = 'Final'
+                operations.append({'op': 'replace', 'path': '/gameData/status/abstractGameState', 'value': 'Final'})
+
+            feed['metaData']['timeStamp'] = self._timecode()
+            operations.append({'op': 'replace', 'path': '/metaData/timeStamp', 'value': self._timecode()})
+            self.patches[game_pk].append((self._timecode(), operations))
+
+    def schedule(self, game_date):
+        schedule = self.season.schedule(game_date)
+        for day in schedule['dates']:
+            for game in day['games']:
+                state = self.feeds[game['gamePk']]['gameData']['status']['abstractGameState']
+                game['status'].update(abstractGameState=state, codedGameState='F' if state == 'Final' else 'I', detailedState='Final' if state == 'Final' else 'In Progress')
+
+        return schedule
+
+    # the boxscore part of the feed, like a fields filtered get_game
+
+    def game(self, game_pk):
+        feed = self.feeds[game_pk]
+
+        return {key: value for key, value in feed.items() if key != 'liveData'} | {'liveData': {'boxscore': feed['liveData']['boxscore']}}
+
+    def diff_patch(self, game_pk, start_timecode):
+        return [{'diff': operations} for timecode, operations in self.patches[game_pk] if timecode > start_timecode]
+
+class SyntheticLiveStatsAPIClient(www.MLBStatsAPIClient):
+
+    def __init__(self, slate, **kwargs):
+        super().__init__(**kwargs)
+        self.slate = slate
+
+    def _get(self, request_url, params = None, cache_policy = None, use_cache = True):
+        game_match = re.search(r"/game/(\d+)/feed/live", request_url)
+        if game_match and request_url.endswith("/diffPatch"):
+            payload = self.slate.diff_patch(int(game_match.group(1)), params['startTimecode'])
+        elif game_match:
+            payload = self.slate.game(int(game_match.group(1)))
+        else:
+            payload = self.slate.schedule(www._parse_date(re.search(r"date=([^&]+)", request_url).group(1)))
+
+        body = json.dumps(payload).encode()
+        if self.metrics is not None:
+            self.metrics.add('http_requests')
+            self.metrics.add('http_bytes', len(body))
+
+        return json.loads(body)
+
+# follow the slate with the watcher (patches, changed players only) and with a full boxscore refetch and
+# rescore of every live game per poll, then check that both end up with the same leaderboards
+
+def bench_live(games = 15, plays_per_poll = 3, polls = 40, seed = 0):
+    slate = SyntheticLiveSlate(games, plays_per_poll, polls, seed)
+    patch_client = SyntheticLiveStatsAPIClient(slate, metrics=www.PipelineMetrics())
+    refetch_client = SyntheticLiveStatsAPIClient(slate, metrics=www.PipelineMetrics())
+    watcher = www.LiveGameWatcher(patch_client, slate.game_date, metrics=patch_client.metrics)
+    game_pks = list(slate.feeds)
+
+    patch_seconds = refetch_seconds = 0
+    for _ in range(polls + 1):
+        start = time.perf_counter()
+        watcher.poll()
+        patch_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        refetched_scores = www.score_stat_lines(www.extract_stat_lines(refetch_client.get_games(game_pks, fields=watcher.fields)))
+        refetch_seconds += time.perf_counter() - start
+
+        slate.advance()
+
+    identical = all(
+        sorted(zip(watcher.leaderboard(role, limit=None)['mlbam_id'], watcher.leaderboard(role, limit=None)['live_score']))
+        == sorted(zip(refetched['Player ID'], refetched[www.score_columns[role][0]]))
+        for role, refetched in zip(www.player_roles, refetched_scores)
+    )
+
+    return {
+        'games': games,
+        'polls': polls,
+        'plays_per_poll': plays_per_poll,
+        'patch_seconds': round(patch_seconds, 4),
+        'refetch_seconds': round(refetch_seconds, 4),
+        'speedup': round(refetch_seconds / patch_seconds, 2),
+        'patch_bytes': patch_client.metrics.counters['http_bytes'],
+        'refetch_bytes': refetch_client.metrics.counters['http_bytes'],
+        'players_rescored': patch_client.metrics.counters['live_players_rescored'],
+        'patch_operations': patch_client.metrics.counters['live_patch_operations'],
+        'identical_scores': bool(identical),
+    }
+
+# ------------- Benchmark: indexed name matcher vs a difflib scan per row ------------- #
+
+def bench_name_matching(free_agents = 1500, rows = 3000, seed = 0):
+    rng = np.random.default_rng(seed)
+    all_names = synthetic_player_names(free_agents * 2, rng)
+    free_agent_names = list(rng.choice(all_names, size=free_agents, replace=False))
+    league = FakeLeague(free_agent_names)
+
+    # the roster to match: about half free agents, some with a one letter typo, the rest rostered elsewhere
+    roster_names = list(rng.choice(all_names, size=rows))
+    for i in range(0, rows, 10):
+        roster_names[i] = roster_names[i][:-1] + "x"
+
+    frames = [pd.DataFrame({'mlbam_id': np.arange(part * rows, (part + 1) * rows), 'player_name': roster_names}) for part in range(6)]
+
+    start = time.perf_counter()
+    legacy_frames = []
+    for frame in frames:
+        matches = [difflib.get_close_matches(name, free_agent_names, n=1, cutoff=0.95) for name in frame['player_name']]
+        legacy_frames.append([match[0] if match else None for match in matches])
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed_frames = www.join_with_waiver_players(league, *frames)
+    indexed_seconds = time.perf_counter() - start
+
+    identical = all(
+        [name for name in legacy if name is not None] == list(indexed['player_name'])
+        for legacy, indexed in zip(legacy_frames, indexed_frames)
+    )
+
+    return {
+        'free_agents': free_agents,
+        'rows': rows * len(frames),
+        'legacy_seconds': round(legacy_seconds, 4),
+        'indexed_seconds': round(indexed_seconds, 4),
+        'speedup': round(legacy_seconds / indexed_seconds, 2),
+        'identical_matches': bool(identical),
+    }
+
+# ------------- Benchmark: batched report rendering vs one email at a time ------------- #
+
+# the reports for every member of a few leagues: the six tables rendered again for every message (what
+# send_email used to do) against rendering each league's tables once, with a roster section per member.
+# Both sides build and send every message, into a LocalSink, so this times rendering and not the SMTP server
+
+def bench_reports(leagues = 4, members = 12, rows = 50, seed = 0):
+    rng = np.random.default_rng(seed)
+    names = synthetic_player_names(rows * 6, rng)
+
+    def players_frame(count):
+        return pd.DataFrame({'mlbam_id': rng.integers(100000, 700000, count), 'player_name': rng.choice(names, count), 'team_id': rng.integers(101, 131, count),
+                             'fantasy_sharpe_ratio': rng.random(count) * 5, 'expected_score': rng.random(count) * 30, 'matchup_expected_score': rng.random(count) * 30})
+
+    league_players = [[players_frame(rows), players_frame(rows)] + [players_frame(5) for _ in range(4)] for _ in range(leagues)]
+    reports = [{'league_name': f"League {league}", 'recipient': f"member{member}@league{league}.example", 'players': players, 'team_name': f"Team {member}",
+                'roster': www.roster_players(players[:2], rng.choice(names, 25))}
+               for league, players in enumerate(league_players) for member in range(members)]
+
+    # the way send_email used to build each message: every table concatenated from scratch, including the
+    # two roster tables, into a fresh multipart message
+    per_message_sink = www.LocalSink()
+    roster_titles = ['Your Likely Pitchers', 'Your Likely Batters']
+    start = time.perf_counter()
+    for report in reports:
+        html_body = "<br><br>".join(f"<h3>{title}:</h3>{players.to_html(index=False)}"
+                                    for title, players in zip(roster_titles + www.report_titles, report['roster'] + report['players']))
+
+        message = MIMEMultipart("alternative")
+        message["Subject"] = f"Waiver Wire Adds - {report['league_name']} - 04/01/2024"
+        message["From"] = per_message_sink.sender_email
+        message["To"] = report['recipient']
+        message.attach(MIMEText(html_body, "html"))
+        per_message_sink.send(message)
+    per_message_seconds = time.perf_counter() - start
+
+    sink = www.LocalSink()
+    metrics = www.PipelineMetrics()
+    start = time.perf_counter()
+    www.deliver_messages(www.render_reports("04/01/2024", reports, sink.sender_email), sink, metrics)
+    batched_seconds = time.perf_counter() - start
+
+    return {
+        'messages': len(reports),
+        'per_message_seconds': round(per_message_seconds, 4),
+        'batched_seconds': round(batched_seconds, 4),
+        'speedup': round(per_message_seconds / batched_seconds, 2),
+        'per_message_emails': len(per_message_sink.messages),
+        'emails_sent': metrics.counters['emails_sent'],
+    }
+
+# ------------- Command line ------------- #
+
+# the commit the benchmark ran against, so results can be compared across commits
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Waiver Wire Winner benchmarks")
+    parser.add_argument("--output", help="also append the results as a JSON line to this file")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    record_parser = subparsers.add_parser("record", help="record live feed fixtures for a date (MM/DD/YYYY)")
+    record_parser.add_argument("fixture_dir")
+    record_parser.add_argument("date")
+
+    boxscore_parser = subparsers.add_parser("boxscore", help="full live feed vs boxscore-only payloads")
+    boxscore_parser.add_argument("fixture_dir")
+
+    scoring_parser = subparsers.add_parser("scoring", help="vectorized scoring engine vs the per-player loop")
+    scoring_parser.add_argument("--games", type=int, default=2400)
+    scoring_parser.add_argument("--seed", type=int, default=0)
+
+    matching_parser = subparsers.add_parser("matching", help="indexed free agent name matcher vs a difflib scan per row")
+    matching_parser.add_argument("--free-agents", type=int, default=1500)
+    matching_parser.add_argument("--rows", type=int, default=3000)
+    matching_parser.add_argument("--seed", type=int, default=0)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="every pipeline stage over a synthetic season")
+    pipeline_parser.add_argument("--days", type=int, default=180)
+    pipeline_parser.add_argument("--games-per-day", type=int, default=15)
+    pipeline_parser.add_argument("--roster-size", type=int, default=26)
+    pipeline_parser.add_argument("--free-agents", type=int, default=1500)
+    pipeline_parser.add_argument("--checkpoints", type=int, nargs="+", default=[1, 90, 180])
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+
+    leagues_parser = subparsers.add_parser("leagues", help="ingest and ranking cost as the number of leagues grows")
+    leagues_parser.add_argument("--league-counts", type=int, nargs="+", default=[1, 2, 4, 8])
+    leagues_parser.add_argument("--days", type=int, default=30)
+    leagues_parser.add_argument("--games-per-day", type=int, default=15)
+    leagues_parser.add_argument("--seed", type=int, default=0)
+
+    backtest_parser = subparsers.add_parser("backtest", help="replay a synthetic season and sweep ranking strategies")
+    backtest_parser.add_argument("--days", type=int, default=180)
+    backtest_parser.add_argument("--games-per-day", type=int, default=15)
+    backtest_parser.add_argument("--roster-size", type=int, default=26)
+    backtest_parser.add_argument("--top-n", type=int, default=5)
+    backtest_parser.add_argument("--seed", type=int, default=0)
+
+    snapshots_parser = subparsers.add_parser("snapshots", help="score histories and season replays from the Arrow snapshot vs SQLite")
+    snapshots_parser.add_argument("--days", type=int, default=180)
+    snapshots_parser.add_argument("--games-per-day", type=int, default=15)
+    snapshots_parser.add_argument("--roster-size", type=int, default=26)
+    snapshots_parser.add_argument("--seed", type=int, default=0)
+
+    projection_parser = subparsers.add_parser("projection", help="bootstrap projection with counted draws vs materialized draws")
+    projection_parser.add_argument("--players", type=int, default=1500)
+    projection_parser.add_argument("--draws", type=int, default=10000)
+    projection_parser.add_argument("--seed", type=int, default=0)
+
+    live_parser = subparsers.add_parser("live", help="following live games with diff patches vs refetching every boxscore")
+    live_parser.add_argument("--games", type=int, default=15)
+    live_parser.add_argument("--plays-per-poll", type=int, default=3)
+    live_parser.add_argument("--polls", type=int, default=40)
+    live_parser.add_argument("--seed", type=int, default=0)
+
+    reports_parser = subparsers.add_parser("reports", help="batched report rendering vs rendering every email from scratch")
+    reports_parser.add_argument("--leagues", type=int, default=4)
+    reports_parser.add_argument("--members", type=int, default=12)
+    reports_parser.add_argument("--rows", type=int, default=50)
+    reports_parser.add_argument("--seed", type=int, default=0)
+
+    parse_parser = subparsers.add_parser("_parse")
+    parse_parser.add_argument("payload_dir")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "record":
+        results = {'recorded_games': record_fixtures(args.fixture_dir, args.date)}
+    elif args.benchmark == "boxscore":
+        results = bench_boxscore(args.fixture_dir)
+    elif args.benchmark == "scoring":
+        results = bench_scoring(args.games, args.seed)
+    elif args.benchmark == "matching":
+        results = bench_name_matching(args.free_agents, args.rows, args.seed)
+    elif args.benchmark == "pipeline":
+        results = bench_pipeline(args.days, args.games_per_day, args.roster_size, args.free_agents, args.checkpoints, args.seed)
+    elif args.benchmark == "leagues":
+        results = bench_leagues(args.league_counts, args.days, args.games_per_day, seed=args.seed)
+    elif args.benchmark == "backtest":
+        results = bench_backtest(args.days, args.games_per_day, args.roster_size, args.top_n, args.seed)
+    elif args.benchmark == "snapshots":
+        results = bench_snapshots(args.days, args.games_per_day, args.roster_size, args.seed)
+    elif args.benchmark == "projection":
+        results = bench_projection(args.players, args.draws, seed=args.seed)
+    elif args.benchmark == "live":
+        results = bench_live(args.games, args.plays_per_poll, args.polls, args.seed)
+    elif args.benchmark == "reports":
+        results = bench_reports(args.leagues, args.members, args.rows, args.seed)
+    else:
+        print(json.dumps(_parse_payloads(args.payload_dir)))
+        return
+
+    results = {'benchmark': args.benchmark, 'commit': current_commit(), 'ran_at': datetime.now().isoformat(timespec='seconds'), 'results': results}
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import pytest
+
+import benchmarks
+import waiver_wire_winner as www
+
+# the ingestion ledger against a small synthetic season: reruns and failed runs must leave the database
+# exactly as one clean run would, and days are only ever applied in date order
+
+season = benchmarks.SyntheticSeason(days=8, games_per_day=4, seed=7)
+days = season.dates
+
+def new_database():
+    conn = www.connect_database(":memory:")
+    www.build_database(conn)
+    www.register_scoring_configs(conn)
+
+    return conn
+
+def ledger(conn):
+    return (conn.execute("SELECT game_date, games FROM ingested_days ORDER BY game_date").fetchall(),
+            conn.execute("SELECT game_pk, game_date FROM ingested_games ORDER BY game_pk").fetchall())
+
+def summary(conn):
+    return conn.execute(f'''SELECT scoring, mlbam_id, role, team_id, cur_days_rest, last_score, {', '.join(www.running_stat_columns)}
+                            FROM player_summary ORDER BY scoring, mlbam_id, role''').fetchall()
+
+def appearances(conn):
+    return conn.execute("SELECT scoring, mlbam_id, game_date, role, score, rest_days FROM appearances ORDER BY scoring, game_date, mlbam_id, role").fetchall()
+
+def chronological_database():
+    conn = new_database()
+    for day in days:
+        www.ingest_day(conn, benchmarks.SyntheticStatsAPIClient(season), day)
+
+    return conn
+
+# fails the nth batch of games it is asked for
+
+class FailingStatsAPIClient(benchmarks.SyntheticStatsAPIClient):
+
+    def __init__(self, season, fail_on_batch):
+        super().__init__(season)
+        self.fail_on_batch = fail_on_batch
+        self.batches = 0
+
+    def get_games(self, game_pks, **kwargs):
+        self.batches += 1
+        if self.batches == self.fail_on_batch:
+            raise ConnectionError("injected failure")
+
+        return super().get_games(game_pks, **kwargs)
+
+# answers with some of the games in another state than the synthetic season has them in
+
+class OverriddenStatsAPIClient(benchmarks.SyntheticStatsAPIClient):
+
+    def __init__(self, season, statuses):
+        super().__init__(season)
+        self.statuses = statuses
+
+    def _get(self, request_url, params = None, cache_policy = None, use_cache = True):
+        response = super()._get(request_url, params, cache_policy, use_cache)
+        for schedule_day in response.get('dates', []):
+            for game in schedule_day['games']:
+                game['status'].update(self.statuses.get(game['gamePk'], {}))
+
+        return response
+
+def test_rerunning_days_changes_nothing():
+    conn = new_database()
+    client = benchmarks.SyntheticStatsAPIClient(season)
+    for day in days[:3]:
+        www.ingest_day(conn, client, day)
+    state = ledger(conn), summary(conn), appearances(conn)
+
+    assert www.ingest_day(conn, client, days[2]) == 0
+    assert www.catch_up(conn, client, days[2]) == 0
+    assert www.backfill(conn, client, days[0], days[2]) == 0
+    assert (ledger(conn), summary(conn), appearances(conn)) == state
+
+def test_failed_ingest_resumes_to_a_clean_run():
+    conn = new_database()
+    with pytest.raises(ConnectionError):
+        www.ingest_days(conn, FailingStatsAPIClient(season, fail_on_batch=2), days, chunk_days=3, max_workers=1)
+
+    # the first chunk went in whole, nothing of the second one did
+    assert [game_date for game_date, _ in ledger(conn)[0]] == [day.isoformat() for day in days[:3]]
+
+    www.ingest_days(conn, benchmarks.SyntheticStatsAPIClient(season), days, chunk_days=3, max_workers=1)
+
+    clean_conn = chronological_database()
+    assert ledger(conn) == ledger(clean_conn)
+    assert summary(conn) == summary(clean_conn)
+    assert appearances(conn) == appearances(clean_conn)
+
+def test_days_before_the_latest_are_rejected():
+    conn = new_database()
+    client = benchmarks.SyntheticStatsAPIClient(season)
+    www.ingest_day(conn, client, days[4])
+    state = ledger(conn), summary(conn)
+
+    with pytest.raises(ValueError):
+        www.ingest_day(conn, client, days[2])
+    with pytest.raises(ValueError):
+        www.ingest_days(conn, client, days[1:3])
+
+    assert www.missing_days(conn, days[4]) == []
+    assert (ledger(conn), summary(conn)) == state
+
+def test_backfill_rebuilds_around_older_days():
+    conn = new_database()
+    client = benchmarks.SyntheticStatsAPIClient(season)
+    for day in days[5:]:
+        www.ingest_day(conn, client, day)
+
+    www.backfill(conn, client, days[0], days[-1], chunk_days=3, max_workers=1)
+
+    clean_conn = chronological_database()
+    assert ledger(conn) == ledger(clean_conn)
+    assert summary(conn) == summary(clean_conn)
+    assert appearances(conn) == appearances(clean_conn)
+
+def test_days_with_unsettled_games_are_deferred():
+    conn = new_database()
+    game_pks = season.games_by_date[days[0]]
+
+    scheduled = OverriddenStatsAPIClient(season, {game_pks[0]: {'abstractGameState': 'Preview', 'codedGameState': 'S', 'detailedState': 'Scheduled'}})
+    assert www.ingest_day(conn, scheduled, days[0]) == 0
+    assert ledger(conn) == ([], [])
+
+    # a suspended game doesn't hold the day back, and isn't ingested until it is finished
+    suspended = OverriddenStatsAPIClient(season, {game_pks[0]: {'abstractGameState': 'Live', 'codedGameState': 'U', 'detailedState': 'Suspended: Rain'}})
+    assert www.ingest_day(conn, suspended, days[0]) == len(game_pks) - 1
+    assert game_pks[0] not in {game_pk for game_pk, _ in ledger(conn)[1]}
@@ -0,0 +1,88 @@
+import copy
+
+import waiver_wire_winner as www
+
+# applying diffPatch operations to the kept parts of a live feed
+
+def player(player_id, batting = None, pitching = None):
+    return {'person': {'id': player_id, 'fullName': f"Player {player_id}"}, 'parentTeamId': 1,
+            'stats': {'batting': batting or {}, 'pitching': pitching or {}}}
+
+def live_feed():
+    return {
+        'gameData': {'status': {'abstractGameState': 'Live'}},
+        'metaData': {'timeStamp': '20240601_200000'},
+        'liveData': {'boxscore': {'teams': {
+            'away': {'team': {'id': 1}, 'batters': [1, 2], 'players': {'ID1': player(1, {'hits': 1, 'homeRuns': 1}), 'ID2': player(2, {'hits': 0})}},
+            'home': {'team': {'id': 2}, 'batters': [], 'players': {'ID3': player(3, pitching={'outs': 3, 'strikeOuts': 1})}},
+        }}},
+    }
+
+def patch(*operations):
+    return [{'diff': list(operations)}]
+
+away_players = '/liveData/boxscore/teams/away/players'
+home_players = '/liveData/boxscore/teams/home/players'
+
+def test_add_and_replace_mark_the_patched_players():
+    feed = live_feed()
+    changed_players, operations_applied = www.apply_feed_patches(feed, patch(
+        {'op': 'add', 'path': f"{away_players}/ID2/stats/batting/doubles", 'value': 1},
+        {'op': 'replace', 'path': f"{home_players}/ID3/stats/pitching/outs", 'value': 6},
+        {'op': 'replace', 'path': '/metaData/timeStamp', 'value': '20240601_200500'},
+    ))
+
+    assert changed_players == {2, 3}
+    assert operations_applied == 3
+    assert feed['liveData']['boxscore']['teams']['away']['players']['ID2']['stats']['batting'] == {'hits': 0, 'doubles': 1}
+    assert feed['liveData']['boxscore']['teams']['home']['players']['ID3']['stats']['pitching']['outs'] == 6
+    assert feed['metaData']['timeStamp'] == '20240601_200500'
+
+def test_remove_and_list_operations():
+    feed = live_feed()
+    changed_players, operations_applied = www.apply_feed_patches(feed, patch(
+        {'op': 'remove', 'path': f"{away_players}/ID1/stats/batting/homeRuns"},
+        {'op': 'add', 'path': '/liveData/boxscore/teams/home/batters/-', 'value': 3},
+        {'op': 'add', 'path': '/liveData/boxscore/teams/away/batters/0', 'value': 9},
+        {'op': 'remove', 'path': '/liveData/boxscore/teams/away/batters/2'},
+    ))
+
+    assert changed_players == {1}
+    assert operations_applied == 4
+    assert feed['liveData']['boxscore']['teams']['away']['players']['ID1']['stats']['batting'] == {'hits': 1}
+    assert feed['liveData']['boxscore']['teams']['home']['batters'] == [3]
+    assert feed['liveData']['boxscore']['teams']['away']['batters'] == [9, 1]
+
+def test_move_marks_both_players():
+    feed = live_feed()
+    changed_players, operations_applied = www.apply_feed_patches(feed, patch(
+        {'op': 'move', 'from': f"{away_players}/ID1/stats/batting/homeRuns", 'path': f"{away_players}/ID2/stats/batting/homeRuns"},
+    ))
+
+    assert changed_players == {1, 2}
+    assert operations_applied == 1
+    assert 'homeRuns' not in feed['liveData']['boxscore']['teams']['away']['players']['ID1']['stats']['batting']
+    assert feed['liveData']['boxscore']['teams']['away']['players']['ID2']['stats']['batting']['homeRuns'] == 1
+
+def test_replacing_a_whole_team_rescores_everyone():
+    feed = live_feed()
+    changed_players, _ = www.apply_feed_patches(feed, patch({'op': 'replace', 'path': home_players, 'value': {'ID4': player(4, {'hits': 2})}}))
+    assert changed_players is None
+    assert list(feed['liveData']['boxscore']['teams']['home']['players']) == ['ID4']
+
+    team = copy.deepcopy(feed['liveData']['boxscore']['teams']['away'])
+    changed_players, _ = www.apply_feed_patches(feed, patch({'op': 'replace', 'path': '/liveData/boxscore/teams/away', 'value': team}))
+    assert changed_players is None
+
+def test_operations_outside_the_kept_feed_are_skipped():
+    feed = live_feed()
+    original_feed = copy.deepcopy(feed)
+    changed_players, operations_applied = www.apply_feed_patches(feed, patch(
+        {'op': 'add', 'path': '/liveData/plays/allPlays/-', 'value': {'result': {}}},
+        {'op': 'replace', 'path': f"{away_players}/ID7/stats/batting/hits", 'value': 1},
+        {'op': 'remove', 'path': '/liveData/boxscore/teams/away/batters/5'},
+    ))
+
+    assert changed_players == set()
+    assert operations_applied == 0
+    assert feed == original_feed
@@ -1,48 +1,433 @@
-from espn_api.baseball import League
-import pandas as pd
 import sqlite3
-from datetime import date, timedelta
-import requests
-import numpy as np
-import difflib
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import os
+import sys
+import json
+import hashlib
+import copy
+import ast
+import re
+import unicodedata
+import argparse
+from collections import defaultdict
+from string import Template
+import threading
+import time
+import resource
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# pandas, numpy, requests, espn_api and the email libraries are imported inside the functions that use
+# them, so importing this module (or running a read-only command) doesn't pay for what it never touches
 
 #------------ Build the databases for pitchers and hitters ------------------------#
 
-# database will store the following pieces of information to later perform analysis on
+# the database stores one row per game appearance in `appearances`, which the rest and scoring
+# distributions are aggregated from:
 # 1. MLBAM ID (for a unique identifier)
-# 2. Player Name (for easier visibility in results)
-# 3. Team ID (needed to join on a team's schedule to see if the player has a game that day)
-# 4. Current Days Rest (number of days since a player played their last game)
-# 5. Rest List (list of previous rest days between playing, i.e. 1, 2, 0, 1)
-# 6. Last Score (most recent number of fantasy points scored)
-# 7. Score List (list of previous points scored, i.e. 13, 10, -1, 7)
-# 8. Score Per Inning (mainly for pitchers and short-outing relievers, but normalize their score to an inning)
-# 9. Score Per Inning List (list of previous normalized score per inning)
+# 2. Game Date (the day the appearance happened)
+# 3. Role (pitcher or batter, a two-way player gets a row for each)
+# 4. Score (number of fantasy points scored)
+# 5. Score Per Unit (score per inning for pitchers and per plate appearance for batters, to normalize short outings)
+# 6. Rest Days (days since the player's previous appearance, empty for their first one)
+# 7. Scoring (the name of the league point system the score was calculated with)
+#
+# and a small summary row per player, role and point system in `player_summary`:
+# 1. Player Name (for easier visibility in results)
+# 2. Team ID (needed to join on a team's schedule to see if the player has a game that day)
+# 3. Current Days Rest (number of days since a player played their last game)
+# 4. Last Score and Last Score Per Unit (most recent appearance)
+# 5. Running statistics of the per unit scores (count, mean and M2 for Welford's algorithm, plus an
+#    exponentially decayed mean and variance) and a histogram of rest days with its median. These are
+#    updated in O(1) whenever an appearance is recorded, so ranking never has to re-scan a history
+
+player_roles = ['pitcher', 'batter']
+
+# the point system used by leagues that don't define their own
+
+default_scoring = 'default'
+
+# weight of the newest appearance in the decayed score mean and variance
+
+score_decay_alpha = 0.2
+
+running_stat_columns = {
+    'score_count': 'INTEGER',
+    'score_mean': 'REAL',
+    'score_m2': 'REAL',
+    'score_ewm_mean': 'REAL',
+    'score_ewm_var': 'REAL',
+    'rest_histogram': 'TEXT',
+    'median_rest': 'REAL',
+}
+
+player_summary_schema = f'''(scoring TEXT NOT NULL DEFAULT '{default_scoring}', mlbam_id INTEGER NOT NULL, role TEXT NOT NULL, player_name TEXT, team_id INTEGER,
+            cur_days_rest INTEGER, last_score INTEGER, last_score_per_unit REAL, PRIMARY KEY (scoring, mlbam_id, role))'''
 
 def build_database(conn):
     c = conn.cursor()
 
-    c.execute('''CREATE TABLE IF NOT EXISTS pitcher_rest_and_scoring
-                (mlbam_id INTEGER PRIMARY KEY, player_name TEXT, team_id INTEGER, cur_days_rest INTEGER, rest_list INTEGER[],
-            last_score INTEGER, score_list INTEGER[], score_per_inn REAL, score_per_inn_list REAL[])''')
+    c.execute(f'''CREATE TABLE IF NOT EXISTS appearances
+                (appearance_id INTEGER PRIMARY KEY AUTOINCREMENT, mlbam_id INTEGER NOT NULL, game_date TEXT, role TEXT NOT NULL,
+            score INTEGER, score_per_unit REAL, rest_days INTEGER, scoring TEXT NOT NULL DEFAULT '{default_scoring}')''')
 
-    c.execute('''CREATE TABLE IF NOT EXISTS batter_rest_and_scoring
-                (mlbam_id INTEGER PRIMARY KEY, player_name TEXT, team_id INTEGER, cur_days_rest INTEGER, rest_list INTEGER[],
-            last_score INTEGER, score_list INTEGER[], score_per_pa REAL, score_per_pa_list REAL[])''')
+    # the raw stat line of every player who appeared in a game, so any league's point system can be
+    # scored from the same ingested games (and re-scored when it changes)
+
+    c.execute('''CREATE TABLE IF NOT EXISTS stat_lines
+                (stat_line_id INTEGER PRIMARY KEY AUTOINCREMENT, game_date TEXT, mlbam_id INTEGER NOT NULL, player_name TEXT, team_id INTEGER,
+            batting TEXT, pitching TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stat_lines_date ON stat_lines (game_date)")
+
+    # the point systems the appearances were scored with
+
+    c.execute("CREATE TABLE IF NOT EXISTS scoring_configs (scoring TEXT PRIMARY KEY, point_systems TEXT)")
+
+    c.execute(f"CREATE TABLE IF NOT EXISTS player_summary {player_summary_schema}")
+
+    # databases from before there were several point systems get the scoring column, and the summary
+    # table is rebuilt since the column is part of its primary key
+
+    if 'scoring' not in {row[1] for row in c.execute("PRAGMA table_info(appearances)")}:
+        c.execute(f"ALTER TABLE appearances ADD COLUMN scoring TEXT NOT NULL DEFAULT '{default_scoring}'")
+
+    summary_columns = [row[1] for row in c.execute("PRAGMA table_info(player_summary)")]
+    if 'scoring' not in summary_columns:
+        c.execute("ALTER TABLE player_summary RENAME TO player_summary_unscored")
+        c.execute(f"CREATE TABLE player_summary {player_summary_schema}")
+        for column in summary_columns:
+            if column in running_stat_columns:
+                c.execute(f"ALTER TABLE player_summary ADD COLUMN {column} {running_stat_columns[column]}")
+        c.execute(f"INSERT INTO player_summary ({', '.join(summary_columns)}) SELECT {', '.join(summary_columns)} FROM player_summary_unscored")
+        c.execute("DROP TABLE player_summary_unscored")
+
+    c.execute("DROP INDEX IF EXISTS idx_appearances_player")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_appearances_scoring_player ON appearances (scoring, mlbam_id, role)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_appearances_date ON appearances (game_date)")
+
+    # who played whom, and every team's opponent tendencies built from those games (see update_team_strength)
+
+    c.execute("CREATE TABLE IF NOT EXISTS team_games (game_pk INTEGER, game_date TEXT, team_id INTEGER, opponent_id INTEGER, PRIMARY KEY (game_pk, team_id))")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_team_games_date ON team_games (game_date)")
+    c.execute('''CREATE TABLE IF NOT EXISTS team_strength
+                (scoring TEXT NOT NULL, team_id INTEGER NOT NULL, games INTEGER, k_rate REAL, walks REAL, runs_allowed REAL,
+            pitcher_points_allowed REAL, batter_points_allowed REAL, updated_through TEXT, PRIMARY KEY (scoring, team_id))''')
+
+    # players that have been matched to an ESPN player once, so they never have to be fuzzy matched again.
+    # An ESPN player belongs to one MLB player at most, maps from before that was checked drop the ESPN
+    # ids they gave to several players. ESPN's player universe (with the team of the players who were
+    # free agents) is kept next to it, to check a name against every ESPN player before it is mapped
+
+    c.execute("CREATE TABLE IF NOT EXISTS espn_player_map (mlbam_id INTEGER PRIMARY KEY, espn_id INTEGER, espn_name TEXT)")
+    c.execute("DELETE FROM espn_player_map WHERE espn_id IN (SELECT espn_id FROM espn_player_map GROUP BY espn_id HAVING COUNT(*) > 1)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_espn_player_map_espn_id ON espn_player_map (espn_id)")
+    c.execute("CREATE TABLE IF NOT EXISTS espn_players (espn_id INTEGER PRIMARY KEY, name TEXT, pro_team TEXT)")
+
+    # the ledger of every day and game that has been ingested, so running a day twice never counts it twice.
+    # It replaces the checkpoints the backfill used to keep, and a database from before the ledger starts
+    # it off with the days its appearances were recorded on
+
+    c.execute("CREATE TABLE IF NOT EXISTS ingested_days (game_date TEXT PRIMARY KEY, games INTEGER, ingested_at TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS ingested_games (game_pk INTEGER PRIMARY KEY, game_date TEXT, ingested_at TEXT)")
+
+    existing_tables = {row[0] for row in c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'backfill_checkpoints' in existing_tables:
+        c.execute("INSERT OR IGNORE INTO ingested_days SELECT game_date, games, completed_at FROM backfill_checkpoints")
+        c.execute("DROP TABLE backfill_checkpoints")
+    if c.execute("SELECT 1 FROM ingested_days LIMIT 1").fetchone() is None:
+        c.execute("INSERT INTO ingested_days SELECT DISTINCT game_date, NULL, NULL FROM appearances WHERE game_date IS NOT NULL")
+
+    # daily snapshots of each league's free agent pool, so ESPN is only asked once the snapshot goes stale
+
+    c.execute("CREATE TABLE IF NOT EXISTS free_agent_snapshots (league_id INTEGER, snapshot_date TEXT, fetched_at REAL, players INTEGER, PRIMARY KEY (league_id, snapshot_date))")
+    c.execute('''CREATE TABLE IF NOT EXISTS free_agent_snapshot_players
+                (league_id INTEGER, snapshot_date TEXT, espn_id INTEGER, name TEXT, PRIMARY KEY (league_id, snapshot_date, espn_id))''')
+
+    # databases created before the running statistics existed get the columns added and filled in from the appearance log
+
+    existing_columns = {row[1] for row in c.execute("PRAGMA table_info(player_summary)")}
+    missing_columns = [column for column in running_stat_columns if column not in existing_columns]
+    for column in missing_columns:
+        c.execute(f"ALTER TABLE player_summary ADD COLUMN {column} {running_stat_columns[column]}")
 
     conn.commit()
 
+    if migrate_legacy_tables(conn) or missing_columns:
+        rebuild_running_statistics(conn)
+
+# the rest and score histories used to be stored as stringified python lists in one table per role.
+# The lists are parsed (never eval'd) and every entry becomes its own row in `appearances`, the
+# legacy tables are then renamed to *_legacy so the migration only ever runs once
+
+legacy_tables = {
+    'pitcher': ('pitcher_rest_and_scoring', 'score_per_inn', 'score_per_inn_list'),
+    'batter': ('batter_rest_and_scoring', 'score_per_pa', 'score_per_pa_list'),
+}
+
+def _parse_legacy_list(list_string):
+    if not list_string:
+        return []
+
+    # lists written from numpy values look like [np.int64(2), np.float64(1.5)]
+    return ast.literal_eval(re.sub(r"np\.\w+\(([^()]*)\)", r"\1", list_string))
+
+def migrate_legacy_tables(conn):
+    c = conn.cursor()
+    existing_tables = {row[0] for row in c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    migrated = False
+
+    with conn:
+        for role, (table, score_per_unit_col, score_per_unit_list_col) in legacy_tables.items():
+            if table not in existing_tables:
+                continue
+
+            c.execute(f"SELECT mlbam_id, player_name, team_id, cur_days_rest, rest_list, last_score, score_list, {score_per_unit_col}, {score_per_unit_list_col} FROM {table}")
+
+            for mlbam_id, player_name, team_id, cur_days_rest, rest_list, last_score, score_list, score_per_unit, score_per_unit_list in c.fetchall():
+
+                # the lists hold every appearance but the latest one, the rest list starts at the second appearance
+
+                scores = _parse_legacy_list(score_list) + [last_score]
+                scores_per_unit = _parse_legacy_list(score_per_unit_list) + [score_per_unit]
+                rest_days = [None] + _parse_legacy_list(rest_list)
+
+                c.executemany("INSERT INTO appearances (mlbam_id, game_date, role, score, score_per_unit, rest_days) VALUES (?, NULL, ?, ?, ?, ?)",
+                              [(mlbam_id, role, score, score_unit, rest) for score, score_unit, rest in zip(scores, scores_per_unit, rest_days)])
+
+                c.execute('''INSERT OR REPLACE INTO player_summary (mlbam_id, role, player_name, team_id, cur_days_rest, last_score, last_score_per_unit)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', (mlbam_id, role, player_name, team_id, cur_days_rest, last_score, score_per_unit))
+
+            c.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            migrated = True
+
+    return migrated
+
+# ------------- Running statistics kept on every player's summary row ------------- #
+
+def new_running_statistics():
+    return {'score_count': 0, 'score_mean': 0.0, 'score_m2': 0.0, 'score_ewm_mean': None, 'score_ewm_var': 0.0, 'rest_histogram': {}, 'median_rest': None}
+
+# median straight from a {rest days: count} histogram, rest days are small integers so the histogram
+# stays a handful of entries and the median is exact
+
+def _histogram_median(histogram):
+    total = sum(histogram.values())
+    if total == 0:
+        return None
+
+    lower_position, upper_position = (total + 1) // 2, (total + 2) // 2
+    lower = upper = None
+    seen = 0
+    for rest_days in sorted(histogram):
+        seen += histogram[rest_days]
+        if lower is None and seen >= lower_position:
+            lower = rest_days
+        if seen >= upper_position:
+            upper = rest_days
+            break
+
+    return (lower + upper) / 2
+
+# fold one appearance into a player's running statistics in O(1): Welford's update for the mean and M2,
+# the exponentially decayed mean and variance, and the rest day histogram (first appearances have no rest)
+
+def update_running_statistics(stats, score_per_unit, rest_days, alpha = score_decay_alpha):
+    stats['score_count'] += 1
+    delta = score_per_unit - stats['score_mean']
+    stats['score_mean'] += delta / stats['score_count']
+    stats['score_m2'] += delta * (score_per_unit - stats['score_mean'])
+
+    if stats['score_ewm_mean'] is None:
+        stats['score_ewm_mean'] = score_per_unit
+        stats['score_ewm_var'] = 0.0
+    else:
+        difference = score_per_unit - stats['score_ewm_mean']
+        increment = alpha * difference
+        stats['score_ewm_mean'] += increment
+        stats['score_ewm_var'] = (1 - alpha) * (stats['score_ewm_var'] + difference * increment)
+
+    if rest_days is not None:
+        stats['rest_histogram'][rest_days] = stats['rest_histogram'].get(rest_days, 0) + 1
+        stats['median_rest'] = _histogram_median(stats['rest_histogram'])
+
+    return stats
+
+def _running_statistics_from_row(score_count, score_mean, score_m2, score_ewm_mean, score_ewm_var, rest_histogram, median_rest):
+    if not score_count:
+        return new_running_statistics()
+
+    return {
+        'score_count': score_count, 'score_mean': score_mean, 'score_m2': score_m2, 'score_ewm_mean': score_ewm_mean, 'score_ewm_var': score_ewm_var,
+        'rest_histogram': {int(rest_days): count for rest_days, count in json.loads(rest_histogram or '{}').items()}, 'median_rest': median_rest,
+    }
+
+def _running_statistics_values(stats):
+    return (stats['score_count'], stats['score_mean'], stats['score_m2'], stats['score_ewm_mean'], stats['score_ewm_var'], json.dumps(stats['rest_histogram']), stats['median_rest'])
+
+# recompute every player's running statistics from the appearance log, only needed after a migration
+
+def rebuild_running_statistics(conn):
+    c = conn.cursor()
+    all_stats = {}
+
+    for scoring, mlbam_id, role, score_per_unit, rest_days in c.execute("SELECT scoring, mlbam_id, role, score_per_unit, rest_days FROM appearances ORDER BY appearance_id"):
+        stats = all_stats.setdefault((scoring, mlbam_id, role), new_running_statistics())
+        update_running_statistics(stats, score_per_unit, rest_days)
+
+    with conn:
+        c.executemany(f"UPDATE player_summary SET {', '.join(f'{column} = ?' for column in running_stat_columns)} WHERE scoring = ? AND mlbam_id = ? AND role = ?",
+                      [_running_statistics_values(stats) + key for key, stats in all_stats.items()])
+
 # --------------------- Get info for that is needed for further calculations from the MLB Stats API -------------#
 
 base_url = "https://statsapi.mlb.com/api"
 
+# the only parts of the live feed that the fantasy scoring reads. Passing these as the `fields` filter
+# has the API trim the several MB play-by-play document down to the boxscore player lines server side
+
+boxscore_fields = [
+    'gameData', 'status', 'abstractGameState', 'liveData', 'boxscore', 'teams', 'away', 'home', 'team', 'players', 'person', 'id', 'fullName', 'parentTeamId', 'stats', 'batting', 'pitching',
+    'outs', 'earnedRuns', 'wins', 'losses', 'saves', 'blownSaves', 'strikeOuts', 'hits', 'baseOnBalls', 'shutouts', 'hitByPitch',
+    'wildPitches', 'balks', 'pickoffs', 'completeGames', 'holds', 'doubles', 'triples', 'homeRuns', 'runs', 'rbi', 'stolenBases',
+    'intentionalWalks', 'sacBunts', 'sacFlies', 'caughtStealing', 'groundIntoDoublePlay', 'plateAppearances'
+]
+
+# local cache of API responses, stored in SQLite and keyed by a hash of the endpoint and its params.
+# Entries without an expiry (finished games) are kept forever, everything else expires after its TTL.
+# Once the cache grows past max_bytes the least recently used responses are evicted first
+
+class ResponseCache:
+
+    def __init__(self, path, max_bytes = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        # the client fetches games on a thread pool, so the connection is shared behind a lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS http_cache
+                    (cache_key TEXT PRIMARY KEY, url TEXT, body BLOB, size INTEGER, stored_at REAL, expires_at REAL, last_access REAL)''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_http_cache_last_access ON http_cache (last_access)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(request_url, params = None):
+        key_source = json.dumps([request_url, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    # returns the cached body, or None if it is missing or expired. Offline replays pass allow_expired
+    # so that anything that was ever fetched can still be served
+
+    def get(self, cache_key, allow_expired = False):
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute("SELECT body, expires_at FROM http_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                return None
+
+            body, expires_at = row
+            if expires_at is not None and expires_at < now and not allow_expired:
+                return None
+
+            self.conn.execute("UPDATE http_cache SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+            self.conn.commit()
+
+        return body
+
+    # store a response, ttl of None means the response never expires
+
+    def put(self, cache_key, request_url, body, ttl = None):
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?)", (cache_key, request_url, body, len(body), now, expires_at, now))
+
+            # keep the most recently used responses that fit under the size cap and evict the rest
+            self.conn.execute('''DELETE FROM http_cache WHERE cache_key IN
+                        (SELECT cache_key FROM (SELECT cache_key, SUM(size) OVER (ORDER BY last_access DESC, stored_at DESC) AS running_size FROM http_cache)
+                        WHERE running_size > ?)''', (self.max_bytes,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# a game (or a whole schedule) only stops changing once every game in it has gone final
+
+def _game_is_final(game_data):
+    return game_data.get('gameData', {}).get('status', {}).get('abstractGameState') == 'Final'
+
+def _schedule_is_final(schedule_data):
+    games = [game for day in schedule_data.get('dates', []) for game in day.get('games', [])]
+    return len(games) > 0 and all(game.get('status', {}).get('abstractGameState') == 'Final' for game in games)
+
 class MLBStatsAPIClient:
     
-    def __init__(self):
-        pass
+    # every request goes through one keep-alive session so a slate of games reuses the same
+    # connection pool instead of paying a fresh TCP + TLS handshake per game. Transient failures
+    # (rate limiting, 5xx) are retried with exponential backoff by the adapter.
+    # Pass a ResponseCache to keep final games and schedules on disk. With offline=True nothing is
+    # requested from the API and every response has to come out of the cache
+
+    def __init__(self, max_workers = 8, retries = 3, backoff_factor = 0.5, timeout = 30, cache = None, offline = False, schedule_ttl = 600, metrics = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.schedule_ttl = schedule_ttl
+
+        if offline and cache is None:
+            raise ValueError("offline mode needs a response cache to replay from")
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # shared GET helper for all of the endpoints. Returns values in JSON form.
+    # cache_policy looks at the parsed response and returns how long it can be cached for:
+    # a number of seconds, None to keep it forever, or False to not cache it at all.
+    # use_cache=False skips the cache both ways, for responses that have to be current
+
+    def _get(self, request_url, params = None, cache_policy = None, use_cache = True):
+        cache_key = None
+
+        if self.cache is not None and use_cache:
+            cache_key = ResponseCache.make_key(request_url, params)
+            body = self.cache.get(cache_key, allow_expired=self.offline)
+            if body is not None:
+                if self.metrics is not None:
+                    self.metrics.add('http_cache_hits')
+                return json.loads(body)
+
+        if self.offline:
+            raise LookupError(f"{request_url} (params {params}) is not in the response cache (offline mode)")
+
+        start = time.perf_counter()
+        response = self.session.get(request_url, params=params, timeout=self.timeout)
+        if self.metrics is not None:
+            # http_bytes is what came over the wire (compressed), http_body_bytes what it was decoded to
+            self.metrics.add('http_requests')
+            self.metrics.add('http_bytes', response.raw.tell())
+            self.metrics.add('http_body_bytes', len(response.content))
+            self.metrics.add('http_seconds', time.perf_counter() - start)
+
+        response.raise_for_status()
+        response_json = response.json()
+
+        if cache_key is not None and cache_policy is not None:
+            ttl = cache_policy(response_json)
+            if ttl is not False:
+                self.cache.put(cache_key, request_url, response.content, ttl=ttl)
+
+        return response_json
     
     # get game data of a specific game given a game_pk. Returns values in JSON form
 
@@ -62,18 +447,51 @@ class MLBStatsAPIClient:
         if fields:
             query_params["fields"] = ",".join(fields)
         
-        response = requests.request(method="GET", url=request_url, params=query_params)
-    
-        return response.json()
+        # finished games never change so they are cached permanently
+        return self._get(request_url, params=query_params, cache_policy=lambda game_data: None if _game_is_final(game_data) else False)
+
+    # the JSON patches that bring a game's live feed from start_timecode up to end_timecode (or up to now).
+    # Returns a list of {'diff': [operations]}, or the whole feed when that would be smaller. Never cached,
+    # the answer depends on how far the game has got
+
+    def get_game_diff_patch(self, game_pk, start_timecode, end_timecode = None):
+        request_url = f"{base_url}/v1.1/game/{game_pk}/feed/live/diffPatch"
+
+        query_params = {"startTimecode": start_timecode}
+
+        if end_timecode:
+            query_params["endTimecode"] = end_timecode
+
+        return self._get(request_url, params=query_params)
+
+    # boxscore-only version of get_game, the response keeps the same shape (liveData -> boxscore -> teams)
+    # but without the play-by-play, so it is a few KB per game instead of a few MB
+
+    def get_game_boxscore(self, game_pk):
+        return self.get_game(game_pk, fields=boxscore_fields)
+
+    # get game data for many games at once. The requests run concurrently on a bounded thread pool
+    # and the results come back in the same order as the game_pks that were passed in
+
+    def get_games(self, game_pks, **kwargs):
+        game_pks = list(game_pks)
+
+        if len(game_pks) <= 1:
+            return [self.get_game(game_pk, **kwargs) for game_pk in game_pks]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(game_pks))) as executor:
+            return list(executor.map(lambda game_pk: self.get_game(game_pk, **kwargs), game_pks))
     
-    # get the JSON response of games from a specific day (normally used for the previous day)
+    # get the JSON response of games from a specific day (normally used for the previous day).
+    # Pass use_cache=False to always ask the API, e.g. while the day's games are being played
 
-    def get_games_by_date(self, date):
+    def get_games_by_date(self, date, use_cache = True):
         request_url = f"{base_url}/v1/schedule/?sportId=1&date={date}"
-        
-        response = requests.request(method="GET", url=request_url)
-    
-        return response.json()
+
+        if not use_cache:
+            return self._get(request_url, use_cache=False)
+
+        return self._get_schedule(request_url)
     
     # get the list of teams that are playing on a certain day
 
@@ -81,9 +499,12 @@ class MLBStatsAPIClient:
 
         request_url = f"{base_url}/v1/schedule/?sportId=1&scheduleTypes=games&date={date}"
         
-        response = requests.request(method="GET", url=request_url)
-    
-        return response.json()
+        return self._get_schedule(request_url)
+
+    # schedules are cached for a short time while games can still change, and permanently once they are all final
+
+    def _get_schedule(self, request_url):
+        return self._get(request_url, cache_policy=lambda schedule_data: None if _schedule_is_final(schedule_data) else self.schedule_ttl)
 
 # ------------- Helper Methods to hit the create MLBStats Client and Grab Relevant Fantasy Information -------- #
 
@@ -97,451 +518,2236 @@ def get_days_previous_games(client, date):
     return previous_day_games
 
 # Define the point system for fantasy scoring using the league's rules
-# and calculate what a player scored based on their results
 
-def calculate_player_scoring(client, games_to_run):
-    
-    pitching_point_system = {
-        'outs': 1,
-        'earnedRuns': -2,
-        'wins': 5,
-        'losses': -3,
-        'saves': 12,
-        'blownSaves': -4,
-        'strikeOuts': 5,
-        'hits': -1,
-        'baseOnBalls': -1,
-        'shutouts': 50,
-        'hitByPitch': -1,
-        'wildPitches': -1,
-        'balks': -7,
-        'pickoffs': 7,
-        'completeGames': 50,
-        'holds': 7
-    }
+pitching_point_system = {
+    'outs': 1,
+    'earnedRuns': -2,
+    'wins': 5,
+    'losses': -3,
+    'saves': 12,
+    'blownSaves': -4,
+    'strikeOuts': 5,
+    'hits': -1,
+    'baseOnBalls': -1,
+    'shutouts': 50,
+    'hitByPitch': -1,
+    'wildPitches': -1,
+    'balks': -7,
+    'pickoffs': 7,
+    'completeGames': 50,
+    'holds': 7
+}
+
+batting_point_system = {
+    'doubles': 5,
+    'triples': 10,
+    'homeRuns': 14,
+    'baseOnBalls': 1,
+    'runs': 2,
+    'rbi': 4,
+    'stolenBases': 9,
+    'strikeOuts': -1,
+    'intentionalWalks': 7,
+    'hitByPitch': 1,
+    'sacBunts': 1,
+    'sacFlies': 1,
+    'caughtStealing': -2,
+    'groundIntoDoublePlay': -1
+
+}
+
+# every point system by name, as {'pitching': {...}, 'batting': {...}}. Leagues with other rules add
+# their own (see load_leagues) and the nightly stat lines are scored once per point system
+
+default_scoring_configs = {default_scoring: {'pitching': pitching_point_system, 'batting': batting_point_system}}
+
+# the boxscore fields to request so that every point system can be scored, not just the default one
+
+def scoring_fields(scoring_configs = default_scoring_configs):
+    stat_names = {stat for point_systems in scoring_configs.values() for point_system in point_systems.values() for stat in point_system}
+
+    return boxscore_fields + sorted(stat_names - set(boxscore_fields))
+
+# score one batch of stat lines with every point system, {scoring: (pitcher_df, batter_df)}
+
+def score_for_scoring_configs(stat_lines, scoring_configs = default_scoring_configs):
+    return {scoring: score_stat_lines(stat_lines, point_systems['pitching'], point_systems['batting']) for scoring, point_systems in scoring_configs.items()}
+
+# pull every player's stat line out of a batch of boxscores as
+# (player name, player id, team id, batting stats, pitching stats) tuples
+
+def extract_stat_lines(games_data):
+    stat_lines = []
+
+    for game_data in games_data:
+        for team in ['away', 'home']:
+            stat_lines.extend(_stat_line(player_info) for player_info in game_data['liveData']['boxscore']['teams'][team]['players'].values())
 
-    batting_point_system = {
-        'doubles': 5,
-        'triples': 10,
-        'homeRuns': 14,
-        'baseOnBalls': 1,
-        'runs': 2,
-        'rbi': 4,
-        'stolenBases': 9,
-        'strikeOuts': -1,
-        'intentionalWalks': 7,
-        'hitByPitch': 1,
-        'sacBunts': 1,
-        'sacFlies': 1,
-        'caughtStealing': -2,
-        'groundIntoDoublePlay': -1
+    return stat_lines
 
-    }
+def _stat_line(player_info):
+    person = player_info['person']
+    stats = player_info['stats']
 
-    # iterate through the games and get the player info
+    # if a player doesn't have a team_id, give him an arbitrary one that won't ever come up
 
-    pitcher_data = []
-    batter_data = []
+    return (person['fullName'], person['id'], player_info.get('parentTeamId', 999), stats['batting'], stats['pitching'])
 
-    for game_pk in games_to_run:
-        
-        game_data = client.get_game(game_pk)
+# turn a list of stat dictionaries into one integer matrix with a column per stat (missing stats are 0)
 
-        # Extract the relevant data that will be added to the database
+def build_stat_matrix(stat_dicts, stat_names):
+    import numpy as np
 
-        for team in ['away', 'home']:
-            for player_id, player_info in game_data['liveData']['boxscore']['teams'][team]['players'].items():
-                player_name = player_info['person']['fullName']
-                player_id = player_info['person']['id']
+    values = (stats.get(stat, 0) for stats in stat_dicts for stat in stat_names)
 
-                # if a player doesn't have a team_id, give him an arbitrary one that won't ever come up
+    return np.fromiter(values, dtype=np.int64, count=len(stat_dicts) * len(stat_names)).reshape(len(stat_dicts), len(stat_names))
 
-                if 'parentTeamId' in player_info:
-                    team_id = player_info['parentTeamId']
-                else:
-                    team_id = 999
-                game_batting_stats = player_info['stats']['batting']
-                game_pitching_stats = player_info['stats']['pitching']
-
-                # Calculate fantasy scores for pitching
-
-                innings_pitched_game = game_pitching_stats.get('outs', 0) / 3
-
-                if innings_pitched_game > 0:
-                    game_pitching_score = sum(game_pitching_stats.get(stat, 0) * pitching_point_system.get(stat, 0) for stat in pitching_point_system)
-                    earned_runs_game = game_pitching_stats.get('earnedRuns', 0)
-                    if innings_pitched_game >= 6 and earned_runs_game <= 3:
-                        game_pitching_score += 8
-                    game_pitching_score_per_inning = round(game_pitching_score / innings_pitched_game, 1)
-
-                    pitcher_data.append({
-                        'Player Name': player_name,
-                        'Player ID': player_id,
-                        'Team ID': team_id,
-                        'Game Pitching Fantasy Score': game_pitching_score,
-                        'Game Pitching Fantasy Score per Inning': game_pitching_score_per_inning,
-                    })
-
-                # Calculate fantasy scores for batting
-
-                plate_appearances = game_batting_stats.get('plateAppearances', 0)
-                hits = game_batting_stats.get('hits', 0)
-
-                if plate_appearances > 0:
-                    game_batting_score = sum(game_batting_stats.get(stat, 0) * batting_point_system.get(stat, 0) for stat in batting_point_system)
-                    if hits > 0:
-                        singles = hits - game_batting_stats.get('doubles', 0) - game_batting_stats.get('triples', 0) - game_batting_stats.get('homeRuns', 0)
-                        game_batting_score += (singles * 2)
-                    game_batting_score_per_pa = round(game_batting_score / plate_appearances, 1)\
-
-                    batter_data.append({
-                        'Player Name': player_name,
-                        'Player ID': player_id,
-                        'Team ID': team_id,
-                        'Game Batting Fantasy Score': game_batting_score,
-                        'Game Batting Fantasy Score per PA': game_batting_score_per_pa,
-                    })
+# calculate what every player scored from a batch of stat lines. The stat lines of everyone who pitched
+# (and everyone who batted) are turned into one stat matrix and scored with a single matrix-vector product
+# against the league's weights, the quality start and singles bonuses are applied as vectorized masks
 
-    # Create DataFrames of the player data which will later be written back to the database
-    pitcher_df = pd.DataFrame(pitcher_data)
-    batter_df = pd.DataFrame(batter_data)
+def score_stat_lines(stat_lines, pitching_point_system = pitching_point_system, batting_point_system = batting_point_system):
+    import numpy as np
+    import pandas as pd
+
+    # Calculate fantasy scores for pitching
+
+    pitching_lines = [line for line in stat_lines if line[4].get('outs', 0) > 0]
+
+    pitching_stats = list(dict.fromkeys(list(pitching_point_system) + ['outs', 'earnedRuns']))
+    pitching_matrix = build_stat_matrix([line[4] for line in pitching_lines], pitching_stats)
+    pitching_weights = np.array([pitching_point_system.get(stat, 0) for stat in pitching_stats], dtype=np.int64)
+
+    outs = pitching_matrix[:, pitching_stats.index('outs')]
+    earned_runs = pitching_matrix[:, pitching_stats.index('earnedRuns')]
+
+    # quality start: 6+ innings (18 outs) with 3 or fewer earned runs
+
+    pitching_scores = pitching_matrix @ pitching_weights + 8 * ((outs >= 18) & (earned_runs <= 3))
+
+    # python's round (not np.round) so the per inning values round exactly like they always have
+
+    pitcher_df = pd.DataFrame({
+        'Player Name': [line[0] for line in pitching_lines],
+        'Player ID': np.array([line[1] for line in pitching_lines], dtype=np.int64),
+        'Team ID': np.array([line[2] for line in pitching_lines], dtype=np.int64),
+        'Game Pitching Fantasy Score': pitching_scores,
+        'Game Pitching Fantasy Score per Inning': np.array([round(score_per_inning, 1) for score_per_inning in (pitching_scores / (outs / 3)).tolist()], dtype=np.float64),
+    })
+
+    # Calculate fantasy scores for batting
+
+    batting_lines = [line for line in stat_lines if line[3].get('plateAppearances', 0) > 0]
+
+    batting_stats = list(dict.fromkeys(list(batting_point_system) + ['plateAppearances', 'hits', 'doubles', 'triples', 'homeRuns']))
+    batting_matrix = build_stat_matrix([line[3] for line in batting_lines], batting_stats)
+    batting_weights = np.array([batting_point_system.get(stat, 0) for stat in batting_stats], dtype=np.int64)
+
+    column = {stat: batting_matrix[:, i] for i, stat in enumerate(batting_stats)}
+    singles = column['hits'] - column['doubles'] - column['triples'] - column['homeRuns']
+
+    # singles are worth 2 points each
+
+    batting_scores = batting_matrix @ batting_weights + np.where(column['hits'] > 0, singles * 2, 0)
+
+    batter_df = pd.DataFrame({
+        'Player Name': [line[0] for line in batting_lines],
+        'Player ID': np.array([line[1] for line in batting_lines], dtype=np.int64),
+        'Team ID': np.array([line[2] for line in batting_lines], dtype=np.int64),
+        'Game Batting Fantasy Score': batting_scores,
+        'Game Batting Fantasy Score per PA': np.array([round(score_per_pa, 1) for score_per_pa in (batting_scores / column['plateAppearances']).tolist()], dtype=np.float64),
+    })
 
     return pitcher_df, batter_df
 
-# method to write back the updated dataframes to the database to be used in the future
+# calculate what every player scored in a list of games based on their results
 
-def update_player_data(conn, pitcher_df, batter_df):
+def calculate_player_scoring(client, games_to_run, pitching_point_system = pitching_point_system, batting_point_system = batting_point_system):
 
-    # Connect to the SQLite database
+    # fetch every game concurrently up front, the results keep the order of games_to_run
 
-    c = conn.cursor()
+    games_data = client.get_games(games_to_run, fields=boxscore_fields)
 
-    # Fetch the existing data from the database
+    # Create DataFrames of the player data which will later be written back to the database
+    return score_stat_lines(extract_stat_lines(games_data), pitching_point_system, batting_point_system)
 
-    c.execute("SELECT * FROM pitcher_rest_and_scoring")
-    existing_pitchers = pd.DataFrame(c.fetchall(), columns=['mlbam_id', 'player_name', 'team_id', 'cur_days_rest', 'rest_list', 'last_score', 'score_list', 'score_per_inn', 'score_per_inn_list'])
+# dates come in as MM/DD/YYYY strings from the pipeline, the database stores ISO dates so they sort
 
-    c.execute("SELECT * FROM batter_rest_and_scoring")
-    existing_batters = pd.DataFrame(c.fetchall(), columns=['mlbam_id', 'player_name', 'team_id', 'cur_days_rest', 'rest_list', 'last_score', 'score_list', 'score_per_pa', 'score_per_pa_list'])
+def _iso_date(game_date):
+    if game_date is None:
+        return None
+    if isinstance(game_date, date):
+        return game_date.isoformat()
+    if '/' in game_date:
+        return datetime.strptime(game_date, "%m/%d/%Y").date().isoformat()
+    return game_date
 
-    # Update the data for pitchers who played today
+# method to write back the day's appearances to the database to be used in the future.
+# Only the players who appeared are touched row by row, keyed on mlbam_id, so the nightly cost depends
+# on the size of the slate and not on the size of the tables. Everything is applied in one transaction
 
-    for _, row in pitcher_df.iterrows():
-        player_name = row['Player Name']
-        player_id = row['Player ID']
-        team_id = row['Team ID']
-        game_pitching_score = row['Game Pitching Fantasy Score']
-        game_pitching_score_per_inning = row['Game Pitching Fantasy Score per Inning']
+score_columns = {
+    'pitcher': ('Game Pitching Fantasy Score', 'Game Pitching Fantasy Score per Inning'),
+    'batter': ('Game Batting Fantasy Score', 'Game Batting Fantasy Score per PA'),
+}
 
-        if player_name in existing_pitchers['player_name'].values:
-            player_data = existing_pitchers.loc[existing_pitchers['player_name'] == player_name]
-            
-            # Update rest_list and cur_days_rest
+def update_player_data(conn, pitcher_df, batter_df, game_date = None, scoring = default_scoring):
 
-            rest_list = player_data['rest_list'].values[0]
-            if rest_list is None:
-                rest_list = []
-            else:
-                rest_list = eval(rest_list)
-            rest_list.append(player_data['cur_days_rest'].values[0])  # Add the previous rest days to the list
-            existing_pitchers.loc[existing_pitchers['player_name'] == player_name, 'rest_list'] = str(rest_list)
-            existing_pitchers.loc[existing_pitchers['player_name'] == player_name, 'cur_days_rest'] = 0
+    with conn:
+        _apply_player_updates(conn.cursor(), pitcher_df, batter_df, _iso_date(game_date), scoring)
 
-            # Update score_list and last_score
+def _apply_player_updates(c, pitcher_df, batter_df, game_date, scoring = default_scoring):
 
-            score_list = player_data['score_list'].values[0]
-            if score_list is None:
-                score_list = []
-            else:
-                score_list = eval(score_list)
-            score_list.append(player_data['last_score'].values[0])  # Add the previous score to the list
-            existing_pitchers.loc[existing_pitchers['player_name'] == player_name, 'score_list'] = str(score_list)
-            existing_pitchers.loc[existing_pitchers['player_name'] == player_name, 'last_score'] = game_pitching_score
+    for role, player_df in [('pitcher', pitcher_df), ('batter', batter_df)]:
+        score_col, score_per_unit_col = score_columns[role]
 
-            # Update score_per_inn_list and score_per_inn
+        player_rows = [(int(player_id), player_name, int(team_id), int(score), float(score_per_unit))
+                       for player_name, player_id, team_id, score, score_per_unit
+                       in zip(player_df['Player Name'], player_df['Player ID'], player_df['Team ID'], player_df[score_col], player_df[score_per_unit_col])]
 
-            score_per_inn_list = player_data['score_per_inn_list'].values[0]
-            if score_per_inn_list is None:
-                score_per_inn_list = []
-            else:
-                score_per_inn_list = eval(score_per_inn_list)
-            score_per_inn_list.append(player_data['score_per_inn'].values[0])  # Add the previous score per inning to the list
-            existing_pitchers.loc[existing_pitchers['player_name'] == player_name, 'score_per_inn_list'] = str(score_per_inn_list)
-            existing_pitchers.loc[existing_pitchers['player_name'] == player_name, 'score_per_inn'] = game_pitching_score_per_inning
+        # load the current rest and running statistics of just the players who appeared
 
-        else:
-            new_row = {'mlbam_id': player_id, 'player_name': player_name, 'team_id': team_id, 'cur_days_rest': 0, 'rest_list': str([]), 'last_score': game_pitching_score, 'score_list': str([]), 'score_per_inn': game_pitching_score_per_inning, 'score_per_inn_list': str([])}
-            existing_pitchers = pd.concat([existing_pitchers, pd.DataFrame([new_row])], ignore_index=True)
+        player_ids = list({row[0] for row in player_rows})
+        player_states = {}
+        if player_ids:
+            c.execute(f"SELECT mlbam_id, cur_days_rest, {', '.join(running_stat_columns)} FROM player_summary WHERE scoring = ? AND role = ? AND mlbam_id IN ({', '.join('?' * len(player_ids))})",
+                      [scoring, role] + player_ids)
+            player_states = {row[0]: (row[1], _running_statistics_from_row(*row[2:])) for row in c.fetchall()}
 
-    # Update the data for batters who played today
+        # the rest before an appearance is the player's current days rest (nothing for a new player,
+        # and 0 for the second game of a doubleheader), then the appearance is folded into the statistics
 
-    for _, row in batter_df.iterrows():
-        player_name = row['Player Name']
-        player_id = row['Player ID']
-        team_id = row['Team ID']
-        game_batting_score = row['Game Batting Fantasy Score']
-        game_batting_score_per_pa = row['Game Batting Fantasy Score per PA']
+        appearance_rows = []
+        summary_rows = []
+        for player_id, player_name, team_id, score, score_per_unit in player_rows:
+            rest_days, stats = player_states.get(player_id, (None, new_running_statistics()))
+            update_running_statistics(stats, score_per_unit, rest_days)
+            player_states[player_id] = (0, stats)
 
-        if player_name in existing_batters['player_name'].values:
-            player_data = existing_batters.loc[existing_batters['player_name'] == player_name]
-            
-            # Update rest_list and cur_days_rest
+            appearance_rows.append((player_id, game_date, role, score, score_per_unit, rest_days, scoring))
+            summary_rows.append((scoring, player_id, role, player_name, team_id, score, score_per_unit) + _running_statistics_values(stats))
 
-            rest_list = player_data['rest_list'].values[0]
-            if rest_list is None:
-                rest_list = []
-            else:
-                rest_list = eval(rest_list)
-            rest_list.append(player_data['cur_days_rest'].values[0])  # Add the previous rest days to the list
-            existing_batters.loc[existing_batters['player_name'] == player_name, 'rest_list'] = str(rest_list)
-            existing_batters.loc[existing_batters['player_name'] == player_name, 'cur_days_rest'] = 0
+        c.executemany("INSERT INTO appearances (mlbam_id, game_date, role, score, score_per_unit, rest_days, scoring) VALUES (?, ?, ?, ?, ?, ?, ?)", appearance_rows)
 
-            # Update score_list and last_score
+        # everyone gets another day of rest, then the players who appeared are reset to 0 by the upsert
 
-            score_list = player_data['score_list'].values[0]
-            if score_list is None:
-                score_list = []
-            else:
-                score_list = eval(score_list)
-            score_list.append(player_data['last_score'].values[0])  # Add the previous score to the list
-            existing_batters.loc[existing_batters['player_name'] == player_name, 'score_list'] = str(score_list)
-            existing_batters.loc[existing_batters['player_name'] == player_name, 'last_score'] = game_batting_score
+        c.execute("UPDATE player_summary SET cur_days_rest = cur_days_rest + 1 WHERE scoring = ? AND role = ?", (scoring, role))
 
-            # Update score_per_pa_list and score_per_pa
+        c.executemany(f'''INSERT INTO player_summary (scoring, mlbam_id, role, player_name, team_id, cur_days_rest, last_score, last_score_per_unit, {', '.join(running_stat_columns)})
+                        VALUES (?, ?, ?, ?, ?, 0, ?, ?, {', '.join('?' * len(running_stat_columns))})
+                        ON CONFLICT (scoring, mlbam_id, role) DO UPDATE SET player_name = excluded.player_name, team_id = excluded.team_id, cur_days_rest = 0,
+                        last_score = excluded.last_score, last_score_per_unit = excluded.last_score_per_unit,
+                        {', '.join(f'{column} = excluded.{column}' for column in running_stat_columns)}''',
+                      summary_rows)
 
-            score_per_pa_list = player_data['score_per_pa_list'].values[0]
-            if score_per_pa_list is None:
-                score_per_pa_list = []
-            else:
-                score_per_pa_list = eval(score_per_pa_list)
-            score_per_pa_list.append(player_data['score_per_pa'].values[0])  # Add the previous score per PA to the list
-            existing_batters.loc[existing_batters['player_name'] == player_name, 'score_per_pa_list'] = str(score_per_pa_list)
-            existing_batters.loc[existing_batters['player_name'] == player_name, 'score_per_pa'] = game_batting_score_per_pa
+# ------------- Raw stat lines shared by every point system ------------- #
 
-        else:
-            new_row = {'mlbam_id': player_id, 'player_name': player_name, 'team_id': team_id, 'cur_days_rest': 0, 'rest_list': str([]), 'last_score': game_batting_score, 'score_list': str([]), 'score_per_pa': game_batting_score_per_pa, 'score_per_pa_list': str([])}
-            existing_batters = pd.concat([existing_batters, pd.DataFrame([new_row])], ignore_index=True)
+# only players who pitched or came to the plate are kept, the same lines the scoring looks at
 
-    # Update the current_days_rest for players who didn't play today
+def store_stat_lines(c, stat_lines, game_date):
+    c.executemany("INSERT INTO stat_lines (game_date, mlbam_id, player_name, team_id, batting, pitching) VALUES (?, ?, ?, ?, ?, ?)",
+                  [(game_date, int(player_id), player_name, int(team_id), json.dumps(batting), json.dumps(pitching))
+                   for player_name, player_id, team_id, batting, pitching in stat_lines
+                   if pitching.get('outs', 0) > 0 or batting.get('plateAppearances', 0) > 0])
 
-    existing_pitchers.loc[~existing_pitchers['player_name'].isin(pitcher_df['Player Name']), 'cur_days_rest'] += 1
-    existing_batters.loc[~existing_batters['player_name'].isin(batter_df['Player Name']), 'cur_days_rest'] += 1
+# write a day to the database: its raw stat lines once, then the appearances for every point system it was scored with
 
-    # Write the updated data back to the database
+def _apply_scored_day(c, stat_lines, scored_day, game_date):
+    store_stat_lines(c, stat_lines, game_date)
 
-    existing_pitchers.to_sql('pitcher_rest_and_scoring', conn, if_exists='replace', index=False)
-    existing_batters.to_sql('batter_rest_and_scoring', conn, if_exists='replace', index=False)
+    for scoring, (pitcher_df, batter_df) in scored_day.items():
+        _apply_player_updates(c, pitcher_df, batter_df, game_date, scoring)
 
-    # Commit the changes
+    update_team_strength(c, game_date, stat_lines, scored_day)
 
-    conn.commit()
+# the stored stat lines a day at a time, in the order they were ingested, as extract_stat_lines returns them
+
+def load_stat_lines(conn):
+    from itertools import groupby
+
+    rows = conn.execute("SELECT game_date, player_name, mlbam_id, team_id, batting, pitching FROM stat_lines ORDER BY game_date, stat_line_id").fetchall()
+
+    for game_date, day_rows in groupby(rows, key=lambda row: row[0]):
+        yield game_date, [(player_name, mlbam_id, team_id, json.loads(batting), json.loads(pitching)) for _, player_name, mlbam_id, team_id, batting, pitching in day_rows]
+
+# replace a point system's appearances and summary rows with a fresh scoring of every stored stat line
+
+def rescore_from_stat_lines(conn, scoring, point_systems):
+    with conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM appearances WHERE scoring = ?", (scoring,))
+        c.execute("DELETE FROM player_summary WHERE scoring = ?", (scoring,))
+        c.execute("DELETE FROM team_strength WHERE scoring = ?", (scoring,))
+
+        for game_date, stat_lines in load_stat_lines(conn):
+            scored_day = {scoring: score_stat_lines(stat_lines, point_systems['pitching'], point_systems['batting'])}
+            _apply_player_updates(c, *scored_day[scoring], game_date, scoring)
+            update_team_strength(c, game_date, stat_lines, scored_day)
+
+# record the point systems in use. A new or changed one is scored from the stored stat lines, except that
+# history from before the point systems were recorded is taken to be scored with the one it's filed under
+
+def register_scoring_configs(conn, scoring_configs = default_scoring_configs):
+    registered = dict(conn.execute("SELECT scoring, point_systems FROM scoring_configs").fetchall())
+
+    for scoring, point_systems in scoring_configs.items():
+        point_systems_json = json.dumps(point_systems, sort_keys=True)
+        if registered.get(scoring) == point_systems_json:
+            continue
+
+        has_history = conn.execute("SELECT 1 FROM appearances WHERE scoring = ? LIMIT 1", (scoring,)).fetchone() is not None
+        if scoring in registered or not has_history:
+            rescore_from_stat_lines(conn, scoring, point_systems)
+
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO scoring_configs VALUES (?, ?)", (scoring, point_systems_json))
+
+    # the whole snapshot is checked on every start, which also picks up re-scored point systems and days an
+    # ingest committed but never wrote out. Days that haven't changed are skipped by their file name
+    sync_appearance_snapshots(conn)
 
 # basic calculation borrowed from economics. Higher sharpe ratio
-# indicated higher average points with low variance
-
-def calculate_fantasy_sharpe_ratio(row, score_list_col):
-    score_list = eval(row[score_list_col])
-    if score_list:
-        # Check if the list is not empty
-        if len(score_list) > 0:
-            score_mean = np.mean(score_list)
-            score_std = np.std(score_list)
-            if score_std > 0:
-                return score_mean / score_std
-            else:
-                return 0  # Return 0 if the standard deviation is 0
-        else:
-            # Handle the case where the list is empty
-            return 0
+# indicated higher average points with low variance (0 when there is no variance)
+
+def calculate_fantasy_sharpe_ratio(score_mean, score_std):
+    import numpy as np
+
+    score_mean = np.asarray(score_mean, dtype=np.float64)
+    score_std = np.asarray(score_std, dtype=np.float64)
+
+    return np.divide(score_mean, score_std, out=np.zeros_like(score_mean), where=score_std > 0)
+
+# ------------- Opponent strength index ------------- #
+
+# every team's recent tendencies as an opponent, kept per point system as exponentially decayed per game
+# averages and folded in one game day at a time as the boxscores are ingested: how often its hitters strike
+# out (k_rate) and walk, the runs it allows, and the fantasy points that pitchers facing it and batters
+# facing it put up. Ranking only reads the (30 row) table, nothing is fetched
+
+team_strength_alpha = 0.1
+team_strength_columns = ['k_rate', 'walks', 'runs_allowed', 'pitcher_points_allowed', 'batter_points_allowed']
+
+# who played whom in a batch of boxscores, as (game_pk, team_id, opponent_id) rows for both sides
+
+def extract_matchups(game_pks, games_data):
+    matchups = []
+
+    for game_pk, game_data in zip(game_pks, games_data):
+        teams = game_data['liveData']['boxscore']['teams']
+        away_team_id, home_team_id = teams['away']['team']['id'], teams['home']['team']['id']
+        matchups += [(game_pk, away_team_id, home_team_id), (game_pk, home_team_id, away_team_id)]
+
+    return matchups
+
+# fold one day into the index for every point system the day was scored with. Players are put on their
+# team by the team_id of their stat line, and a doubleheader counts as one update averaged over its games
+
+def update_team_strength(c, game_date, stat_lines, scored_day, alpha = team_strength_alpha):
+    day_matchups = c.execute("SELECT team_id, opponent_id FROM team_games WHERE game_date = ?", (game_date,)).fetchall()
+    if not day_matchups:
+        return
+
+    opponents = dict(day_matchups)
+    games = defaultdict(int)
+    for team_id, _ in day_matchups:
+        games[team_id] += 1
+
+    # what each team's hitters did, summed over the day
+    offense = defaultdict(lambda: defaultdict(int))
+    for _, _, team_id, batting, _ in stat_lines:
+        if team_id in opponents:
+            for stat in ['plateAppearances', 'strikeOuts', 'baseOnBalls', 'runs']:
+                offense[team_id][stat] += batting.get(stat, 0)
+
+    for scoring, (pitcher_df, batter_df) in scored_day.items():
+        points_by_team = {role: player_df.groupby('Team ID')[score_columns[role][0]].sum().to_dict() for role, player_df in [('pitcher', pitcher_df), ('batter', batter_df)]}
+        existing = {row[0]: row[1:] for row in c.execute(f"SELECT team_id, games, {', '.join(team_strength_columns)} FROM team_strength WHERE scoring = ?", (scoring,))}
+
+        rows = []
+        for team_id, opponent_id in opponents.items():
+            team_offense, opponent_offense = offense[team_id], offense[opponent_id]
+            day_values = [
+                team_offense['strikeOuts'] / team_offense['plateAppearances'] if team_offense['plateAppearances'] else None,
+                team_offense['baseOnBalls'] / games[team_id],
+                opponent_offense['runs'] / games[team_id],
+                points_by_team['pitcher'].get(opponent_id, 0) / games[team_id],
+                points_by_team['batter'].get(opponent_id, 0) / games[team_id],
+            ]
+
+            previous_games, *previous_values = existing.get(team_id, (0,) + (None,) * len(team_strength_columns))
+            values = [previous if value is None else value if previous is None else previous + alpha * (value - previous)
+                      for previous, value in zip(previous_values, day_values)]
+            rows.append((scoring, team_id, previous_games + games[team_id], *values, game_date))
+
+        c.executemany(f'''INSERT OR REPLACE INTO team_strength (scoring, team_id, games, {', '.join(team_strength_columns)}, updated_through)
+                          VALUES (?, ?, ?, {', '.join('?' * len(team_strength_columns))}, ?)''', rows)
+
+def load_team_strength(conn, scoring = default_scoring):
+    import pandas as pd
+
+    return pd.read_sql_query(f"SELECT team_id, games, {', '.join(team_strength_columns)} FROM team_strength WHERE scoring = ? ORDER BY team_id", conn, params=(scoring,))
+
+# how much easier (above 1) or harder (below 1) each opponent has been than the average team, by how many
+# fantasy points players in the role put up against them. Teams without a history are neutral
+
+def matchup_factors(team_strength, opponent_ids, role):
+    import numpy as np
+
+    column = 'pitcher_points_allowed' if role == 'pitcher' else 'batter_points_allowed'
+    league_average = team_strength[column].mean()
+    factors = dict(zip(team_strength['team_id'], team_strength[column] / league_average)) if league_average > 0 else {}
+
+    return np.array([factors.get(opponent_id, 1.0) for opponent_id in opponent_ids], dtype=np.float64)
+
+# ------------- Monte Carlo projections from the appearance history ------------- #
+
+# a "boom" is a game at or above these many fantasy points
+
+boom_thresholds = {'pitcher': 30, 'batter': 10}
+
+# every player's fantasy scores in appearance order as a (players x longest history) array padded with
+# zeros, plus how many of each row are real, in the order of player_ids
+
+def load_score_histories(conn, role, player_ids, scoring = default_scoring):
+    import numpy as np
+
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    if len(player_ids) == 0:
+        return np.zeros((0, 0), dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    snapshot_dir = getattr(conn, 'snapshot_dir', None)
+    if snapshot_dir is not None:
+        appearances = load_snapshot_appearances(snapshot_dir, role, ['mlbam_id', 'score'], player_ids, scoring)
+        by_player = np.argsort(appearances['mlbam_id'], kind='stable')
+        score_player_ids, scores = appearances['mlbam_id'][by_player], appearances['score'][by_player]
     else:
-        return 0  # Return 0 if the score_list is empty
+        rows = conn.execute(f"SELECT mlbam_id, score FROM appearances WHERE scoring = ? AND role = ? AND mlbam_id IN ({', '.join('?' * len(player_ids))}) ORDER BY mlbam_id, appearance_id",
+                            [scoring, role] + player_ids.tolist()).fetchall()
+        score_player_ids, scores = (np.array(column, dtype=np.int64) for column in zip(*rows)) if rows else (np.zeros(0, dtype=np.int64),) * 2
+
+    # rows come back grouped by player, so each score's slot is its position within its group
+    id_order = np.argsort(player_ids)
+    row_index = id_order[np.searchsorted(player_ids, score_player_ids, sorter=id_order)]
+    slots = np.arange(len(scores)) - np.searchsorted(score_player_ids, score_player_ids)
+    lengths = np.bincount(row_index, minlength=len(player_ids))
+
+    histories = np.zeros((len(player_ids), lengths.max(initial=0)), dtype=np.int64)
+    histories[row_index, slots] = scores
+
+    return histories, lengths
+
+# bootstrap the next game of every player at once: each player's history is resampled `draws` times with
+# replacement. The draws are counted rather than materialized, one multinomial per player over the slots of
+# their history in a single batched call, which is the same resample without a (players x draws) array.
+# Returns the share of draws at or above the threshold, the mean draw and the upper quantile of the draws
+# (interpolated the same way as np.quantile over the drawn scores)
+
+def bootstrap_projection(histories, lengths, threshold, draws = 10000, upper_quantile = 0.9, seed = None):
+    import numpy as np
+
+    histories = np.asarray(histories, dtype=np.float64)
+    lengths = np.asarray(lengths)
+    players, longest = histories.shape
+    has_history = lengths > 0
+
+    projection = {'boom_probability': np.full(players, np.nan), 'expected_score': np.full(players, np.nan), 'upper_quantile': np.full(players, np.nan)}
+    if not has_history.any():
+        return projection
+
+    histories, lengths = histories[has_history], lengths[has_history]
+    slot_probabilities = (np.arange(longest) < lengths[:, None]) / lengths[:, None]
+    counts = np.random.default_rng(seed).multinomial(draws, slot_probabilities)
+
+    projection['boom_probability'][has_history] = (counts * (histories >= threshold)).sum(axis=1) / draws
+    projection['expected_score'][has_history] = (counts * histories).sum(axis=1) / draws
+
+    # sort every history (padding sorts last, it was never drawn) and walk the cumulative counts to the
+    # two drawn scores the quantile falls between
+    order = np.argsort(np.where(counts > 0, histories, np.inf), axis=1, kind='stable')
+    sorted_scores = np.take_along_axis(histories, order, axis=1)
+    cumulative_counts = np.cumsum(np.take_along_axis(counts, order, axis=1), axis=1)
+
+    position = (draws - 1) * upper_quantile
+    lower_rank, fraction = int(np.floor(position)), position - np.floor(position)
+    lower = np.take_along_axis(sorted_scores, (cumulative_counts > lower_rank).argmax(axis=1)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(sorted_scores, (cumulative_counts > min(lower_rank + 1, draws - 1)).argmax(axis=1)[:, None], axis=1)[:, 0]
+    projection['upper_quantile'][has_history] = lower + (upper - lower) * fraction
+
+    return projection
+
+score_per_unit_names = {'pitcher': 'score_per_inn', 'batter': 'score_per_pa'}
 
 # calculate which players are the most likely to play based on how many rest days they have had compared to their median rest
-# rank these players by their Sharpe ratio (which ones will likely get the most stable return of points if they pitch)
+# rank these players by their Sharpe ratio (which ones will likely get the most stable return of points if they pitch).
+# Both come straight off the running statistics on the summary rows, players without a rest history yet are left out.
+# Every likely player also gets a bootstrap projection of their next game: the chance of a boom, the expected
+# score and the 90th percentile score (pass a seed to make it reproducible)
 
-def predict_players(conn):
+def predict_players(conn, projection_draws = 10000, projection_seed = None, scoring = default_scoring):
+    import numpy as np
+    import pandas as pd
 
-    # Connect to the SQLite database
-    c = conn.cursor()
+    ranked_players = []
 
-    # Fetch the data from the database
-    c.execute("SELECT * FROM pitcher_rest_and_scoring")
-    pitchers = pd.DataFrame(c.fetchall(), columns=['mlbam_id', 'player_name', 'team_id', 'cur_days_rest', 'rest_list', 'last_score', 'score_list', 'score_per_inn', 'score_per_inn_list'])
+    for role in player_roles:
 
-    c.execute("SELECT * FROM batter_rest_and_scoring")
-    batters = pd.DataFrame(c.fetchall(), columns=['mlbam_id', 'player_name', 'team_id', 'cur_days_rest', 'rest_list', 'last_score', 'score_list', 'score_per_pa', 'score_per_pa_list'])
+        # Fetch the players who are likely to play
 
-    # Calculate the fantasy_sharpe_ratio for pitchers
-    pitchers['fantasy_sharpe_ratio'] = pitchers.apply(lambda row: calculate_fantasy_sharpe_ratio(row, 'score_per_inn_list'), axis=1)
+        likely_players = pd.read_sql_query('''SELECT mlbam_id, player_name, team_id, cur_days_rest, median_rest, last_score, last_score_per_unit,
+                                            score_count AS appearances, score_mean, score_m2, score_ewm_mean, score_ewm_var
+                                            FROM player_summary WHERE scoring = ? AND role = ? AND median_rest IS NOT NULL AND cur_days_rest >= median_rest
+                                            ORDER BY mlbam_id''',
+                                           conn, params=(scoring, role))
 
-    # Filter pitchers who are likely to play
-    likely_pitchers = pitchers[pitchers['cur_days_rest'] >= pitchers['rest_list'].apply(lambda x: np.median(eval(x)) if x else 0)]
+        # Calculate the fantasy_sharpe_ratio (and its decayed version that favours recent form) and rank the likely players by it
 
-    # Rank likely pitchers by fantasy_sharpe_ratio
-    ranked_pitchers = likely_pitchers.sort_values(by='fantasy_sharpe_ratio', ascending=False)
+        likely_players['fantasy_sharpe_ratio'] = calculate_fantasy_sharpe_ratio(likely_players['score_mean'], np.sqrt(likely_players['score_m2'] / likely_players['appearances']))
+        likely_players['decayed_sharpe_ratio'] = calculate_fantasy_sharpe_ratio(likely_players['score_ewm_mean'], np.sqrt(likely_players['score_ewm_var']))
+        histories, lengths = load_score_histories(conn, role, likely_players['mlbam_id'], scoring)
+        projection = bootstrap_projection(histories, lengths, boom_thresholds[role], projection_draws, seed=projection_seed)
+        likely_players['boom_probability'] = projection['boom_probability']
+        likely_players['expected_score'] = projection['expected_score']
+        likely_players['score_p90'] = projection['upper_quantile']
 
-    # Calculate the fantasy_sharpe_ratio for batters
-    batters['fantasy_sharpe_ratio'] = batters.apply(lambda row: calculate_fantasy_sharpe_ratio(row, 'score_per_pa_list'), axis=1)
+        likely_players = likely_players.drop(columns=['score_mean', 'score_m2', 'score_ewm_mean', 'score_ewm_var']).rename(columns={'last_score_per_unit': score_per_unit_names[role]})
 
-    # Filter batters who are likely to play
-    likely_batters = batters[batters['cur_days_rest'] >= batters['rest_list'].apply(lambda x: np.median(eval(x)) if x else 0)]
+        ranked_players.append(likely_players.sort_values(by='fantasy_sharpe_ratio', ascending=False))
 
-    # Rank likely batters by fantasy_sharpe_ratio
-    ranked_batters = likely_batters.sort_values(by='fantasy_sharpe_ratio', ascending=False)
+    ranked_pitchers, ranked_batters = ranked_players
 
     return ranked_pitchers, ranked_batters
 
 # method for recapping what happened the previous day
 # display the top pitchers and hitters
 
-def get_top_players(conn):
-    # Connect to the SQLite database
-    c = conn.cursor()
+def _top_players(conn, role, column, limit = 5, scoring = default_scoring):
+    import pandas as pd
+
+    order_column = 'last_score_per_unit' if column == score_per_unit_names[role] else column
 
-    # Fetch the data from the database
-    c.execute("SELECT * FROM pitcher_rest_and_scoring")
-    pitchers = pd.DataFrame(c.fetchall(), columns=['mlbam_id', 'player_name', 'team_id', 'cur_days_rest', 'rest_list', 'last_score', 'score_list', 'score_per_inn', 'score_per_inn_list'])
+    return pd.read_sql_query(f"SELECT mlbam_id, player_name, {order_column} AS {column} FROM player_summary WHERE scoring = ? AND role = ? ORDER BY {order_column} DESC, mlbam_id LIMIT ?",
+                             conn, params=(scoring, role, limit))
 
-    c.execute("SELECT * FROM batter_rest_and_scoring")
-    batters = pd.DataFrame(c.fetchall(), columns=['mlbam_id', 'player_name', 'team_id', 'cur_days_rest', 'rest_list', 'last_score', 'score_list', 'score_per_pa', 'score_per_pa_list'])
+def get_top_players(conn, scoring = default_scoring):
 
     # Get top 5 pitchers by score_per_inn
-    top_pitchers_by_score_per_inn = pitchers.nlargest(5, 'score_per_inn')[['player_name', 'score_per_inn']]
+    top_pitchers_by_score_per_inn = _top_players(conn, 'pitcher', 'score_per_inn', scoring=scoring)
 
     # Get top 5 pitchers by last_score
-    top_pitchers_by_last_score = pitchers.nlargest(5, 'last_score')[['player_name', 'last_score']]
+    top_pitchers_by_last_score = _top_players(conn, 'pitcher', 'last_score', scoring=scoring)
 
     # Get top 5 batters by score_per_pa
-    top_batters_by_score_per_pa = batters.nlargest(5, 'score_per_pa')[['player_name', 'score_per_pa']]
+    top_batters_by_score_per_pa = _top_players(conn, 'batter', 'score_per_pa', scoring=scoring)
 
     # Get top 5 batters by last_score
-    top_batters_by_last_score = batters.nlargest(5, 'last_score')[['player_name', 'last_score']]
+    top_batters_by_last_score = _top_players(conn, 'batter', 'last_score', scoring=scoring)
 
     return top_pitchers_by_score_per_inn, top_pitchers_by_last_score, top_batters_by_score_per_pa, top_batters_by_last_score
 
-# join all of the players with the list of players who are available in the fantasy league
-# returns results with the players who are available to be acquired
+# ------------- Matching database players to ESPN free agents ------------- #
 
-def join_with_waiver_players(league, probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b):
-    
-    def find_closest_match(name, free_agents_available):
-        closest_match = difflib.get_close_matches(name, free_agents_available, n=1, cutoff=0.95)
+# names are compared without accents, punctuation, case or generational suffixes (Jr., Sr., II, ...)
+
+name_suffixes = {'jr', 'sr', 'ii', 'iii', 'iv', 'v'}
+
+def normalize_player_name(name):
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    name = re.sub(r"[.'`]", "", name)
+    tokens = re.sub(r"[^a-z0-9]+", " ", name).split()
+
+    return " ".join(token for token in tokens if token not in name_suffixes)
+
+def _name_trigrams(name):
+    return {name[i:i + 3] for i in range(max(len(name) - 2, 1))}
+
+# index over the free agent names that is built once per run. A name is resolved by an exact lookup,
+# then a lookup on the normalized name (when it is unambiguous), and only then by difflib - but against
+# the few names that share a trigram and are of a length that can reach the cutoff instead of every free agent.
+# Any name within the cutoff shares trigrams with the query, so the fuzzy step returns what a full scan would
+
+class PlayerNameMatcher:
+
+    def __init__(self, names, cutoff = 0.95):
+        self.names = list(dict.fromkeys(names))
+        self.cutoff = cutoff
+        self.exact_names = set(self.names)
+        self.matches = {}
+
+        self.normalized_names = {}
+        for name in self.names:
+            normalized_name = normalize_player_name(name)
+            # two free agents with the same normalized name can't be told apart this way
+            self.normalized_names[normalized_name] = name if normalized_name not in self.normalized_names else None
+
+        self.trigram_index = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for trigram in _name_trigrams(name):
+                self.trigram_index[trigram].add(i)
+
+    def match(self, name):
+        if name not in self.matches:
+            self.matches[name] = self._match(name)
+
+        return self.matches[name]
+
+    def _match(self, name):
+        import difflib
+
+        if name in self.exact_names:
+            return name
+
+        normalized_match = self.normalized_names.get(normalize_player_name(name))
+        if normalized_match is not None:
+            return normalized_match
+
+        candidate_ids = set()
+        for trigram in _name_trigrams(name):
+            candidate_ids.update(self.trigram_index.get(trigram, ()))
+
+        # the difflib ratio can never be above 2 * shorter / (sum of lengths)
+        candidates = [self.names[i] for i in candidate_ids
+                      if 2 * min(len(name), len(self.names[i])) >= self.cutoff * (len(name) + len(self.names[i]))]
+
+        closest_match = difflib.get_close_matches(name, candidates, n=1, cutoff=self.cutoff)
         return closest_match[0] if closest_match else None
+
+# ESPN's team abbreviations (espn_api's PRO_TEAM_MAP) by MLBAM team id
+
+espn_pro_teams = {
+    108: 'LAA', 109: 'Ari', 110: 'Bal', 111: 'Bos', 112: 'ChC', 113: 'Cin', 114: 'Cle', 115: 'Col', 116: 'Det', 117: 'Hou',
+    118: 'KC', 119: 'LAD', 120: 'Wsh', 121: 'NYM', 133: 'Oak', 134: 'Pit', 135: 'SD', 136: 'Sea', 137: 'SF', 138: 'StL',
+    139: 'TB', 140: 'Tex', 141: 'Tor', 142: 'Min', 143: 'Phi', 144: 'Atl', 145: 'ChW', 146: 'Mia', 147: 'NYY', 158: 'Mil',
+}
+
+# the new matches that can be trusted from now on: the name is shared by no other ESPN player (rostered ones
+# included), the free agent plays for the player's team and the ESPN id isn't anyone else's already. Two
+# players that match the same ESPN player are both left out
+
+def _verified_mappings(conn, new_mappings, mapped_espn_ids):
+    from collections import Counter
+
+    espn_name_counts = Counter(normalize_player_name(name) for name, in conn.execute("SELECT name FROM espn_players"))
+    espn_teams = dict(conn.execute("SELECT espn_id, pro_team FROM espn_players").fetchall())
+    player_teams = dict(conn.execute("SELECT mlbam_id, team_id FROM player_summary").fetchall())
+    claimed_espn_ids = Counter(espn_id for espn_id, _ in new_mappings.values())
+
+    return {mlbam_id: (espn_id, espn_name) for mlbam_id, (espn_id, espn_name) in new_mappings.items()
+            if espn_name_counts[normalize_player_name(espn_name)] == 1 and espn_teams.get(espn_id) is not None
+            and espn_pro_teams.get(player_teams.get(mlbam_id)) == espn_teams[espn_id]
+            and claimed_espn_ids[espn_id] == 1 and espn_id not in mapped_espn_ids}
+
+# join all of the players with the list of players who are available in the fantasy league
+# returns results with the players who are available to be acquired. Players that were matched to
+# an ESPN id before are looked up by that id and never fuzzy matched again
+
+def join_with_waiver_players(league, probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b, conn = None,
+                             free_agents = None):
     
-    # get list of available free agents
-    free_agents = league.free_agents(size = 1500)
-    free_agents_available = [player.name for player in free_agents]
+    # get list of available free agents (from today's snapshot when there is a fresh one), unless they were already fetched
+    if free_agents is None:
+        free_agents = get_free_agents(league, conn)
+    free_agent_names = dict(free_agents)
+    free_agent_ids = defaultdict(set)
+    for espn_id, name in free_agents:
+        free_agent_ids[name].add(espn_id)
 
-    # Filter ranked pitchers
-    probable_pitchers['player_name'] = probable_pitchers['player_name'].apply(lambda x: find_closest_match(x, free_agents_available))
-    probable_pitchers = probable_pitchers[probable_pitchers['player_name'].notnull()]
+    matcher = PlayerNameMatcher([name for _, name in free_agents])
 
-    # Filter ranked batters
-    probable_batters['player_name'] = probable_batters['player_name'].apply(lambda x: find_closest_match(x, free_agents_available))
-    probable_batters = probable_batters[probable_batters['player_name'].notnull()]
+    espn_ids = {}
+    if conn is not None:
+        espn_ids = dict(conn.execute("SELECT mlbam_id, espn_id FROM espn_player_map").fetchall())
 
-    # Filter top pitchers by score_per_inn
-    top_score_per_inn_p['player_name'] = top_score_per_inn_p['player_name'].apply(lambda x: find_closest_match(x, free_agents_available))
-    top_score_per_inn_p = top_score_per_inn_p[top_score_per_inn_p['player_name'].notnull()]
+    new_mappings = {}
 
-    # Filter top pitchers by last_score
-    top_score_p['player_name'] = top_score_p['player_name'].apply(lambda x: find_closest_match(x, free_agents_available))
-    top_score_p = top_score_p[top_score_p['player_name'].notnull()]
+    def find_free_agent(mlbam_id, name):
+        if mlbam_id in espn_ids:
+            return free_agent_names.get(espn_ids[mlbam_id])
 
-    # Filter top batters by score_per_pa
-    top_score_per_pa_b['player_name'] = top_score_per_pa_b['player_name'].apply(lambda x: find_closest_match(x, free_agents_available))
-    top_score_per_pa_b = top_score_per_pa_b[top_score_per_pa_b['player_name'].notnull()]
+        closest_match = matcher.match(name)
 
-    # Filter top batters by last_score
-    top_score_b['player_name'] = top_score_b['player_name'].apply(lambda x: find_closest_match(x, free_agents_available))
-    top_score_b = top_score_b[top_score_b['player_name'].notnull()]
+        # only a name that matches one free agent exactly (up to normalization) is a candidate to remember, fuzzy
+        # matches and names shared by several free agents (e.g. two Will Smiths) are left unmapped
+        if (closest_match is not None and len(free_agent_ids[closest_match]) == 1
+                and closest_match in (name, matcher.normalized_names.get(normalize_player_name(name)))):
+            new_mappings[mlbam_id] = (next(iter(free_agent_ids[closest_match])), closest_match)
+        return closest_match
+
+    available_players = []
+
+    # Filter ranked pitchers and batters, then the top pitchers and batters by score per unit and by last score
+
+    for players in [probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b]:
+        players = players.copy()
+        players['player_name'] = [find_free_agent(int(mlbam_id), name) for mlbam_id, name in zip(players['mlbam_id'], players['player_name'])]
+        available_players.append(players[players['player_name'].notnull()])
+
+    # remember every new match that checks out so the player resolves by id from now on
+
+    if conn is not None and new_mappings:
+        new_mappings = _verified_mappings(conn, new_mappings, set(espn_ids.values()))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO espn_player_map VALUES (?, ?, ?)", [(mlbam_id, espn_id, espn_name) for mlbam_id, (espn_id, espn_name) in new_mappings.items()])
+
+    probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b = available_players
 
     return probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b
 
 # join the available players with the games that are happening
 # i.e. a player can't get points if their team doesn't play
 
-def join_with_todays_games(client, date, probable_pitchers, probable_batters):
+def join_with_todays_games(client, date, probable_pitchers, probable_batters, conn = None, scoring = default_scoring):
     teams_today_json = client.get_team_schedule_by_date(date)
     
-    teams_today = []
+    opponents = {}
     for game in teams_today_json['dates'][0]['games']:
         away_team_id = game['teams']['away']['team']['id']
         home_team_id = game['teams']['home']['team']['id']
-        teams_today.append(away_team_id)
-        teams_today.append(home_team_id)
+        opponents[away_team_id] = home_team_id
+        opponents[home_team_id] = away_team_id
 
-    probable_pitchers = probable_pitchers[probable_pitchers['team_id'].isin(teams_today)]
-    probable_batters = probable_batters[probable_batters['team_id'].isin(teams_today)]
+    probable_pitchers = probable_pitchers[probable_pitchers['team_id'].isin(list(opponents))]
+    probable_batters = probable_batters[probable_batters['team_id'].isin(list(opponents))]
+
+    # with the database, each player's opponent today and the projection adjusted for how that opponent has played
+    if conn is not None:
+        team_strength = load_team_strength(conn, scoring)
+        probable_pitchers = _with_matchups(probable_pitchers, 'pitcher', opponents, team_strength)
+        probable_batters = _with_matchups(probable_batters, 'batter', opponents, team_strength)
 
     return probable_pitchers, probable_batters
 
-# send yourself or others an automated email with the results so that you can quickly identify players for pick-up
+# the opponent's K rate is shown for pitchers and the runs it allows for batters
 
-def send_email(date, prob_pitchers_available, prob_batters_available, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available):
-    # Your Gmail account credentials
-    sender_email = {SENDER_EMAIL}
-    receiver_email = {RECEIVER_EMAIL}
-    password = {EMAIL_PASSKEY}
+def _with_matchups(players, role, opponents, team_strength):
+    tendency = 'k_rate' if role == 'pitcher' else 'runs_allowed'
 
-    # Create a multipart message
-    message = MIMEMultipart("alternative")
-    message["Subject"] = f"Waiver Wire Adds - {date}"
-    message["From"] = sender_email
-    message["To"] = receiver_email
+    players = players.assign(opponent_id=players['team_id'].map(opponents))
+    players[f'opponent_{tendency}'] = players['opponent_id'].map(team_strength.set_index('team_id')[tendency])
+    players['matchup_factor'] = matchup_factors(team_strength, players['opponent_id'], role)
+    players['matchup_expected_score'] = players['expected_score'] * players['matchup_factor']
 
-    # Construct the email body with the DataFrames
-    html_body = f"<h3>Probable Pitchers:</h3>{prob_pitchers_available.to_html(index=False)}<br><br>"
-    html_body += f"<h3>Probable Batters:</h3>{prob_batters_available.to_html(index=False)}<br><br>"
-    html_body += f"<h3>Top Pitchers by Score per Inning:</h3>{top_score_per_inn_p_available.to_html(index=False)}<br><br>"
-    html_body += f"<h3>Top Pitchers by Last Score:</h3>{top_score_p_available.to_html(index=False)}<br><br>"
-    html_body += f"<h3>Top Batters by Score per Plate Appearance:</h3>{top_score_per_pa_b_available.to_html(index=False)}<br><br>"
-    html_body += f"<h3>Top Batters by Last Score:</h3>{top_score_b_available.to_html(index=False)}"
+    return players
 
-    # Attach the email body to the message
-    message.attach(MIMEText(html_body, "html"))
+# ------------- Free agent snapshots ------------- #
 
-    # Create a secure SMTP session
-    server = smtplib.SMTP("smtp.gmail.com", 587)
-    server.starttls()
+# the league's free agent pool is saved once per league and day, so re-ranking during the day doesn't go
+# back to ESPN until that day's snapshot is older than the TTL. If ESPN fails, the latest snapshot that was
+# fetched successfully is used instead. Only the last free_agent_snapshot_days days are kept
 
-    try:
-        # Login to your Gmail account
-        server.login(sender_email, password)
-        # Send the email
-        server.sendmail(sender_email, receiver_email, message.as_string())
-    except Exception as e:
-        print(f"Error occurred while sending email: {e}")
-    finally:
-        # Close the SMTP server connection
-        server.quit()
+default_free_agent_ttl = float(os.environ.get('WAIVER_WIRE_FREE_AGENT_TTL', 6 * 60 * 60))
+free_agent_snapshot_days = 30
 
-# ----- Main calling functions to run the code ----- #
+def save_free_agent_snapshot(conn, league_id, free_agents, snapshot_date = None, fetched_at = None):
+    snapshot_date = _iso_date(snapshot_date or date.today())
 
-# Get yesterday's date in MM/DD/YYYY format
-yesterday = (date.today() - timedelta(days=1)).strftime("%m/%d/%Y")
-today = (date.today()).strftime("%m/%d/%Y")
+    with conn:
+        conn.execute("DELETE FROM free_agent_snapshot_players WHERE league_id = ? AND snapshot_date = ?", (league_id, snapshot_date))
+        conn.execute("INSERT OR REPLACE INTO free_agent_snapshots VALUES (?, ?, ?, ?)", (league_id, snapshot_date, fetched_at or time.time(), len(free_agents)))
+        conn.executemany("INSERT OR REPLACE INTO free_agent_snapshot_players VALUES (?, ?, ?, ?)",
+                         [(league_id, snapshot_date, espn_id, name) for espn_id, name in free_agents])
 
-# connect to the DB
-conn = sqlite3.connect('/home/aj/code_scripts/player_rest_and_scoring.db')
-build_database(conn)
+        expired_date = (_parse_date(snapshot_date) - timedelta(days=free_agent_snapshot_days)).isoformat()
+        conn.execute("DELETE FROM free_agent_snapshot_players WHERE league_id = ? AND snapshot_date < ?", (league_id, expired_date))
+        conn.execute("DELETE FROM free_agent_snapshots WHERE league_id = ? AND snapshot_date < ?", (league_id, expired_date))
 
-# initialize the instance of your ESPN fantasy league
-client = MLBStatsAPIClient()
-league = League(league_id={YOUR_LEAGUE_ID}, year=2024, espn_s2={YOUR_ESPN_S2}, swid={YOUR_ESPN_SWID})
+# the snapshot for a date (or the latest one, or the latest one before a date) as (snapshot date, fetched at,
+# [(espn id, name), ...]), None if there isn't one
+
+def load_free_agent_snapshot(conn, league_id, snapshot_date = None, before = False):
+    if snapshot_date is None:
+        row = conn.execute("SELECT snapshot_date, fetched_at FROM free_agent_snapshots WHERE league_id = ? ORDER BY snapshot_date DESC LIMIT 1", (league_id,)).fetchone()
+    else:
+        comparison = '<' if before else '='
+        row = conn.execute(f"SELECT snapshot_date, fetched_at FROM free_agent_snapshots WHERE league_id = ? AND snapshot_date {comparison} ? ORDER BY snapshot_date DESC LIMIT 1",
+                           (league_id, _iso_date(snapshot_date))).fetchone()
+    if row is None:
+        return None
+
+    snapshot_date, fetched_at = row
+    free_agents = conn.execute("SELECT espn_id, name FROM free_agent_snapshot_players WHERE league_id = ? AND snapshot_date = ? ORDER BY rowid",
+                               (league_id, snapshot_date)).fetchall()
+
+    return snapshot_date, fetched_at, free_agents
 
-# grab yesterdays games and perform the calculations
-yesterdays_games = get_days_previous_games(client, yesterday)
+def _fresh_free_agents(conn, league_id, ttl):
+    snapshot = load_free_agent_snapshot(conn, league_id, date.today())
+    if snapshot is None or time.time() - snapshot[1] >= ttl:
+        return None
+
+    metrics = getattr(conn, 'metrics', None)
+    if metrics is not None:
+        metrics.add('free_agent_snapshot_hits')
+
+    return snapshot[2]
+
+# the free agents as [(espn id, name), ...] and every ESPN player as [(espn id, name, team), ...], where only
+# the free agents' teams are known
+
+def _fetch_free_agents(league, size, metrics = None):
+    if metrics is not None:
+        metrics.add('espn_requests')
+
+    players = league.free_agents(size=size)
+    espn_players = {espn_id: (name, None) for espn_id, name in league.player_map.items() if isinstance(espn_id, int)}
+    espn_players.update((player.playerId, (player.name, player.proTeam)) for player in players)
+
+    return [(player.playerId, player.name) for player in players], [(espn_id, name, pro_team) for espn_id, (name, pro_team) in espn_players.items()]
+
+def save_espn_players(conn, espn_players):
+    with conn:
+        conn.executemany('''INSERT INTO espn_players VALUES (?, ?, ?)
+                            ON CONFLICT (espn_id) DO UPDATE SET name = excluded.name, pro_team = COALESCE(excluded.pro_team, espn_players.pro_team)''', espn_players)
+
+def _last_good_free_agents(conn, league_id, error):
+    last_snapshot = load_free_agent_snapshot(conn, league_id) if conn is not None else None
+    if last_snapshot is None:
+        return None
+
+    print(f"Error occurred while fetching free agents for league {league_id}, using the snapshot from {last_snapshot[0]}: {error}", file=sys.stderr)
+    return last_snapshot[2]
+
+# the league's free agents as [(espn id, name), ...], from today's snapshot while it is fresh and from ESPN
+# otherwise. Without a database connection every call goes to ESPN
+
+def get_free_agents(league, conn = None, ttl = default_free_agent_ttl, size = 1500):
+    if conn is not None:
+        free_agents = _fresh_free_agents(conn, league.league_id, ttl)
+        if free_agents is not None:
+            return free_agents
+
+    try:
+        free_agents, espn_players = _fetch_free_agents(league, size, getattr(conn, 'metrics', None))
+    except Exception as e:
+        free_agents = _last_good_free_agents(conn, league.league_id, e)
+        if free_agents is None:
+            raise
+        return free_agents
+
+    if conn is not None:
+        save_free_agent_snapshot(conn, league.league_id, free_agents)
+        save_espn_players(conn, espn_players)
+
+    return free_agents
+
+# the free agents of several leagues (configured as in load_leagues) by league name. The leagues without a
+# fresh snapshot are opened and fetched from ESPN concurrently, the database is only used from this thread.
+# A league that fails without any snapshot to fall back on is left out
+
+def get_league_free_agents(conn, leagues, ttl = default_free_agent_ttl, size = 1500, max_workers = 8):
+    metrics = getattr(conn, 'metrics', None)
+    free_agents = {}
+    stale_leagues = []
+
+    for league in leagues:
+        fresh_free_agents = _fresh_free_agents(conn, _league_id(league), ttl)
+        if fresh_free_agents is None:
+            stale_leagues.append(league)
+        else:
+            free_agents[league['name']] = fresh_free_agents
+
+    if not stale_leagues:
+        return free_agents
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(stale_leagues))) as executor:
+        fetches = [executor.submit(lambda league: _fetch_free_agents(open_league(league), size, metrics), league) for league in stale_leagues]
+
+        for league, fetch in zip(stale_leagues, fetches):
+            try:
+                free_agents[league['name']], espn_players = fetch.result()
+                save_free_agent_snapshot(conn, _league_id(league), free_agents[league['name']])
+                save_espn_players(conn, espn_players)
+            except Exception as e:
+                last_good_free_agents = _last_good_free_agents(conn, _league_id(league), e)
+                if last_good_free_agents is None:
+                    print(f"Error occurred while fetching free agents for {league['name']}, skipping it: {e}", file=sys.stderr)
+                else:
+                    free_agents[league['name']] = last_good_free_agents
 
-pitcher_df, batter_df = calculate_player_scoring(client, yesterdays_games)
-update_player_data(conn, pitcher_df, batter_df)
-probable_pitchers, probable_batters = predict_players(conn)
-top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b = get_top_players(conn)
+    return free_agents
+
+# compare a day's free agent pool (the latest by default) with the previous snapshot. Returns the players
+# who were newly dropped into the pool and the ones who were picked up, as [(espn id, name), ...]
+
+def free_agent_changes(conn, league_id, snapshot_date = None):
+    snapshot = load_free_agent_snapshot(conn, league_id, snapshot_date)
+    if snapshot is None:
+        return [], []
+
+    previous_snapshot = load_free_agent_snapshot(conn, league_id, snapshot[0], before=True)
+    if previous_snapshot is None:
+        return [], []
+
+    current_ids = {espn_id for espn_id, _ in snapshot[2]}
+    previous_ids = {espn_id for espn_id, _ in previous_snapshot[2]}
+
+    newly_dropped = [(espn_id, name) for espn_id, name in snapshot[2] if espn_id not in previous_ids]
+    picked_up = [(espn_id, name) for espn_id, name in previous_snapshot[2] if espn_id not in current_ids]
+
+    return newly_dropped, picked_up
+
+# ------------- Report rendering and delivery ------------- #
+
+# the report is filled in from templates compiled once. A league's six tables are rendered to HTML once and
+# shared by everyone who gets that league's report, only the recipient's own roster section is rendered per
+# message
+
+report_template = Template("$roster$sections")
+report_section_template = Template("<h3>$title:</h3>$table")
+report_section_separator = "<br><br>"
+
+def _report_subject(report_date, league_name = None):
+    return f"Waiver Wire Adds - {league_name} - {report_date}" if league_name else f"Waiver Wire Adds - {report_date}"
+
+# the recipient's rostered players who are likely to play, with the same columns as the probable players
+
+def roster_players(ranked_players, roster_names):
+    roster_names = {normalize_player_name(name) for name in roster_names}
+
+    return [players[players['player_name'].map(normalize_player_name).isin(roster_names)] for players in ranked_players]
+
+# build the messages for a batch of reports, each a dict with 'league_name', 'recipient' and the six
+# 'players' frames, plus optionally 'roster' (the recipient's likely pitchers and batters) and 'team_name'
+
+def render_reports(report_date, reports, sender_email):
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    rendered_sections = {}
+    messages = []
+
+    for report in reports:
+        frames_key = tuple(id(players) for players in report['players'])
+        if frames_key not in rendered_sections:
+            rendered_sections[frames_key] = report_section_separator.join(report_section_template.substitute(title=title, table=players.to_html(index=False))
+                                                                          for title, players in zip(report_titles, report['players']))
+
+        roster = ""
+        if report.get('roster') is not None:
+            roster_titles = [f"Your Likely Pitchers ({report.get('team_name') or 'your team'})", f"Your Likely Batters ({report.get('team_name') or 'your team'})"]
+            roster = "".join(report_section_template.substitute(title=title, table=players.to_html(index=False)) + report_section_separator
+                             for title, players in zip(roster_titles, report['roster']))
+
+        # Create a multipart message
+        message = MIMEMultipart("alternative")
+        message["Subject"] = _report_subject(report_date, report.get('league_name'))
+        message["From"] = sender_email
+        message["To"] = report['recipient']
+        message.attach(MIMEText(report_template.substitute(roster=roster, sections=rendered_sections[frames_key]), "html"))
+        messages.append(message)
+
+    return messages
+
+# sends every message over one SMTP connection, opened (STARTTLS + login) on the first message and reopened
+# once if the server drops it
+
+class SMTPSink:
+
+    def __init__(self, sender_email = None, password = None, host = "smtp.gmail.com", port = 587):
+        # Your Gmail account credentials, taken from the environment unless they are passed in
+        self.sender_email = sender_email or os.environ["WAIVER_WIRE_SENDER_EMAIL"]
+        self.password = password or os.environ["WAIVER_WIRE_EMAIL_PASSKEY"]
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def _connect(self):
+        import smtplib
+
+        self.server = smtplib.SMTP(self.host, self.port)
+        self.server.starttls()
+        self.server.login(self.sender_email, self.password)
+
+    def send(self, message):
+        import smtplib
+
+        if self.server is None:
+            self._connect()
+
+        try:
+            self.server.sendmail(self.sender_email, message["To"], message.as_string())
+        except smtplib.SMTPServerDisconnected:
+            self._connect()
+            self.server.sendmail(self.sender_email, message["To"], message.as_string())
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+# keeps the messages instead of sending them, and writes each one to an .eml file when given a directory.
+# For testing, or for looking at a report before it goes out
+
+class LocalSink:
+
+    def __init__(self, directory = None):
+        self.sender_email = os.environ.get("WAIVER_WIRE_SENDER_EMAIL", "waiver-wire-winner@localhost")
+        self.directory = directory
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            file_name = re.sub(r"[^\w.@-]+", "_", f"{len(self.messages):03d}-{message['To']}-{message['Subject']}") + ".eml"
+            with open(os.path.join(self.directory, file_name), "w") as f:
+                f.write(message.as_string())
+
+    def close(self):
+        pass
+
+# send every message through the sink. One failed message is reported and skipped without stopping the
+# rest. Returns the error for each message (None when it was sent)
+
+def deliver_messages(messages, sink, metrics = None):
+    errors = []
+
+    try:
+        for message in messages:
+            start = time.perf_counter()
+            try:
+                sink.send(message)
+                errors.append(None)
+            except Exception as e:
+                print(f"Error occurred while sending email to {message['To']}: {e}", file=sys.stderr)
+                errors.append(e)
+
+            if metrics is not None:
+                metrics.add('emails_failed' if errors[-1] is not None else 'emails_sent')
+                metrics.add('email_seconds', time.perf_counter() - start)
+    finally:
+        sink.close()
+
+    return errors
+
+# who gets a league's report: its 'recipients', each {"email": ..., "team_id": <ESPN team id>} (the team id
+# adds that team's roster section), or else the league's receiver_email
+
+def league_recipients(league):
+    return league.get('recipients') or [{'email': league.get('receiver_email')}]
+
+# the rosters of the teams whose owners get a report, {league name: {team id: (team name, [player names])}}.
+# The leagues are opened concurrently and a league that fails just gets reports without a roster section
+
+def get_league_rosters(leagues, max_workers = 8, metrics = None):
+    leagues = [league for league in leagues if any(recipient.get('team_id') is not None for recipient in league_recipients(league))]
+    if not leagues:
+        return {}
+
+    def fetch_rosters(league):
+        if metrics is not None:
+            metrics.add('espn_requests')
+        return {team.team_id: (team.team_name, [player.name for player in team.roster]) for team in open_league(league).teams}
+
+    rosters = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(leagues))) as executor:
+        for league, fetch in zip(leagues, [executor.submit(fetch_rosters, league) for league in leagues]):
+            try:
+                rosters[league['name']] = fetch.result()
+            except Exception as e:
+                print(f"Error occurred while fetching the rosters of {league['name']}, sending its reports without them: {e}", file=sys.stderr)
+
+    return rosters
+
+# send yourself or others an automated email with the results so that you can quickly identify players for pick-up.
+# One recipient, straight over SMTP unless a sink is passed
+
+def send_email(date, prob_pitchers_available, prob_batters_available, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available,
+               sender_email = None, receiver_email = None, password = None, league_name = None, sink = None):
+    sink = sink or SMTPSink(sender_email, password)
+    receiver_email = receiver_email or os.environ.get("WAIVER_WIRE_RECEIVER_EMAIL", sink.sender_email)
+    players = [prob_pitchers_available, prob_batters_available, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available]
+
+    return deliver_messages(render_reports(date, [{'league_name': league_name, 'recipient': receiver_email, 'players': players}], sink.sender_email), sink)[0]
+
+# ------------- Pipeline instrumentation ------------- #
+
+# collects per stage wall time, call counts, HTTP requests/bytes/latency, database query counts/time
+# and peak memory for one run. Counters are bumped from anywhere (including the client's thread pool)
+# with add(), and every stage records how much each counter moved while it was running
+
+class PipelineMetrics:
+
+    def __init__(self):
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.counters = defaultdict(int)
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, counter, value = 1):
+        with self.lock:
+            self.counters[counter] += value
+
+    @contextmanager
+    def stage(self, name):
+        with self.lock:
+            counters_before = dict(self.counters)
+        start = time.perf_counter()
+
+        try:
+            yield self
+        finally:
+            wall_seconds = time.perf_counter() - start
+            with self.lock:
+                stage = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0})
+                stage['calls'] += 1
+                stage['wall_seconds'] += wall_seconds
+                for counter, value in self.counters.items():
+                    stage[counter] = stage.get(counter, 0) + value - counters_before.get(counter, 0)
+
+                # ru_maxrss is the peak of the whole process so far (KB on Linux), not of this stage - a stage
+                # that allocates less than an earlier one shows the earlier peak
+                stage['process_peak_rss_kb_so_far'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def summary(self, **run_info):
+        return {
+            'started_at': self.started_at,
+            **run_info,
+            'totals': dict(self.counters),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'stages': self.stages,
+        }
+
+    # append one JSON line per run so runs can be compared night over night
+
+    def write_jsonl(self, path, **run_info):
+        with open(path, "a") as f:
+            f.write(json.dumps(self.summary(**run_info), default=str) + "\n")
+
+# sqlite connection and cursor that count and time every query into the connection's metrics
+
+# every execute counts as one query and is timed under db_seconds. Reading the rows back (fetches, or iterating
+# over the cursor) is timed under db_fetch_seconds, SQLite does most of a SELECT's work while the rows are stepped through
+
+class InstrumentedCursor(sqlite3.Cursor):
+
+    def _timed(self, counter, method, *args):
+        metrics = getattr(self.connection, 'metrics', None)
+        if metrics is None:
+            return method(*args)
+
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if counter is not None:
+                metrics.add(counter)
+            metrics.add('db_fetch_seconds' if counter is None else 'db_seconds', time.perf_counter() - start)
+
+    def execute(self, *args):
+        return self._timed('db_queries', super().execute, *args)
+
+    def executemany(self, *args):
+        return self._timed('db_queries', super().executemany, *args)
+
+    def fetchone(self):
+        return self._timed(None, super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(None, super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(None, super().fetchall)
+
+    def __next__(self):
+        return self._timed(None, super().__next__)
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    metrics = None
+    snapshot_dir = None
+
+    def cursor(self, factory = InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+# pass a snapshot_dir to keep the columnar snapshot of the appearances up to date and read the
+# histories from it (see sync_appearance_snapshots)
+
+def connect_database(path, metrics = None, snapshot_dir = None):
+    conn = sqlite3.connect(path, factory=InstrumentedConnection)
+    conn.metrics = metrics
+    conn.snapshot_dir = snapshot_dir
+
+    return conn
+
+# ------------- Columnar appearance snapshots ------------- #
+
+# an optional copy of the appearance log as uncompressed Arrow IPC files, for the analysis that reads
+# whole histories (the bootstrap projection and the backtest). There is one file per point system, role and
+# game date (scoring=<name>/role=<role>/<game date>.<last appearance_id>.<rows>.arrow), so each ingest only
+# writes that day's files and a re-scored point system rewrites just its own. Reads are memory mapped and
+# only pull in the columns and players that are asked for. Needs pyarrow, which is only imported when a
+# connection has a snapshot directory
+
+snapshot_schema = [('appearance_id', 'int64'), ('mlbam_id', 'int64'), ('game_date', 'string'), ('score', 'int64'), ('score_per_unit', 'float64'), ('rest_days', 'int64')]
+
+def _snapshot_partition(snapshot_dir, scoring, role):
+    from urllib.parse import quote
+
+    return os.path.join(snapshot_dir, 'appearances', f"scoring={quote(scoring, safe='')}", f"role={role}")
+
+# bring the snapshot in line with the appearances table. A day's file is named after its last appearance_id
+# and row count, so a day that was (re)written in SQLite since gets a new file and everything else is left
+# alone. After an ingest only the days that were just written are checked (game_dates), otherwise the whole
+# table is. Returns the number of files written
+
+def sync_appearance_snapshots(conn, snapshot_dir = None, game_dates = None):
+    snapshot_dir = snapshot_dir or getattr(conn, 'snapshot_dir', None)
+    if snapshot_dir is None:
+        return 0
+
+    import pyarrow as pa
+
+    date_filter, params = '', []
+    if game_dates is not None:
+        game_dates = [_iso_date(game_date) for game_date in game_dates]
+        date_filter, params = f"WHERE game_date IN ({', '.join('?' * len(game_dates))})", game_dates
+
+    expected_files = {}
+    for scoring, role, game_date, last_appearance_id, rows in conn.execute(f'''SELECT scoring, role, game_date, MAX(appearance_id), COUNT(*) FROM appearances {date_filter}
+                                                                               GROUP BY scoring, role, game_date''', params):
+        partition = _snapshot_partition(snapshot_dir, scoring, role)
+        expected_files[os.path.join(partition, f"{game_date or 'undated'}.{last_appearance_id}.{rows}.arrow")] = (scoring, role, game_date)
+
+    existing_files = {os.path.join(directory, name) for directory, _, names in os.walk(os.path.join(snapshot_dir, 'appearances')) for name in names
+                      if name.endswith('.arrow') and (game_dates is None or name.split('.')[0] in game_dates)}
+    schema = pa.schema(snapshot_schema)
+    files_written = 0
+
+    for path, (scoring, role, game_date) in expected_files.items():
+        if path in existing_files:
+            continue
+
+        rows = conn.execute(f'''SELECT {', '.join(name for name, _ in snapshot_schema)} FROM appearances WHERE scoring = ? AND role = ? AND game_date IS ?
+                                ORDER BY appearance_id''', (scoring, role, game_date)).fetchall()
+        table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)], schema=schema)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with pa.OSFile(path + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+        os.replace(path + '.tmp', path)
+        files_written += 1
+
+    # the older files of days that were written again
+    for path in existing_files - set(expected_files):
+        os.remove(path)
+
+    if files_written and getattr(conn, 'metrics', None) is not None:
+        conn.metrics.add('snapshot_files_written', files_written)
+
+    return files_written
+
+# read some columns of a role's appearances out of the snapshot, optionally only for some players, as numpy
+# arrays in appearance order
+
+def load_snapshot_appearances(snapshot_dir, role, columns, player_ids = None, scoring = default_scoring):
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    partition = _snapshot_partition(snapshot_dir, scoring, role)
+    read_columns = list(dict.fromkeys(['appearance_id'] + list(columns)))
+
+    if os.path.isdir(partition):
+        dataset = ds.dataset(partition, format='ipc', filesystem=fs.LocalFileSystem(use_mmap=True))
+        table = dataset.to_table(columns=read_columns, filter=None if player_ids is None else ds.field('mlbam_id').isin(np.asarray(player_ids, dtype=np.int64)))
+    else:
+        table = pa.schema(snapshot_schema).empty_table().select(read_columns)
+
+    order = np.argsort(table.column('appearance_id').to_numpy(), kind='stable')
+
+    return {column: table.column(column).to_numpy(zero_copy_only=False)[order] for column in columns}
+
+# ------------- Ingestion ledger, catch-up and historical backfill ------------- #
+
+# turn MM/DD/YYYY or YYYY-MM-DD strings (or dates) into a date
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    if '/' in value:
+        return datetime.strptime(value, "%m/%d/%Y").date()
+    return date.fromisoformat(value)
+
+# the finished games on a day's schedule that haven't been ingested yet. A suspended game shows up again on
+# the day it is resumed and a postponed one keeps its game_pk when it is made up, so only games that were
+# played to the end count (the API calls postponed and cancelled games Final too, their codedGameState is
+# D or C) and game_pks that were already seen are skipped
+
+played_game_states = {'F', 'O'}
+
+def _game_was_played(game):
+    return game.get('status', {}).get('codedGameState') in played_game_states
+
+def _final_game_pks(schedule, seen_game_pks):
+    game_pks = [game['gamePk'] for schedule_day in schedule.get('dates', []) for game in schedule_day['games']
+                if _game_was_played(game) and game['gamePk'] not in seen_game_pks]
+
+    return list(dict.fromkeys(game_pks))
+
+# a day can't be recorded until every game on it is settled, a game that is still scheduled, delayed or being
+# played would never be ingested. Settled is played to the end (F, O), postponed or cancelled (D, C) or
+# suspended (T, U): a suspended game is finished under the same game_pk on the day it is resumed and ingested
+# there, so it doesn't hold its original day back
+
+settled_game_states = played_game_states | {'D', 'C', 'T', 'U'}
+
+def _day_in_progress(schedule):
+    return any(game.get('status', {}).get('codedGameState') not in settled_game_states for schedule_day in schedule.get('dates', []) for game in schedule_day['games'])
+
+# the finished games on every day of a chunk as (game_pks, games data) per day. Schedules are fetched
+# concurrently and then every game of the chunk is fetched in one batch. The list stops short at the first
+# day that still has a game to be played or finished
+
+def _fetch_backfill_chunk(client, days, seen_game_pks, fields = boxscore_fields):
+    with ThreadPoolExecutor(max_workers=min(client.max_workers, len(days))) as executor:
+        schedules = list(executor.map(lambda day: client.get_games_by_date(day.strftime("%m/%d/%Y")), days))
+
+    game_pks_by_day = []
+    for schedule in schedules:
+        if _day_in_progress(schedule):
+            break
+
+        game_pks = _final_game_pks(schedule, seen_game_pks)
+        seen_game_pks.update(game_pks)
+        game_pks_by_day.append(game_pks)
+
+    games_data = iter(client.get_games([game_pk for game_pks in game_pks_by_day for game_pk in game_pks], fields=fields))
+
+    return [(game_pks, [next(games_data) for _ in game_pks]) for game_pks in game_pks_by_day]
+
+# scoring runs in worker processes, so it has to be a top level function
+
+def _score_games(games_data, scoring_configs):
+    stat_lines = extract_stat_lines(games_data)
+
+    return stat_lines, score_for_scoring_configs(stat_lines, scoring_configs)
+
+# every ingested day and game is written to the ledger in the same transaction as its stat lines and
+# appearances, so a day is either completely in the database or not at all. Days without finished
+# games are recorded too but don't add a day of rest
+
+def _record_ingested_day(c, game_date, game_pks, stat_lines, scored_day, matchups = ()):
+    ingested_at = datetime.now().isoformat(timespec='seconds')
+
+    c.executemany("INSERT OR REPLACE INTO team_games VALUES (?, ?, ?, ?)", [(game_pk, game_date, team_id, opponent_id) for game_pk, team_id, opponent_id in matchups])
+    if game_pks:
+        _apply_scored_day(c, stat_lines, scored_day, game_date)
+
+    c.executemany("INSERT INTO ingested_games VALUES (?, ?, ?)", [(game_pk, game_date, ingested_at) for game_pk in game_pks])
+    c.execute("INSERT INTO ingested_days VALUES (?, ?, ?)", (game_date, len(game_pks), ingested_at))
+
+def _ingested_days(conn):
+    return {row[0] for row in conn.execute("SELECT game_date FROM ingested_days")}
+
+def _ingested_game_pks(conn):
+    return {row[0] for row in conn.execute("SELECT game_pk FROM ingested_games")}
+
+def _latest_ingested_day(conn):
+    return conn.execute("SELECT MAX(game_date) FROM ingested_days").fetchone()[0]
+
+# score every day in a list that isn't in the ledger yet with every point system, and write the stat lines
+# and the rest and score history for each day. Days are fetched a chunk at a time (the next chunk downloads
+# while the current one is processed) and a long range is scored in a process pool, but the updates are
+# always replayed one day at a time in date order so cur_days_rest stays correct. Returns the number of
+# games that were ingested
+#
+# a day from before the latest one in the ledger can't be applied on top of it, every player's rest has moved
+# on since. Those are refused unless rebuild is set (a backfill): then only the stat lines are stored and every
+# point system is re-scored from them in date order at the end. The point systems are marked as changed first,
+# so one that was interrupted is rebuilt the next time they are registered
+
+def ingest_days(conn, client, days, chunk_days = 7, max_workers = None, scoring_configs = default_scoring_configs, rebuild = False):
+    completed_dates = _ingested_days(conn)
+    days = sorted(day for day in {_parse_date(day) for day in days} if day.isoformat() not in completed_dates)
+    chunks = [days[i:i + chunk_days] for i in range(0, len(days), chunk_days)]
+
+    latest_date = _latest_ingested_day(conn)
+    out_of_order = bool(days) and latest_date is not None and days[0].isoformat() < latest_date
+    if out_of_order and not rebuild:
+        raise ValueError(f"{days[0].isoformat()} is before the latest ingested day {latest_date}, older days can only be added with a backfill")
+    if out_of_order:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO scoring_configs VALUES (?, NULL)", [(scoring,) for scoring in scoring_configs])
+    day_scoring_configs = {} if out_of_order else scoring_configs
+
+    seen_game_pks = _ingested_game_pks(conn)
+    games_ingested = 0
+    fields = scoring_fields(scoring_configs)
+
+    # a few days of catching up are scored in a background thread, it isn't worth starting processes for
+    scorers = ProcessPoolExecutor(max_workers=max_workers) if len(chunks) > 1 else ThreadPoolExecutor(max_workers=1)
+
+    # the days that were committed go into the snapshot, also when the ingest fails partway through
+    try:
+        with ThreadPoolExecutor(max_workers=1) as fetcher, scorers:
+            next_chunk = fetcher.submit(_fetch_backfill_chunk, client, chunks[0], seen_game_pks, fields) if chunks else None
+
+            for i, chunk in enumerate(chunks):
+                chunk_games = next_chunk.result()
+                if i + 1 < len(chunks):
+                    next_chunk = fetcher.submit(_fetch_backfill_chunk, client, chunks[i + 1], seen_game_pks, fields)
+
+                scored_days = [scorers.submit(_score_games, games_data, day_scoring_configs) if games_data else None for _, games_data in chunk_games]
+
+                for day, (game_pks, games_data), scored_day in zip(chunk, chunk_games, scored_days):
+                    stat_lines, scored = scored_day.result() if scored_day is not None else ([], {})
+
+                    with conn:
+                        _record_ingested_day(conn.cursor(), day.isoformat(), game_pks, stat_lines, scored, extract_matchups(game_pks, games_data))
+
+                    games_ingested += len(game_pks)
+
+                # the days are recorded in order, so nothing after a day with a game still going is either
+                if len(chunk_games) < len(chunk):
+                    print(f"Games on {chunk[len(chunk_games)].isoformat()} aren't all over yet, stopping the ingest before that day", file=sys.stderr)
+                    break
+    finally:
+        sync_appearance_snapshots(conn, game_dates=days)
+
+    if out_of_order:
+        register_scoring_configs(conn, scoring_configs)
+
+    return games_ingested
+
+# score every game between two dates (inclusive), an interrupted backfill picks up where it stopped. Days
+# from before the latest ingested one are fine here, the history is rebuilt around them
+
+def backfill(conn, client, start_date, end_date, chunk_days = 7, max_workers = None, scoring_configs = default_scoring_configs):
+    start_date, end_date = _parse_date(start_date), _parse_date(end_date)
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+    return ingest_days(conn, client, days, chunk_days, max_workers, scoring_configs, rebuild=True)
+
+# the days that still have to be ingested up to a date: every day after the latest one in the ledger,
+# or just that date for a new database. A job that missed a few nights catches up on all of them, a gap
+# before the latest day (from an ingest --date that skipped ahead) is left to a backfill
+
+def missing_days(conn, through_date):
+    through_date = _parse_date(through_date)
+    latest_date = _latest_ingested_day(conn)
+    if latest_date is None:
+        return [through_date]
+
+    completed_dates = _ingested_days(conn)
+    first_day = min(date.fromisoformat(latest_date) + timedelta(days=1), through_date)
+    days = [first_day + timedelta(days=offset) for offset in range((through_date - first_day).days + 1)]
+
+    return [day for day in days if day.isoformat() not in completed_dates]
+
+# ------------- Live in-game updates ------------- #
+
+# while games are in progress each one is polled for the JSON patches to its live feed since the last
+# timecode, instead of downloading the whole feed again. Only the patches that touch the boxscore, the
+# game status or the feed's timestamp are applied, to a copy of the feed that only holds those parts, and
+# only the players whose stat lines were patched are scored again. A poll costs about as much as the
+# plays since the previous one
+
+live_feed_paths = ('/liveData/boxscore', '/gameData/status', '/metaData')
+live_player_path = re.compile(r"^/liveData/boxscore/teams/(?:away|home)/players/ID(\d+)(?:/|$)")
+
+def _json_pointer_keys(path):
+    return [key.replace('~1', '/').replace('~0', '~') for key in path.split('/')[1:]]
+
+def _resolve_json_pointer(document, keys):
+    for key in keys:
+        if isinstance(document, list):
+            if not key.isdigit() or int(key) >= len(document):
+                return None
+            document = document[int(key)]
+        elif isinstance(document, dict) and key in document:
+            document = document[key]
+        else:
+            return None
+
+    return document
+
+# apply one JSON patch (RFC 6902) operation in place. Returns False, changing nothing, when the operation's
+# parent isn't in the document, which is how the parts of the feed that aren't kept are skipped
+
+def apply_patch_operation(document, operation):
+    keys = _json_pointer_keys(operation['path'])
+    if not keys:
+        return False
+
+    parent = _resolve_json_pointer(document, keys[:-1])
+    if not isinstance(parent, (dict, list)):
+        return False
+
+    op = operation['op']
+    if op in ('move', 'copy'):
+        from_keys = _json_pointer_keys(operation['from'])
+        value = _resolve_json_pointer(document, from_keys)
+        if value is None:
+            return False
+        if op == 'move':
+            apply_patch_operation(document, {'op': 'remove', 'path': operation['from']})
+        else:
+            value = copy.deepcopy(value)
+        op = 'add'
+    elif op in ('add', 'replace'):
+        value = operation['value']
+    elif op != 'remove':
+        return False
+
+    key = keys[-1]
+    if isinstance(parent, list):
+        index = len(parent) if key == '-' else int(key)
+        if op == 'add':
+            parent.insert(index, value)
+        elif index >= len(parent):
+            return False
+        elif op == 'replace':
+            parent[index] = value
+        else:
+            del parent[index]
+    elif op == 'remove':
+        parent.pop(key, None)
+    else:
+        parent[key] = value
+
+    return True
+
+# apply a diffPatch response ([{'diff': [operations]}, ...]) to a live feed. Returns the ids of the players
+# whose stat lines changed (None when a patch replaced a whole team's players) and how many operations applied
+
+def apply_feed_patches(feed, patch_groups):
+    changed_players = set()
+    rescore_all = False
+    operations_applied = 0
+
+    for patch_group in patch_groups:
+        for operation in patch_group.get('diff', []):
+            path = operation['path']
+            if not path.startswith(live_feed_paths) or not apply_patch_operation(feed, operation):
+                continue
+            operations_applied += 1
+
+            # a move changes the player it was taken from as well
+            from_match = live_player_path.match(operation['from']) if operation['op'] == 'move' else None
+            if from_match:
+                changed_players.add(int(from_match.group(1)))
+
+            player_match = live_player_path.match(path)
+            if player_match:
+                changed_players.add(int(player_match.group(1)))
+            elif any(players_path.startswith(path) for players_path in ('/liveData/boxscore/teams/away/players', '/liveData/boxscore/teams/home/players')):
+                rescore_all = True
+
+    return (None if rescore_all else changed_players), operations_applied
+
+# one game being watched: the kept parts of its live feed and the timecode they are current as of
+
+class LiveGame:
+
+    def __init__(self, game_pk):
+        self.game_pk = game_pk
+        self.feed = None
+        self.timecode = None
+
+    # bring the feed up to date. Returns the ids of the players whose stat lines changed (None for everyone)
+    # and the number of patch operations applied
+
+    def poll(self, client, fields):
+        if self.feed is None:
+            self.feed = client.get_game(self.game_pk, fields=fields)
+            changed_players, operations_applied = None, 0
+        else:
+            patches = client.get_game_diff_patch(self.game_pk, self.timecode)
+
+            # the API sends the whole feed instead when that is smaller than the patches
+            if isinstance(patches, dict):
+                self.feed = patches
+                changed_players, operations_applied = None, 0
+            else:
+                changed_players, operations_applied = apply_feed_patches(self.feed, patches)
+
+        self.timecode = self.feed.get('metaData', {}).get('timeStamp', self.timecode)
+
+        return changed_players, operations_applied
+
+    def is_final(self):
+        return self.feed is not None and _game_is_final(self.feed)
+
+    # the stat lines of some (or all) of the players, shaped like extract_stat_lines
+
+    def stat_lines(self, player_ids = None):
+        stat_lines = []
+
+        for team in ['away', 'home']:
+            players = self.feed['liveData']['boxscore']['teams'][team]['players']
+            player_infos = players.values() if player_ids is None else [players[f"ID{player_id}"] for player_id in player_ids if f"ID{player_id}" in players]
+            stat_lines.extend(_stat_line(player_info) for player_info in player_infos)
+
+        return stat_lines
+
+# follows every in-progress game of a day and keeps each player's live fantasy score for one point system
+
+class LiveGameWatcher:
+
+    def __init__(self, client, game_date, point_systems = default_scoring_configs[default_scoring], metrics = None):
+        self.client = client
+        self.game_date = _parse_date(game_date).strftime("%m/%d/%Y")
+        self.point_systems = point_systems
+        self.metrics = metrics
+        self.fields = scoring_fields({'live': point_systems}) + ['metaData', 'timeStamp', 'gamePk']
+        self.games = {}
+        self.scores = {role: {} for role in player_roles}
+
+    # poll every game that is live (or just finished since the last poll) concurrently, then rescore the
+    # changed players. Returns the number of players rescored and whether any game is still to come or live
+
+    def poll(self):
+        # the schedule changes as games start and end, so it never comes out of the response cache
+        schedule = self.client.get_games_by_date(self.game_date, use_cache=False)
+        games_left = False
+
+        for schedule_day in schedule.get('dates', []):
+            for game in schedule_day['games']:
+                state = game.get('status', {}).get('abstractGameState')
+                games_left |= state in ('Preview', 'Live')
+                if state in ('Live', 'Final') and game['gamePk'] not in self.games:
+                    self.games[game['gamePk']] = LiveGame(game['gamePk'])
+
+        polled_games = [live_game for live_game in self.games.values() if not live_game.is_final()]
+        if not polled_games:
+            return 0, games_left
+
+        with ThreadPoolExecutor(max_workers=min(self.client.max_workers, len(polled_games))) as executor:
+            results = list(executor.map(lambda live_game: live_game.poll(self.client, self.fields), polled_games))
+
+        # the changed players of every game are scored together in one batch
+        game_pks, stat_lines = [], []
+        for live_game, (changed_players, operations_applied) in zip(polled_games, results):
+            if changed_players is None or changed_players:
+                game_stat_lines = live_game.stat_lines(changed_players)
+                game_pks.extend([live_game.game_pk] * len(game_stat_lines))
+                stat_lines.extend(game_stat_lines)
+
+            if self.metrics is not None:
+                self.metrics.add('live_patch_operations', operations_applied)
+
+        if stat_lines:
+            self._rescore(game_pks, stat_lines)
+
+        if self.metrics is not None:
+            self.metrics.add('live_players_rescored', len(stat_lines))
+
+        return len(stat_lines), games_left
+
+    # score_stat_lines keeps the lines of everyone who got an out (or came to the plate) in order, the
+    # same filters line the scores back up with their games. Anyone else has no score in that role (yet)
+
+    def _rescore(self, game_pks, stat_lines):
+        pitcher_df, batter_df = score_stat_lines(stat_lines, self.point_systems['pitching'], self.point_systems['batting'])
+        scored_lines = {'pitcher': [line[4].get('outs', 0) > 0 for line in stat_lines], 'batter': [line[3].get('plateAppearances', 0) > 0 for line in stat_lines]}
+
+        for role, player_df in [('pitcher', pitcher_df), ('batter', batter_df)]:
+            score_col, score_per_unit_col = score_columns[role]
+            role_scores = self.scores[role]
+
+            for game_pk, line, scored in zip(game_pks, stat_lines, scored_lines[role]):
+                if not scored:
+                    role_scores.pop((game_pk, line[1]), None)
+
+            scored_game_pks = [game_pk for game_pk, scored in zip(game_pks, scored_lines[role]) if scored]
+            for game_pk, player_name, player_id, team_id, score, score_per_unit in zip(scored_game_pks, player_df['Player Name'], player_df['Player ID'].tolist(), player_df['Team ID'].tolist(),
+                                                                                      player_df[score_col].tolist(), player_df[score_per_unit_col].tolist()):
+                role_scores[(game_pk, player_id)] = (player_name, team_id, score, score_per_unit)
+
+    # today's best live fantasy scores for a role
+
+    def leaderboard(self, role, limit = 10):
+        import pandas as pd
+
+        leaderboard = pd.DataFrame([(player_id, player_name, team_id, game_pk, score, score_per_unit)
+                                    for (game_pk, player_id), (player_name, team_id, score, score_per_unit) in self.scores[role].items()],
+                                   columns=['mlbam_id', 'player_name', 'team_id', 'game_pk', 'live_score', score_per_unit_names[role]])
+
+        return leaderboard.sort_values(by=['live_score', 'mlbam_id'], ascending=[False, True]).head(limit)
+
+# poll the day's games every interval seconds and print the leaderboards whenever a score changed,
+# until every game is final (or for a number of polls)
+
+def watch(client, game_date, point_systems = default_scoring_configs[default_scoring], interval = 30, limit = 10, polls = None, metrics = None):
+    watcher = LiveGameWatcher(client, game_date, point_systems, metrics)
+    poll_count = 0
+
+    while polls is None or poll_count < polls:
+        players_rescored, games_left = watcher.poll()
+        poll_count += 1
+
+        if players_rescored:
+            print(f"\n{datetime.now().strftime('%H:%M:%S')} rescored {players_rescored} players")
+            _print_players(['Live Pitchers', 'Live Batters'], [watcher.leaderboard(role, limit) for role in player_roles])
+
+        if not games_left:
+            break
+        time.sleep(interval)
+
+    return watcher
+
+# ------------- Backtesting ranking strategies ------------- #
+
+# a backtest replays the stored appearances one game date at a time and checks which players a ranking
+# strategy would have picked going into each date, using only what the database knew the night before,
+# against the points those players actually scored that day.
+# The appearance log is folded once with the same running statistics the nightly run keeps, and each
+# statistic is laid out as a (game dates x players) matrix of its value going into every date. A strategy
+# is then a few array operations over the whole season at once, so sweeping strategies and parameters
+# only repeats the cheap part. Appearances migrated from the old list tables have no date and are left out
+
+def replay_season(conn, role, alpha = score_decay_alpha, scoring = default_scoring):
+    import numpy as np
+
+    snapshot_dir = getattr(conn, 'snapshot_dir', None)
+    if snapshot_dir is not None:
+        appearances = load_snapshot_appearances(snapshot_dir, role, ['mlbam_id', 'game_date', 'score', 'score_per_unit', 'rest_days'], scoring=scoring)
+        dated = np.flatnonzero(appearances['game_date'] != None)
+        dated = dated[np.argsort(appearances['game_date'][dated].astype(str), kind='stable')]
+        # rest_days comes back as floats, with NaN for first appearances, when any of them are missing
+        rest_days = [None if rest != rest else int(rest) for rest in appearances['rest_days'][dated].tolist()]
+        rows = list(zip(*(appearances[column][dated].tolist() for column in ['mlbam_id', 'game_date', 'score', 'score_per_unit']), rest_days))
+    else:
+        rows = conn.execute("SELECT mlbam_id, game_date, score, score_per_unit, rest_days FROM appearances WHERE scoring = ? AND role = ? AND game_date IS NOT NULL ORDER BY game_date, appearance_id",
+                            (scoring, role)).fetchall()
+    player_ids, game_dates, scores, scores_per_unit, rest_days = zip(*rows) if rows else ((), (), (), (), ())
+
+    game_dates = np.array(game_dates, dtype=str)
+    unique_dates, day_index = np.unique(game_dates, return_inverse=True)
+    unique_players, player_index = np.unique(np.array(player_ids, dtype=np.int64), return_inverse=True)
+    days, players = len(unique_dates), len(unique_players)
+
+    # every player's running statistics right after each of their appearances
+
+    folded = np.empty((len(rows), 6))
+    all_stats = {}
+    for i, (player, score_per_unit, rest) in enumerate(zip(player_index.tolist(), scores_per_unit, rest_days)):
+        stats = all_stats.get(player)
+        if stats is None:
+            stats = all_stats[player] = new_running_statistics()
+        update_running_statistics(stats, score_per_unit, rest, alpha)
+        folded[i] = (stats['score_count'], stats['score_mean'], stats['score_m2'], stats['score_ewm_mean'], stats['score_ewm_var'],
+                     np.nan if stats['median_rest'] is None else stats['median_rest'])
+
+    season = {'role': role, 'game_dates': unique_dates, 'player_ids': unique_players, 'appearance_day': day_index, 'appearance_player': player_index,
+              'appearance_score': np.array(scores, dtype=np.float64), 'appearance_score_per_unit': np.array(scores_per_unit, dtype=np.float64)}
+
+    # a doubleheader gives a player two appearances on a date, only the later one is what the next day sees
+
+    appearance_key = day_index * players + player_index
+    season['last_of_day'] = len(rows) - 1 - np.unique(appearance_key[::-1], return_index=True)[1]
+
+    score_count, score_mean, score_m2, score_ewm_mean, score_ewm_var, median_rest = (season_as_of(season, column) for column in folded.T)
+    season.update(score_count=np.nan_to_num(score_count), score_mean=score_mean, score_std=np.sqrt(score_m2 / score_count),
+                  score_ewm_mean=score_ewm_mean, score_ewm_std=np.sqrt(score_ewm_var), median_rest=median_rest)
+
+    # days of rest going into a date count the game dates since the player's last appearance, the same way
+    # cur_days_rest does, and a player is likely to play once that reaches their median rest
+
+    last_day = season_as_of(season, day_index.astype(np.float64))
+    season['cur_days_rest'] = np.arange(days)[:, None] - 1 - last_day
+    season['likely_to_play'] = season['cur_days_rest'] >= median_rest
+
+    # what actually happened: the points a player scored on each date (0 if they didn't play)
+
+    season['points'] = np.zeros((days, players))
+    np.add.at(season['points'], (day_index, player_index), season['appearance_score'])
+    season['played'] = np.zeros((days, players), dtype=bool)
+    season['played'][day_index, player_index] = True
+
+    return season
+
+# lay a value recorded after every appearance out as a (game dates x players) matrix holding, for each date,
+# the value after the player's last appearance before it (NaN before their first one)
+
+def season_as_of(season, appearance_values):
+    import numpy as np
+
+    days, players = len(season['game_dates']), len(season['player_ids'])
+    last_of_day = season['last_of_day']
+
+    matrix = np.full((days + 1, players), np.nan)
+    matrix[season['appearance_day'][last_of_day] + 1, season['appearance_player'][last_of_day]] = np.asarray(appearance_values, dtype=np.float64)[last_of_day]
+
+    # forward fill down the dates by carrying the row index of the latest recorded value
+    recorded_rows = np.where(np.isnan(matrix), 0, np.arange(days + 1)[:, None])
+    np.maximum.accumulate(recorded_rows, axis=0, out=recorded_rows)
+
+    return matrix[recorded_rows, np.arange(players)][:-1]
+
+# ranking strategies take a replayed season (plus their own parameters) and return a (game dates x players)
+# matrix where higher is better. Only players who are likely to play get picked, whatever the strategy says
+
+def sharpe_strategy(season):
+    return calculate_fantasy_sharpe_ratio(season['score_mean'], season['score_std'])
+
+def decayed_sharpe_strategy(season):
+    return calculate_fantasy_sharpe_ratio(season['score_ewm_mean'], season['score_ewm_std'])
+
+def mean_strategy(season):
+    return season['score_mean']
+
+def decayed_mean_strategy(season):
+    return season['score_ewm_mean']
+
+# the q quantile of every points total the player has put up so far
+
+def upside_quantile_strategy(season, q = 0.9):
+    import pandas as pd
+
+    scores = pd.Series(season['appearance_score'])
+    quantiles = scores.groupby(season['appearance_player']).expanding().quantile(q).reset_index(level=0, drop=True).sort_index()
+
+    return season_as_of(season, quantiles.to_numpy())
+
+# the share of the player's appearances so far that scored at least the threshold
+
+def boom_probability_strategy(season, threshold = 10):
+    import pandas as pd
+
+    booms = pd.Series(season['appearance_score'] >= threshold, dtype=float).groupby(season['appearance_player'])
+    boom_rate = booms.cumsum() / booms.cumcount().add(1)
+
+    return season_as_of(season, boom_rate.to_numpy())
+
+backtest_strategies = {
+    'sharpe': sharpe_strategy,
+    'decayed_sharpe': decayed_sharpe_strategy,
+    'mean': mean_strategy,
+    'decayed_mean': decayed_mean_strategy,
+    'upside_quantile': upside_quantile_strategy,
+    'boom_probability': boom_probability_strategy,
+}
+
+default_backtest_strategies = ['sharpe', 'decayed_sharpe', 'mean', 'decayed_mean', 'upside_quantile:q=0.9', 'boom_probability:threshold=10']
+
+# strategies are given as "name" or "name:param=value,param=value", e.g. "upside_quantile:q=0.75"
+
+def parse_strategy(spec):
+    name, _, param_string = spec.partition(':')
+    if name not in backtest_strategies:
+        raise ValueError(f"Unknown ranking strategy {name!r}, expected one of {', '.join(backtest_strategies)}")
+
+    params = {}
+    for param in filter(None, param_string.split(',')):
+        key, _, value = param.partition('=')
+        params[key.strip()] = float(value)
+
+    return name, params
+
+# pick each strategy's top_n likely players on every game date between start_date and end_date and score
+# the picks on what they actually did. Every strategy is measured against the average likely player
+# (what a random pick from the same pool would have scored)
+
+def evaluate_strategies(season, strategies = default_backtest_strategies, top_n = 5, start_date = None, end_date = None):
+    import numpy as np
+    import pandas as pd
+
+    game_dates = season['game_dates']
+    selected_days = np.ones(len(game_dates), dtype=bool)
+    if start_date is not None:
+        selected_days &= game_dates >= _parse_date(start_date).isoformat()
+    if end_date is not None:
+        selected_days &= game_dates <= _parse_date(end_date).isoformat()
+
+    likely_to_play = season['likely_to_play'][selected_days]
+    points = season['points'][selected_days]
+    played = season['played'][selected_days]
+    candidate_points_per_pick = points[likely_to_play].mean() if likely_to_play.any() else np.nan
+
+    results = []
+    for spec in strategies:
+        name, params = parse_strategy(spec) if isinstance(spec, str) else spec
+        strategy = backtest_strategies[name] if isinstance(name, str) else name
+        label = name if isinstance(name, str) else name.__name__
+        if params:
+            label += ':' + ','.join(f'{key}={value:g}' for key, value in params.items())
+
+        rankings = np.asarray(strategy(season, **params), dtype=np.float64)[selected_days]
+        rankings = np.where(likely_to_play & ~np.isnan(rankings), rankings, -np.inf)
+
+        # ties go to the lower mlbam_id, the same on every run
+        picks = np.argsort(-rankings, axis=1, kind='stable')[:, :top_n]
+        picked = np.take_along_axis(rankings, picks, axis=1) > -np.inf
+        pick_points = np.take_along_axis(points, picks, axis=1)[picked]
+
+        results.append({
+            'role': season['role'],
+            'strategy': label,
+            'game_dates': int(picked.any(axis=1).sum()),
+            'picks': int(picked.sum()),
+            'points_per_pick': pick_points.mean() if len(pick_points) else np.nan,
+            'play_rate': np.take_along_axis(played, picks, axis=1)[picked].mean() if len(pick_points) else np.nan,
+            'points_per_game_date': pick_points.sum() / max(int(picked.any(axis=1).sum()), 1),
+            'candidate_points_per_pick': candidate_points_per_pick,
+        })
+
+    results = pd.DataFrame(results)
+    results['lift'] = results['points_per_pick'] - results['candidate_points_per_pick']
+
+    return results
+
+# replay each role once and evaluate every strategy on it, best strategies first
+
+def backtest(conn, strategies = default_backtest_strategies, roles = player_roles, top_n = 5, start_date = None, end_date = None, alpha = score_decay_alpha,
+             scoring = default_scoring):
+    import pandas as pd
+
+    results = [evaluate_strategies(replay_season(conn, role, alpha, scoring), strategies, top_n, start_date, end_date) for role in roles]
+
+    return pd.concat(results, ignore_index=True).sort_values(by=['role', 'points_per_pick'], ascending=[True, False], ignore_index=True)
+
+# ----- Main calling functions to run the code ----- #
+
+# everything the pipeline needs to know about where it runs comes from the environment (or the command line)
+
+default_db_path = os.environ.get('WAIVER_WIRE_DB', 'player_rest_and_scoring.db')
+default_cache_path = os.environ.get('WAIVER_WIRE_CACHE', 'http_cache.db')
+default_metrics_path = os.environ.get('WAIVER_WIRE_METRICS', 'pipeline_metrics.jsonl')
+default_leagues_path = os.environ.get('WAIVER_WIRE_LEAGUES', 'leagues.json')
+default_snapshot_dir = os.environ.get('WAIVER_WIRE_SNAPSHOTS')
+
+# initialize the instance of your ESPN fantasy league
+
+def get_league(league_id = None, year = None, espn_s2 = None, swid = None):
+    from espn_api.baseball import League
+
+    return League(league_id=int(league_id or os.environ['ESPN_LEAGUE_ID']), year=int(year or os.environ.get('ESPN_YEAR', date.today().year)),
+                  espn_s2=espn_s2 or os.environ.get('ESPN_S2'), swid=swid or os.environ.get('ESPN_SWID'))
+
+# the leagues to report on and their point systems, from a JSON file like
+#   {"scoring": {"points": {"pitching": {"outs": 1, ...}, "batting": {"homeRuns": 10, ...}}},
+#    "leagues": [{"name": "office", "league_id": 1234, "year": 2024, "espn_s2": "...", "swid": "...", "scoring": "points", "receiver_email": "...",
+#                 "recipients": [{"email": "...", "team_id": 3}, ...]}]}
+# A point system that leaves out pitching or batting uses the default one for it, and a league without a
+# scoring uses the default point system. Without the file there is one league, set up from the environment
+
+def load_leagues(path = default_leagues_path):
+    scoring_configs = dict(default_scoring_configs)
+    if not os.path.exists(path):
+        return scoring_configs, [{'name': default_scoring, 'scoring': default_scoring}]
+
+    with open(path) as f:
+        config = json.load(f)
+
+    for scoring, point_systems in config.get('scoring', {}).items():
+        scoring_configs[scoring] = {'pitching': point_systems.get('pitching', pitching_point_system), 'batting': point_systems.get('batting', batting_point_system)}
+
+    leagues = []
+    for league in config.get('leagues') or [{'name': default_scoring}]:
+        league = {'scoring': default_scoring, **league}
+        league.setdefault('name', str(league.get('league_id')))
+        if league['scoring'] not in scoring_configs:
+            raise ValueError(f"League {league['name']!r} uses an unknown scoring {league['scoring']!r}, expected one of {', '.join(scoring_configs)}")
+        leagues.append(league)
+
+    return scoring_configs, leagues
+
+def _league_id(league):
+    return int(league['league_id'] if league.get('league_id') is not None else os.environ['ESPN_LEAGUE_ID'])
+
+def open_league(league):
+    return get_league(league.get('league_id'), league.get('year'), league.get('espn_s2'), league.get('swid'))
+
+def select_leagues(leagues, name = None):
+    if name is None:
+        return leagues
+
+    selected = [league for league in leagues if league['name'] == name]
+    if not selected:
+        raise ValueError(f"Unknown league {name!r}, expected one of {', '.join(league['name'] for league in leagues)}")
+    return selected
+
+def _stage(metrics, name):
+    return metrics.stage(name) if metrics is not None else nullcontext()
+
+# grab a day's games (normally yesterday), perform the calculations and write them to the database.
+# The games are fetched and their stat lines stored once, then scored with every point system. A day
+# that is already in the ledger is skipped, as is any game that was already ingested on another day, and
+# a day from before the latest one in the ledger is refused (see ingest_days). Returns the number of games
+# that were ingested
+
+def ingest_day(conn, client, game_date, metrics = None, scoring_configs = default_scoring_configs):
+    game_date = _iso_date(game_date)
+    if game_date in _ingested_days(conn):
+        return 0
+
+    latest_date = _latest_ingested_day(conn)
+    if latest_date is not None and game_date < latest_date:
+        raise ValueError(f"{game_date} is before the latest ingested day {latest_date}, older days can only be added with a backfill")
+
+    with _stage(metrics, 'get_days_previous_games'):
+        schedule = client.get_games_by_date(_parse_date(game_date).strftime("%m/%d/%Y"))
+        if _day_in_progress(schedule):
+            print(f"Games on {game_date} aren't all over yet, not ingesting the day yet", file=sys.stderr)
+            return 0
+        game_pks = _final_game_pks(schedule, _ingested_game_pks(conn))
+
+    with _stage(metrics, 'calculate_player_scoring'):
+        games_data = client.get_games(game_pks, fields=scoring_fields(scoring_configs))
+        stat_lines = extract_stat_lines(games_data)
+        scored_day = score_for_scoring_configs(stat_lines, scoring_configs)
+    with _stage(metrics, 'update_player_data'):
+        with conn:
+            _record_ingested_day(conn.cursor(), game_date, game_pks, stat_lines, scored_day, extract_matchups(game_pks, games_data))
+        sync_appearance_snapshots(conn, game_dates=[game_date])
+
+    return len(game_pks)
+
+# ingest every day the ledger is missing up to a date (normally yesterday). That is one day on a normal
+# night, after missed nights the missing days are fetched concurrently and applied in order
+
+def catch_up(conn, client, through_date, metrics = None, scoring_configs = default_scoring_configs):
+    days = missing_days(conn, through_date)
+    if len(days) <= 1:
+        return sum(ingest_day(conn, client, day, metrics, scoring_configs) for day in days)
+
+    with _stage(metrics, 'catch_up'):
+        return ingest_days(conn, client, days, scoring_configs=scoring_configs)
+
+# the players most likely to play ranked by Sharpe ratio, plus the recap of the best performers.
+# Only reads the database
+
+def rank_players(conn, metrics = None, projection_seed = None, scoring = default_scoring):
+    with _stage(metrics, 'predict_players'):
+        probable_pitchers, probable_batters = predict_players(conn, projection_seed=projection_seed, scoring=scoring)
+    with _stage(metrics, 'get_top_players'):
+        top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b = get_top_players(conn, scoring)
+
+    return probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b
+
+# narrow the rankings down to the free agents in the league whose teams play on the report date
+
+def filter_available_players(conn, client, league, report_date, ranked_players, metrics = None, free_agents = None, scoring = default_scoring):
+    with _stage(metrics, 'join_with_waiver_players'):
+        prob_pitchers_available, prob_batters_available, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available = join_with_waiver_players(league, *ranked_players, conn, free_agents)
+    with _stage(metrics, 'join_with_todays_games'):
+        prob_pitchers_today, prob_batters_today = join_with_todays_games(client, report_date, prob_pitchers_available, prob_batters_available, conn, scoring)
+
+    return prob_pitchers_today, prob_batters_today, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available
+
+# rank, filter and send out the email for the report date
+
+def send_report(conn, client, league, report_date, metrics = None, projection_seed = None, scoring = default_scoring, sink = None):
+    available_players = filter_available_players(conn, client, league, report_date, rank_players(conn, metrics, projection_seed, scoring), metrics, scoring=scoring)
+
+    with _stage(metrics, 'send_email'):
+        send_email(report_date, *available_players, sink=sink)
+
+    return available_players
+
+# the report for every recipient of every league (configured as in load_leagues). Players are ranked once
+# per point system and the free agents (and rosters) of every league are fetched concurrently. All of the
+# messages are rendered in one batch and sent over one SMTP connection, or into the sink that is passed.
+# Returns the available players by league name
+
+def send_reports(conn, client, leagues, report_date, metrics = None, projection_seed = None, max_workers = 8, sink = None):
+    rankings = {scoring: rank_players(conn, metrics, projection_seed, scoring) for scoring in dict.fromkeys(league['scoring'] for league in leagues)}
+
+    with _stage(metrics, 'get_free_agents'):
+        free_agents = get_league_free_agents(conn, leagues, max_workers=max_workers)
+
+    reported_leagues = [league for league in leagues if league['name'] in free_agents]
+    available_players = {league['name']: filter_available_players(conn, client, None, report_date, rankings[league['scoring']], metrics, free_agents[league['name']], league['scoring'])
+                         for league in reported_leagues}
+
+    with _stage(metrics, 'get_rosters'):
+        rosters = get_league_rosters(reported_leagues, max_workers, metrics)
+
+    sink = sink or SMTPSink()
+    default_receiver_email = os.environ.get("WAIVER_WIRE_RECEIVER_EMAIL", sink.sender_email)
+
+    reports = []
+    for league in reported_leagues:
+        for recipient in league_recipients(league):
+            report = {'league_name': league['name'] if len(leagues) > 1 else None, 'recipient': recipient.get('email') or default_receiver_email,
+                      'players': available_players[league['name']]}
+
+            team = rosters.get(league['name'], {}).get(recipient.get('team_id'))
+            if team is not None:
+                report.update(team_name=team[0], roster=roster_players(rankings[league['scoring']][:2], team[1]))
+            reports.append(report)
+
+    with _stage(metrics, 'render_reports'):
+        messages = render_reports(report_date, reports, sink.sender_email)
+    with _stage(metrics, 'send_email'):
+        deliver_messages(messages, sink, metrics)
+
+    return available_players
+
+# the nightly crontab job: ingest yesterday's games once (and any earlier days a missed run left out),
+# then send today's report for every league
+
+def run_pipeline(conn, client, leagues, run_date = None, metrics = None, projection_seed = None, scoring_configs = default_scoring_configs, sink = None):
+    run_date = run_date or date.today()
+    yesterday = (run_date - timedelta(days=1)).strftime("%m/%d/%Y")
+
+    games = catch_up(conn, client, yesterday, metrics, scoring_configs)
+    send_reports(conn, client, leagues, run_date.strftime("%m/%d/%Y"), metrics, projection_seed, sink=sink)
+
+    return games
+
+def _print_players(titles, player_frames):
+    for title, players in zip(titles, player_frames):
+        print(f"\n{title}:\n{players.to_string(index=False)}")
+
+report_titles = ['Probable Pitchers', 'Probable Batters', 'Top Pitchers by Score per Inning', 'Top Pitchers by Last Score',
+                 'Top Batters by Score per Plate Appearance', 'Top Batters by Last Score']
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="waiver_wire_winner", description="Automated ESPN Fantasy Baseball Assistant Manager")
+    parser.add_argument("--db", default=default_db_path, help="SQLite database with the rest and scoring history")
+    parser.add_argument("--cache", default=default_cache_path, help="on-disk cache of MLB Stats API responses")
+    parser.add_argument("--offline", action="store_true", help="serve every MLB Stats API request from the cache")
+    parser.add_argument("--metrics", default=default_metrics_path, help="JSON lines file the run's metrics are appended to")
+    parser.add_argument("--profile", help="dump a cProfile of the run to this path")
+    parser.add_argument("--seed", type=int, help="seed for the bootstrap projections, so a ranking can be reproduced")
+    parser.add_argument("--leagues", default=default_leagues_path, help="JSON file with the leagues and their point systems")
+    parser.add_argument("--outbox", help="write the report emails to .eml files in this directory instead of sending them")
+    parser.add_argument("--snapshots", default=default_snapshot_dir, help="directory for a columnar (Arrow) snapshot of the appearances that rankings and backtests read from")
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("run", help="ingest yesterday's games and send today's report (the default)")
+
+    ingest_parser = subparsers.add_parser("ingest", help="score a day's games into the database")
+    ingest_parser.add_argument("--date", help="MM/DD/YYYY, defaults to every day missing up to yesterday")
+
+    rank_parser = subparsers.add_parser("rank", help="print the ranked players")
+    rank_parser.add_argument("--from-db", action="store_true", help="only rank from the database, no ESPN or schedule lookups")
+    rank_parser.add_argument("--date", help="MM/DD/YYYY report date, defaults to today")
+    rank_parser.add_argument("--league", help="league name, defaults to the first one")
+
+    report_parser = subparsers.add_parser("report", help="rank the players and send the email")
+    report_parser.add_argument("--date", help="MM/DD/YYYY report date, defaults to today")
+    report_parser.add_argument("--league", help="only report on this league")
+
+    backfill_parser = subparsers.add_parser("backfill", help="score every game in a date range")
+    backfill_parser.add_argument("start_date")
+    backfill_parser.add_argument("end_date")
+
+    free_agents_parser = subparsers.add_parser("free-agents", help="show the league's free agent pool and who was dropped since the previous snapshot")
+    free_agents_parser.add_argument("--refresh", action="store_true", help="fetch from ESPN even if today's snapshot is still fresh")
+    free_agents_parser.add_argument("--league", help="league name, defaults to the first one")
+
+    watch_parser = subparsers.add_parser("watch", help="follow the day's games live and print the best fantasy scores as they change")
+    watch_parser.add_argument("--date", help="MM/DD/YYYY, defaults to today")
+    watch_parser.add_argument("--league", help="league whose point system is used, defaults to the first one")
+    watch_parser.add_argument("--interval", type=float, default=30, help="seconds between polls")
+    watch_parser.add_argument("--limit", type=int, default=10, help="players shown per leaderboard")
+    watch_parser.add_argument("--polls", type=int, help="stop after this many polls, defaults to when every game is final")
+
+    backtest_parser = subparsers.add_parser("backtest", help="replay the stored season and score ranking strategies on what their picks did")
+    backtest_parser.add_argument("--strategy", action="append", dest="strategies", help="name or name:param=value,... (repeatable), defaults to "
+                                 + ", ".join(default_backtest_strategies))
+    backtest_parser.add_argument("--role", choices=player_roles, action="append", dest="roles", help="defaults to both")
+    backtest_parser.add_argument("--top-n", type=int, default=5, help="players picked per game date")
+    backtest_parser.add_argument("--start", help="first game date to evaluate (earlier dates still build up the history)")
+    backtest_parser.add_argument("--end", help="last game date to evaluate")
+    backtest_parser.add_argument("--alpha", type=float, default=score_decay_alpha, help="weight of the newest appearance in the decayed statistics")
+    backtest_parser.add_argument("--scoring", default=default_scoring, help="point system to replay")
+
+    return parser
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    command = args.command or "run"
+
+    metrics = PipelineMetrics()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    conn = connect_database(args.db, metrics, args.snapshots)
+    build_database(conn)
+
+    scoring_configs, leagues = load_leagues(args.leagues)
+    register_scoring_configs(conn, scoring_configs)
+
+    sink = LocalSink(args.outbox) if args.outbox else None
+
+    def make_client():
+        return MLBStatsAPIClient(cache=ResponseCache(args.cache), offline=args.offline, metrics=metrics)
+
+    today = date.today().strftime("%m/%d/%Y")
+    run_info = {'command': command}
+
+    try:
+        if command == "run":
+            run_info.update(leagues=len(leagues), games=run_pipeline(conn, make_client(), leagues, metrics=metrics, projection_seed=args.seed, scoring_configs=scoring_configs, sink=sink))
+
+        elif command == "ingest":
+            if args.date:
+                run_info.update(game_date=args.date, games=ingest_day(conn, make_client(), args.date, metrics, scoring_configs))
+            else:
+                yesterday = (date.today() - timedelta(days=1)).strftime("%m/%d/%Y")
+                run_info.update(game_date=yesterday, games=catch_up(conn, make_client(), yesterday, metrics, scoring_configs))
+
+        elif command == "rank":
+            league = select_leagues(leagues, args.league)[0]
+            ranked_players = rank_players(conn, metrics, args.seed, league['scoring'])
+            if not args.from_db:
+                with metrics.stage('get_free_agents'):
+                    free_agents = get_league_free_agents(conn, [league])
+                if league['name'] not in free_agents:
+                    raise RuntimeError(f"No free agents available for {league['name']}")
+                ranked_players = filter_available_players(conn, make_client(), None, args.date or today, ranked_players, metrics, free_agents[league['name']],
+                                                          league['scoring'])
+            _print_players(report_titles, ranked_players)
+
+        elif command == "report":
+            selected_leagues = select_leagues(leagues, args.league)
+            run_info['leagues'] = len(send_reports(conn, make_client(), selected_leagues, args.date or today, metrics, args.seed, sink=sink))
+
+        elif command == "backfill":
+            with metrics.stage('backfill'):
+                games_backfilled = backfill(conn, make_client(), args.start_date, args.end_date, scoring_configs=scoring_configs)
+            run_info.update(start_date=args.start_date, end_date=args.end_date, games=games_backfilled)
+            print(f"Backfilled {games_backfilled} games from {args.start_date} to {args.end_date}")
+
+        elif command == "free-agents":
+            league = select_leagues(leagues, args.league)[0]
+            with metrics.stage('get_free_agents'):
+                free_agents = get_league_free_agents(conn, [league], ttl=0 if args.refresh else default_free_agent_ttl).get(league['name'], [])
+            newly_dropped, picked_up = free_agent_changes(conn, _league_id(league))
+            run_info.update(free_agents=len(free_agents), newly_dropped=len(newly_dropped), picked_up=len(picked_up))
+
+            print(f"{len(free_agents)} free agents")
+            print(f"\nNewly dropped ({len(newly_dropped)}):\n" + "\n".join(name for _, name in newly_dropped))
+            print(f"\nPicked up ({len(picked_up)}):\n" + "\n".join(name for _, name in picked_up))
+
+        elif command == "watch":
+            league = select_leagues(leagues, args.league)[0]
+            watcher = watch(make_client(), args.date or today, scoring_configs[league['scoring']], args.interval, args.limit, args.polls, metrics)
+            run_info.update(game_date=args.date or today, games=len(watcher.games))
+
+        elif command == "backtest":
+            with metrics.stage('backtest'):
+                results = backtest(conn, args.strategies or default_backtest_strategies, args.roles or player_roles, args.top_n, args.start, args.end, args.alpha, args.scoring)
+            run_info.update(strategies=len(results), top_n=args.top_n)
+            print(results.to_string(index=False))
+
+    finally:
+        conn.close()
 
-# get the most likely players to player and send out the email
-prob_pitchers_available, prob_batters_available, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available = join_with_waiver_players(league, probable_pitchers, probable_batters, top_score_per_inn_p, top_score_p, top_score_per_pa_b, top_score_b)
-prob_pitchers_today, prob_batters_today = join_with_todays_games(client, today, prob_pitchers_available, prob_batters_available)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
 
-send_email(today, prob_pitchers_today, prob_batters_today, top_score_per_inn_p_available, top_score_p_available, top_score_per_pa_b_available, top_score_b_available)
+    metrics.write_jsonl(args.metrics, **run_info)
 
-conn.close()
+if __name__ == "__main__":
+    main()